@@ -1,29 +1,38 @@
 from typing import Annotated
 from uuid import UUID
 
-from fastapi import BackgroundTasks, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import BackgroundTasks, Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from app.core.exceptions import ClientNotAuthorized
-from app.core.security import oauth2_scheme_seller, oauth2_scheme_partner
-from app.database.models import DeliveryPartner, Seller
-from app.database.redis import is_jti_blacklisted
-from app.database.session import get_session
+from app.core.rate_limit import rate_limiter
+from app.core.security import (
+    Principal,
+    oauth2_scheme_seller,
+    oauth2_scheme_partner,
+    verify_access_token,
+)
+from app.database.session import get_read_session, get_session, get_session_factory
 from app.services.deliver_partner import DeliveryPartnerService
 from app.services.seller import SellerService
 from app.services.shipment import ShipmentService
 from app.services.shipment_event import ShipmentEventService
-from app.utils import decode_access_token
-
+from app.services.webhook import WebhookService
 
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
+# Read-only endpoints, a replica when configured
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
+# Streamed responses open their own session
+SessionFactoryDep = Annotated[
+    async_sessionmaker[AsyncSession], Depends(get_session_factory)
+]
 
 
 # Access token data dep
 async def _get_access_token(token: str) -> dict:
-    data = decode_access_token(token)
+    data = await verify_access_token(token)
 
-    if data is None or await is_jti_blacklisted(data["jti"]):
+    if data is None:
         raise ClientNotAuthorized
 
     return data
@@ -43,30 +52,6 @@ async def get_delivery_partner_access_token(
     return await _get_access_token(token)
 
 
-# Logged In Seller
-async def get_current_seller(
-    token_data: Annotated[dict, Depends(get_seller_access_token)],
-    session: SessionDep,
-):
-    seller = await session.get(Seller, UUID(token_data["user"]["id"]))
-
-    if seller is None:
-        raise ClientNotAuthorized
-    return seller
-
-
-# Logged In Seller
-async def get_current_partner(
-    token_data: Annotated[dict, Depends(get_delivery_partner_access_token)],
-    session: SessionDep,
-):
-    partner = await session.get(DeliveryPartner, UUID(token_data["user"]["id"]))
-
-    if partner is None:
-        raise ClientNotAuthorized
-    return partner
-
-
 # Shipment service dep
 def get_shipment_service(session: SessionDep):
     return ShipmentService(
@@ -84,11 +69,67 @@ def get_delivery_partner_service(session: SessionDep):
     return DeliveryPartnerService(session)
 
 
-SellerDep = Annotated[Seller, Depends(get_current_seller)]
-DeliveryPartnerDep = Annotated[DeliveryPartner, Depends(get_current_partner)]
+# Webhook service dep
+def get_webhook_service(session: SessionDep):
+    return WebhookService(session)
+
+
+# Services of read-only endpoints
+def get_read_shipment_service(session: ReadSessionDep):
+    return get_shipment_service(session)
+
+
+def get_read_seller_service(session: ReadSessionDep):
+    return SellerService(session)
+
+
+def get_read_delivery_partner_service(session: ReadSessionDep):
+    return DeliveryPartnerService(session)
+
+
+def get_read_webhook_service(session: ReadSessionDep):
+    return WebhookService(session)
+
+
 ShipmentServiceDep = Annotated[ShipmentService, Depends(get_shipment_service)]
 SellerServiceDep = Annotated[SellerService, Depends(get_seller_service)]
 
 DeliveryPartnerServiceDep = Annotated[
     DeliveryPartnerService, Depends(get_delivery_partner_service)
 ]
+
+WebhookServiceDep = Annotated[WebhookService, Depends(get_webhook_service)]
+
+ReadShipmentServiceDep = Annotated[ShipmentService, Depends(get_read_shipment_service)]
+ReadSellerServiceDep = Annotated[SellerService, Depends(get_read_seller_service)]
+ReadDeliveryPartnerServiceDep = Annotated[
+    DeliveryPartnerService, Depends(get_read_delivery_partner_service)
+]
+ReadWebhookServiceDep = Annotated[WebhookService, Depends(get_read_webhook_service)]
+
+
+# Logged In Seller, rate limited per seller
+async def get_current_seller(
+    request: Request,
+    token_data: Annotated[dict, Depends(get_seller_access_token)],
+    service: SellerServiceDep,
+) -> Principal:
+    principal = await service.get_principal(UUID(token_data["user"]["id"]))
+    await rate_limiter.check(request, f"seller:{principal.id}")
+    return principal
+
+
+# Logged In Delivery Partner, rate limited per partner
+async def get_current_partner(
+    request: Request,
+    token_data: Annotated[dict, Depends(get_delivery_partner_access_token)],
+    service: DeliveryPartnerServiceDep,
+) -> Principal:
+    principal = await service.get_principal(UUID(token_data["user"]["id"]))
+    await rate_limiter.check(request, f"partner:{principal.id}")
+    return principal
+
+
+# Routes that need the full entity load it through the service
+SellerDep = Annotated[Principal, Depends(get_current_seller)]
+DeliveryPartnerDep = Annotated[Principal, Depends(get_current_partner)]
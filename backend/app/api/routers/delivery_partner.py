@@ -1,20 +1,24 @@
-from math import ceil
 from typing import Annotated, Literal
 from uuid import UUID
 from fastapi import APIRouter, Depends, Form, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
 from pydantic import EmailStr
-from sqlmodel import asc, desc, select
 
-from app.api.schemas.pagination import PaginationParams, get_pagination_params
+from app.api.schemas.pagination import (
+    PaginationParams,
+    ShipmentFilterParams,
+    get_pagination_params,
+    get_shipment_filter_params,
+)
 from app.api.schemas.shipment import ShipmentRead
 from app.config import app_settings
 
 from app.api.dependencies import (
     DeliveryPartnerDep,
     DeliveryPartnerServiceDep,
-    SessionDep,
+    ReadDeliveryPartnerServiceDep,
+    ReadShipmentServiceDep,
     get_delivery_partner_access_token,
 )
 from app.api.schemas.delivery_partner import (
@@ -25,8 +29,9 @@ from app.api.schemas.delivery_partner import (
 )
 from app.api.tag import APITag
 from app.core.exceptions import EntityNotFound
-from app.database.models import Shipment
-from app.database.redis import add_jti_to_blacklist
+from app.core.rate_limit import limit_client
+from app.core.security import revoke_access_token
+from app.database.profiles import PARTNER_DETAIL
 from app.utils import TEMPLATE_DIR
 
 router = APIRouter(prefix="/partner", tags=[APITag.PARTNER])
@@ -41,7 +46,7 @@ async def register_delivery_partner(
 
 
 ### Login a delivery partner
-@router.post("/token")
+@router.post("/token", dependencies=[Depends(limit_client)])
 async def login_delivery_partner(
     request_form: Annotated[OAuth2PasswordRequestForm, Depends()],
     service: DeliveryPartnerServiceDep,
@@ -62,6 +67,7 @@ async def update_delivery_partner(
     if not update:
         raise EntityNotFound
 
+    partner = await service.get(partner.id, PARTNER_DETAIL)
     return await service.update(partner.sqlmodel_update(update))
 
 
@@ -70,7 +76,7 @@ async def update_delivery_partner(
 async def logout_delivery_partner(
     token_data: Annotated[dict, Depends(get_delivery_partner_access_token)],
 ):
-    await add_jti_to_blacklist(token_data["jti"])
+    await revoke_access_token(token_data["jti"], token_data["exp"])
     return {"detail": "Successfully logged out!"}
 
 
@@ -126,32 +132,18 @@ async def get_reset_password_form(request: Request, token: str):
 
 ### Get seller profile
 @router.get("/me", response_model=DeliveryPartnerRead)
-async def get_partner_profile(partner: DeliveryPartnerDep):
-    return partner
+async def get_partner_profile(
+    partner: DeliveryPartnerDep, service: ReadDeliveryPartnerServiceDep
+):
+    return await service.get(partner.id, PARTNER_DETAIL)
 
 
 ### Get all shipments assigned to the delivery partner
-@router.get("/shipments", response_model=list[DeliveryPartnerShipments])
+@router.get("/shipments", response_model=DeliveryPartnerShipments)
 async def get_shipments(
     partner: DeliveryPartnerDep,
-    session: SessionDep,
+    service: ReadShipmentServiceDep,
     pagination: Annotated[PaginationParams, Depends(get_pagination_params)],
+    filters: Annotated[ShipmentFilterParams, Depends(get_shipment_filter_params)],
 ):
-    result = await session.scalars(
-        select(Shipment)
-        .where(Shipment.delivery_partner_id == partner.id)
-        .limit(pagination.pageSize)
-        .offset((pagination.page - 1) * pagination.pageSize)
-        .order_by(
-            asc(Shipment.created_at)
-            if pagination.order == "asc"
-            else desc(Shipment.created_at)
-        )
-    )
-
-    return {
-        "shipments": result.all(),
-        "total_shipments": len(partner.shipments),
-        "page": pagination.page,
-        "total_pages": ceil(len(partner.shipments) / pagination.pageSize),
-    }
+    return await service.get_partner_shipments(partner.id, pagination, filters)
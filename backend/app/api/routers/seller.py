@@ -1,25 +1,39 @@
-from math import ceil
 from typing import Annotated
 from uuid import UUID
-from fastapi import APIRouter, Depends, Form, Request
+from fastapi import APIRouter, Depends, Form, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
 from pydantic import EmailStr
-from sqlmodel import asc, desc, select
 
 from app.api.dependencies import (
+    ReadSellerServiceDep,
+    ReadShipmentServiceDep,
+    ReadWebhookServiceDep,
     SellerDep,
     SellerServiceDep,
-    SessionDep,
+    WebhookServiceDep,
     get_seller_access_token,
 )
-from app.api.schemas.pagination import PaginationParams, get_pagination_params
-from app.api.schemas.seller import SellerCreate, SellerRead, SellerShipments
+from app.api.schemas.pagination import (
+    PaginationParams,
+    ShipmentFilterParams,
+    get_pagination_params,
+    get_shipment_filter_params,
+)
+from app.api.schemas.seller import (
+    SellerCreate,
+    SellerRead,
+    SellerShipments,
+    WebhookCreate,
+    WebhookCreated,
+    WebhookDeadLetter,
+    WebhookRead,
+)
 from app.api.tag import APITag
 from app.config import app_settings
 from app.core.exceptions import EntityNotFound
-from app.database.models import Shipment
-from app.database.redis import add_jti_to_blacklist
+from app.core.rate_limit import limit_client
+from app.core.security import revoke_access_token
 from app.utils import TEMPLATE_DIR
 
 router = APIRouter(prefix="/seller", tags=[APITag.SELLER])
@@ -32,7 +46,7 @@ async def register_seller(seller: SellerCreate, service: SellerServiceDep):
 
 
 ### Login a seller
-@router.post("/token")
+@router.post("/token", dependencies=[Depends(limit_client)])
 async def login_seller(
     request_form: Annotated[OAuth2PasswordRequestForm, Depends()],
     service: SellerServiceDep,
@@ -44,7 +58,7 @@ async def login_seller(
 ### Logout a seller
 @router.get("/logout")
 async def logout_seller(token_data: Annotated[dict, Depends(get_seller_access_token)]):
-    await add_jti_to_blacklist(token_data["jti"])
+    await revoke_access_token(token_data["jti"], token_data["exp"])
     return {"detail": "Successfully logged out!"}
 
 
@@ -100,32 +114,64 @@ async def get_reset_password_form(request: Request, token: str):
 
 ### Get seller profile
 @router.get("/me", response_model=SellerRead)
-async def get_seller_profile(seller: SellerDep):
-    return seller
+async def get_seller_profile(seller: SellerDep, service: ReadSellerServiceDep):
+    return await service.get(seller.id)
 
 
 ### Get all shipments assigned to the delivery partner
-@router.get("/shipments", response_model=list[SellerShipments])
+@router.get("/shipments", response_model=SellerShipments)
 async def get_shipments(
     seller: SellerDep,
-    session: SessionDep,
+    service: ReadShipmentServiceDep,
     pagination: Annotated[PaginationParams, Depends(get_pagination_params)],
+    filters: Annotated[ShipmentFilterParams, Depends(get_shipment_filter_params)],
+):
+    return await service.get_seller_shipments(seller.id, pagination, filters)
+
+
+### Register a webhook for shipment events
+@router.post("/webhooks", response_model=WebhookCreated, status_code=201)
+async def add_webhook(
+    webhook: WebhookCreate, seller: SellerDep, service: WebhookServiceDep
 ):
-    result = await session.scalars(
-        select(Shipment)
-        .where(Shipment.seller_id == seller.id)
-        .limit(pagination.pageSize)
-        .offset((pagination.page - 1) * pagination.pageSize)
-        .order_by(
-            asc(Shipment.created_at)
-            if pagination.order == "asc"
-            else desc(Shipment.created_at)
-        )
+    created = await service.add(seller.id, str(webhook.url))
+    # The secret is excluded from the model's dump, shown this once
+    return WebhookCreated(
+        id=created.id,
+        url=created.url,
+        created_at=created.created_at,
+        secret=created.secret,
     )
 
-    return {
-        "shipments": result.all(),
-        "total_shipments": len(seller.shipments),
-        "page": pagination.page,
-        "total_pages": ceil(len(seller.shipments) / pagination.pageSize),
-    }
+
+### Get the seller's webhooks
+@router.get("/webhooks", response_model=list[WebhookRead])
+async def get_webhooks(seller: SellerDep, service: ReadWebhookServiceDep):
+    return await service.get_seller_webhooks(seller.id)
+
+
+### Remove a webhook
+@router.delete("/webhooks/{id}")
+async def delete_webhook(id: UUID, seller: SellerDep, service: WebhookServiceDep):
+    await service.delete(id, seller.id)
+    return {"detail": "Webhook deleted"}
+
+
+### Deliveries that ran out of attempts
+@router.get("/webhooks/{id}/dead_letters", response_model=list[WebhookDeadLetter])
+async def get_webhook_dead_letters(
+    id: UUID,
+    seller: SellerDep,
+    service: ReadWebhookServiceDep,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+    return await service.get_dead_letters(id, seller.id, limit)
+
+
+### Queue dead letters again
+@router.post("/webhooks/{id}/redeliver")
+async def redeliver_webhook_dead_letters(
+    id: UUID, seller: SellerDep, service: WebhookServiceDep
+):
+    count = await service.redeliver(id, seller.id)
+    return {"detail": f"{count} deliveries queued"}
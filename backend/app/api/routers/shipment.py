@@ -1,34 +1,61 @@
-from typing import Annotated
+import asyncio
+import json
+from typing import Annotated, Any
 from uuid import UUID
-from fastapi import APIRouter, Form, HTTPException, Request, status
+from fastapi import APIRouter, Body, Depends, Form, HTTPException, Request, status
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from app.api.dependencies import (
     DeliveryPartnerDep,
+    ReadShipmentServiceDep,
     SellerDep,
-    SessionDep,
+    SessionFactoryDep,
     ShipmentServiceDep,
+    get_shipment_service,
+)
+from app.api.schemas.pagination import (
+    PaginationParams,
+    ShipmentFilterParams,
+    TagFilterParams,
+    get_pagination_params,
+    get_shipment_filter_params,
+    get_tag_filter_params,
 )
 from app.api.schemas.shipment import (
+    BULK_SHIPMENT_LIMIT,
+    BulkShipmentResult,
+    BulkShipmentResults,
     ShipmentCreate,
     ShipmentRead,
+    ShipmentScan,
+    ShipmentScanResult,
+    ShipmentScanResults,
     ShipmentUpdate,
+    TaggedShipments,
 )
 from app.api.tag import APITag
 from app.config import app_settings
-from app.core.exceptions import EntityNotFound
+from app.core.exceptions import EntityNotFound, InvalidBulkRequest
+from app.core.idempotency import IdempotentRoute
 from app.database.models import TagName
+from app.database.profiles import SHIPMENT_DETAIL
+from app.services.event_stream import RESYNC, shipment_events
 from app.utils import TEMPLATE_DIR
 
 router = APIRouter(prefix="/shipment", tags=[APITag.SHIPMENT])
+# Routes a client may retry with an Idempotency-Key header, included below
+idempotent = APIRouter(route_class=IdempotentRoute)
 
 templates = Jinja2Templates(TEMPLATE_DIR)
 
 
 ### Read a shipment by id
 @router.get("/", response_model=ShipmentRead)
-async def get_shipment(id: UUID, _: SellerDep, service: ShipmentServiceDep):
-    shipment = await service.get(id)
+async def get_shipment(id: UUID, _: SellerDep, service: ReadShipmentServiceDep):
+    shipment = await service.get(id, SHIPMENT_DETAIL)
 
     if shipment is None:
         raise EntityNotFound
@@ -37,26 +64,72 @@ async def get_shipment(id: UUID, _: SellerDep, service: ShipmentServiceDep):
 
 
 ### Tracking details of shipment
+# On the primary, a page rendered from a lagging replica would be cached
 @router.get("/track", include_in_schema=False)
 async def get_tracking(request: Request, id: UUID, service: ShipmentServiceDep):
-    shipment = await service.get(id)
+    page = await service.get_tracking_page(id)
+
+    # Browsers and CDNs revalidate with the ETag after max-age
+    if page.not_modified(request.headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=page.headers)
+
+    return HTMLResponse(page.body, headers=page.headers)
+
+
+### Live shipment events
+@router.get("/{id}/events/stream", response_class=StreamingResponse)
+async def stream_shipment_events(id: UUID, service: ShipmentServiceDep):
+    """Server-sent events, the current status first and then each new event
+    of the shipment. A resync event means events may have been missed."""
+    # Subscribed before the status is read, so no event after it is missed,
+    # and read from the primary, which has every committed event
+    queue = shipment_events.subscribe(id)
+    try:
+        shipment = await service.get(id)
+        if shipment is None:
+            raise EntityNotFound
+    except BaseException:
+        shipment_events.unsubscribe(id, queue)
+        raise
+
+    current = json.dumps(
+        {
+            "status": shipment.current_status,
+            "location": shipment.current_location,
+        }
+    )
 
-    if shipment is None:
-        raise EntityNotFound
+    # The session is closed before streaming, a stream holds no connection
+    return StreamingResponse(
+        _server_sent_events(id, current, queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    context = shipment.model_dump()
-    context["status"] = shipment.status
-    context["partner"] = shipment.delivery_partner.name
-    context["timeline"] = shipment.timeline
-    context["timeline"].reverse()
 
-    return templates.TemplateResponse(
-        request=request, name="track.html", context=context
-    )
+async def _server_sent_events(id: UUID, current: str, queue: asyncio.Queue[str | None]):
+    try:
+        yield f"event: status\ndata: {current}\n\n"
+
+        while True:
+            try:
+                async with asyncio.timeout(app_settings.EVENT_STREAM_HEARTBEAT):
+                    event = await queue.get()
+            except TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": heartbeat\n\n"
+                continue
+
+            if event is RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                yield f"event: shipment_event\ndata: {event}\n\n"
+    finally:
+        shipment_events.unsubscribe(id, queue)
 
 
 ### Create a new shipment with content and weight
-@router.post(
+@idempotent.post(
     "/",
     response_model=ShipmentRead,
     name="Create Shipment",
@@ -95,8 +168,129 @@ async def submit_shipment(
     return await service.add(shipment, seller)
 
 
+def _read_bulk_items(body: bytes, content_type: str) -> list[Any]:
+    # NDJSON lines are parsed one by one, a bad line only fails its item
+    if content_type.startswith(("application/x-ndjson", "application/jsonl")):
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(line.decode(errors="replace"))
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise InvalidBulkRequest
+
+    if not isinstance(items, list) or not 0 < len(items) <= BULK_SHIPMENT_LIMIT:
+        raise InvalidBulkRequest
+
+    return items
+
+
+def _validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in detail['loc']) or 'item'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+### Create many shipments from a JSON array or NDJSON body
+@router.post(
+    "/bulk",
+    response_model=BulkShipmentResults,
+    description="Create up to 1000 **shipments** in one transaction, "
+    "results are reported per item so failed items do not abort the batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/ShipmentCreate"},
+                        "maxItems": BULK_SHIPMENT_LIMIT,
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/ShipmentCreate"}
+                },
+            },
+        }
+    },
+)
+async def submit_shipments(
+    request: Request, seller: SellerDep, service: ShipmentServiceDep
+):
+    items = _read_bulk_items(
+        await request.body(), request.headers.get("content-type", "")
+    )
+
+    results: list[BulkShipmentResult] = []
+    shipment_creates: list[ShipmentCreate] = []
+    positions: list[int] = []
+    for index, item in enumerate(items):
+        try:
+            shipment_creates.append(ShipmentCreate.model_validate(item))
+            positions.append(index)
+        except ValidationError as error:
+            results.append(
+                BulkShipmentResult(index=index, error=_validation_error(error))
+            )
+
+    if shipment_creates:
+        created = await service.add_bulk(shipment_creates, seller)
+        for index, result in zip(positions, created):
+            results.append(
+                BulkShipmentResult(index=index, error=result.__doc__)
+                if isinstance(result, Exception)
+                else BulkShipmentResult(index=index, id=result.id)
+            )
+
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.error)
+
+    return BulkShipmentResults(
+        created=len(results) - failed, failed=failed, results=results
+    )
+
+
+### Record a batch of scanner status updates
+@router.post(
+    "/events",
+    response_model=ShipmentScanResults,
+    description="Record up to 1000 **scans** of the partner's shipments, "
+    "replayed scans are reported as duplicates and recorded once",
+)
+async def submit_shipment_scans(
+    scans: Annotated[
+        list[ShipmentScan], Body(min_length=1, max_length=BULK_SHIPMENT_LIMIT)
+    ],
+    partner: DeliveryPartnerDep,
+    service: ShipmentServiceDep,
+):
+    results = [
+        (
+            ShipmentScanResult(index=index, result="rejected", error=result.__doc__)
+            if isinstance(result, Exception)
+            else ShipmentScanResult(index=index, result=result)
+        )
+        for index, result in enumerate(await service.record_scans(scans, partner))
+    ]
+
+    return ShipmentScanResults(
+        recorded=sum(1 for result in results if result.result == "recorded"),
+        duplicates=sum(1 for result in results if result.result == "duplicate"),
+        rejected=sum(1 for result in results if result.result == "rejected"),
+        results=results,
+    )
+
+
 ### Update fields of a shipment
-@router.patch("/", response_model=ShipmentRead)
+@idempotent.patch("/", response_model=ShipmentRead)
 async def update_shipment(
     id: UUID,
     shipment_update: ShipmentUpdate,
@@ -112,7 +306,7 @@ async def update_shipment(
 
 
 ### Cancel a shipment by id
-@router.get("/cancel", response_model=ShipmentRead)
+@idempotent.get("/cancel", response_model=ShipmentRead)
 async def cancel_shipment(id: UUID, seller: SellerDep, service: ShipmentServiceDep):
     shipment = await service.get(id)
 
@@ -160,8 +354,59 @@ async def remove_tag_from_shipment(
     return await service.remove_tag(id, tag_name)
 
 
-### Get all shipments with a tag
-@router.get("/tagged", response_model=list[ShipmentRead])
-async def get_shipments_with_tag(tag_name: TagName, session: SessionDep):
-    tag = await tag_name.tag(session)
-    return tag.shipments
+### Get shipments with any or all of the tags, as pages or an NDJSON stream
+@router.get(
+    "/tagged",
+    response_model=TaggedShipments,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/ShipmentRead"}
+                }
+            },
+            "description": "A page of shipments, or with `Accept: "
+            "application/x-ndjson` every matching shipment, one per line",
+        }
+    },
+)
+async def get_shipments_with_tag(
+    request: Request,
+    tags: Annotated[TagFilterParams, Depends(get_tag_filter_params)],
+    pagination: Annotated[PaginationParams, Depends(get_pagination_params)],
+    filters: Annotated[ShipmentFilterParams, Depends(get_shipment_filter_params)],
+    service: ReadShipmentServiceDep,
+    sessions: SessionFactoryDep,
+):
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _ndjson_lines(sessions, tags, pagination, filters),
+            media_type="application/x-ndjson",
+        )
+
+    return await service.get_by_tags(tags, pagination, filters, SHIPMENT_DETAIL)
+
+
+async def _ndjson_lines(
+    sessions: async_sessionmaker[AsyncSession],
+    tags: TagFilterParams,
+    pagination: PaginationParams,
+    filters: ShipmentFilterParams,
+):
+    # The request's session is closed before the body is sent, the stream
+    # holds a connection of its own until it ends
+    async with sessions() as session:
+        pages = get_shipment_service(session).stream_by_tags(
+            tags, pagination, filters, SHIPMENT_DETAIL
+        )
+        async for shipments in pages:
+            yield "".join(
+                ShipmentRead.model_validate(
+                    shipment, from_attributes=True
+                ).model_dump_json()
+                + "\n"
+                for shipment in shipments
+            )
+
+
+router.include_router(idempotent)
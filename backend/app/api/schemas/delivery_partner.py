@@ -27,5 +27,5 @@ class Shipment(BaseModel):
 
 class DeliveryPartnerShipments(BaseModel):
     shipments: list[Shipment]
-    total_shipments: int
-    page: int
+    total_shipments: int | None
+    next_cursor: str | None
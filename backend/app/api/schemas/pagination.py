@@ -1,14 +1,81 @@
-from typing import Literal
-from pydantic import BaseModel
+import base64
+import json
+from datetime import datetime
+from typing import Annotated, Literal
+from uuid import UUID
+
+from fastapi import Query
+from pydantic import BaseModel, Field
+
+from app.core.exceptions import InvalidCursor
+from app.database.models import ShipmentStatus, TagName
 
 
 class PaginationParams(BaseModel):
-    page: int = 1
-    pageSize: int = 10
+    cursor: str | None = None
+    pageSize: int = Field(default=10, ge=1, le=100)
     order: Literal["asc", "desc"] = "asc"
+    include_total: bool = True
 
 
 def get_pagination_params(
-    page: int = 1, pageSize: int = 10, order: Literal["asc", "desc"] = "asc"
+    cursor: str | None = None,
+    pageSize: Annotated[int, Query(ge=1, le=100)] = 10,
+    order: Literal["asc", "desc"] = "asc",
+    include_total: bool = True,
+):
+    return PaginationParams(
+        cursor=cursor, pageSize=pageSize, order=order, include_total=include_total
+    )
+
+
+class ShipmentFilterParams(BaseModel):
+    status: list[ShipmentStatus] | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+
+
+def get_shipment_filter_params(
+    status: Annotated[list[ShipmentStatus] | None, Query()] = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+):
+    return ShipmentFilterParams(
+        status=status, created_after=created_after, created_before=created_before
+    )
+
+
+class TagFilterParams(BaseModel):
+    tag_name: list[TagName]
+    # Shipments with any or with all of the tags
+    match: Literal["any", "all"] = "any"
+    seller_id: UUID | None = None
+
+
+def get_tag_filter_params(
+    tag_name: Annotated[list[TagName], Query()],
+    match: Literal["any", "all"] = "any",
+    seller_id: UUID | None = None,
 ):
-    return PaginationParams(page=page, pageSize=pageSize, order=order)
+    return TagFilterParams(tag_name=tag_name, match=match, seller_id=seller_id)
+
+
+# Opaque token of the last seen (created_at, id) pair
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    return base64.urlsafe_b64encode(
+        json.dumps([created_at.isoformat(), str(id)]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise InvalidCursor
+    # Anything else in a crafted cursor is an error, not a 500
+    if not isinstance(created_at, str) or not isinstance(id, str):
+        raise InvalidCursor
+    try:
+        return datetime.fromisoformat(created_at), UUID(id)
+    except ValueError:
+        raise InvalidCursor
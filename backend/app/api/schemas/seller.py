@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from datetime import datetime
+from uuid import UUID
+from pydantic import BaseModel, EmailStr, HttpUrl
 
 
 class BaseSeller(BaseModel):
@@ -20,5 +22,29 @@ class Shipment(BaseModel):
 
 class SellerShipments(BaseModel):
     shipments: list[Shipment]
-    total_shipments: int
-    page: int
+    total_shipments: int | None
+    next_cursor: str | None
+
+
+class WebhookCreate(BaseModel):
+    url: HttpUrl
+
+
+class WebhookRead(BaseModel):
+    id: UUID
+    url: str
+    created_at: datetime
+
+
+class WebhookCreated(WebhookRead):
+    """Only shown once, verifies the X-FastShip-Signature of deliveries"""
+
+    secret: str
+
+
+class WebhookDeadLetter(BaseModel):
+    id: UUID
+    created_at: datetime
+    attempts: int
+    last_error: str | None
+    payload: dict
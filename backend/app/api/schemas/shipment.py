@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Literal
 from uuid import UUID
 from pydantic import BaseModel, EmailStr, Field
 
@@ -27,6 +28,12 @@ class ShipmentRead(BaseShipment):
     tags: list[Tag]
 
 
+class TaggedShipments(BaseModel):
+    shipments: list[ShipmentRead]
+    total_shipments: int | None
+    next_cursor: str | None
+
+
 class ShipmentCreate(BaseShipment):
     """Shipment details to create a new shipment"""
 
@@ -34,6 +41,47 @@ class ShipmentCreate(BaseShipment):
     client_contact_phone: int | None = Field(default=None)
 
 
+# Most items accepted by POST /shipment/bulk
+BULK_SHIPMENT_LIMIT = 1000
+
+
+class BulkShipmentResult(BaseModel):
+    """Outcome of one item of a bulk request, by its position in the body"""
+
+    index: int
+    id: UUID | None = None
+    error: str | None = None
+
+
+class BulkShipmentResults(BaseModel):
+    created: int
+    failed: int
+    results: list[BulkShipmentResult]
+
+
+class ShipmentScan(BaseModel):
+    """Status update recorded by a partner's scanner"""
+
+    shipment_id: UUID
+    status: ShipmentStatus
+    location: int
+    description: str | None = Field(default=None)
+    timestamp: datetime = Field(description="When the scan happened")
+
+
+class ShipmentScanResult(BaseModel):
+    index: int
+    result: Literal["recorded", "duplicate", "rejected"]
+    error: str | None = None
+
+
+class ShipmentScanResults(BaseModel):
+    recorded: int
+    duplicates: int
+    rejected: int
+    results: list[ShipmentScanResult]
+
+
 class ShipmentUpdate(BaseModel):
     location: int | None = Field(default=None)
     status: ShipmentStatus | None = Field(default=None)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 _base_config = SettingsConfigDict(
@@ -10,6 +12,54 @@ _base_config = SettingsConfigDict(
 class AppSettings(BaseSettings):
     APP_NAME: str = "FastShip"
     APP_DOMAIN: str = "localhost:8000"
+    # Adds X-DB-* query stats headers to every response
+    DEBUG: bool = False
+
+    # Rendered tracking pages, kept in process and in Redis until the
+    # shipment changes, or for the ttl in seconds if a change is missed
+    TRACKING_CACHE_TTL: int = 3600
+    TRACKING_CACHE_SIZE: int = 10_000
+    # Seconds browsers and CDNs may serve a tracking page without asking
+    TRACKING_MAX_AGE: int = 30
+
+    # Server-sent event streams, seconds between heartbeats on an idle
+    # stream and events buffered per client before it is told to resync
+    EVENT_STREAM_HEARTBEAT: float = 15.0
+    EVENT_STREAM_QUEUE_SIZE: int = 100
+
+    # Responses to requests with an Idempotency-Key are replayed for this
+    # many seconds. A request in progress holds its key for at most the
+    # lock seconds, duplicates wait up to the wait seconds for it
+    IDEMPOTENCY_TTL: int = 86400
+    IDEMPOTENCY_LOCK_TTL: int = 60
+    IDEMPOTENCY_WAIT: float = 10.0
+
+    # Token bucket per authenticated seller or partner and route, and per
+    # client address on the login routes. Requests a second and burst,
+    # by route name, a rate of 0 disables the limit
+    RATE_LIMIT_RATE: float = 50.0
+    RATE_LIMIT_BURST: int = 100
+    RATE_LIMITS: dict[str, tuple[float, int]] = {
+        "login_seller": (0.5, 20),
+        "login_delivery_partner": (0.5, 20),
+        "submit_shipments": (1.0, 5),
+    }
+
+    # Requests handled at once per process before new ones are answered
+    # 503, defaults to twice the database pool and overflow
+    MAX_IN_FLIGHT_REQUESTS: int | None = None
+    LOAD_SHED_RETRY_AFTER: int = 1
+
+    # Request profiles, written as speedscope files to the directory for
+    # this fraction of requests and for requests with an X-FastShip-Profile
+    # header signed with the secret. With neither set nothing is installed
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SECRET: str | None = None
+    PROFILE_DIR: str = "profiles"
+    # Seconds between samples
+    PROFILE_INTERVAL: float = 0.001
+
+    model_config = _base_config
 
 
 class DatabaseSettings(BaseSettings):
@@ -21,6 +71,31 @@ class DatabaseSettings(BaseSettings):
 
     REDIS_HOST: str
     REDIS_PORT: str
+    # Revoked tokens are grouped by expiry, one sorted set per bucket of this
+    # many seconds, dropped by Redis once all of its tokens have expired
+    BLACKLIST_BUCKET_SECONDS: int = 3600
+
+    # Connection pool, per process, so each uvicorn worker has its own
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    # Seconds before a connection is replaced, -1 keeps it forever
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Milliseconds, 0 disables
+    DB_STATEMENT_TIMEOUT: int = 0
+    # asyncpg prepared statements per connection, 0 when behind pgbouncer
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Log sql queries
+    DB_ECHO: bool = False
+
+    # Read replicas for ReadSessionDep, a JSON list of database urls
+    DB_REPLICA_URLS: list[str] = []
+    DB_REPLICA_SELECTION: Literal["round_robin", "least_connections"] = "round_robin"
+    # Seconds an unreachable replica is skipped
+    DB_REPLICA_RETRY_AFTER: float = 30.0
+    # Seconds a client reads from the primary after its last write
+    DB_READ_YOUR_WRITES: float = 5.0
 
     model_config = _base_config
 
@@ -38,6 +113,21 @@ class SecuritySettings(BaseSettings):
     JWT_ALGORITHM: str
     SECURITY_SALT: str
 
+    # Seconds an authenticated principal is reused before a database check
+    PRINCIPAL_CACHE_TTL: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 10_000
+    # Seconds a verified token is reused without a Redis check, revocations
+    # are also pushed to every process so this only bounds a missed message
+    TOKEN_CACHE_TTL: int = 60
+    TOKEN_CACHE_SIZE: int = 10_000
+
+    # bcrypt cost, hashes of another cost are replaced on the next login
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    # Threads hashing passwords per process, a login waiting longer than
+    # the queue timeout for one is answered 503
+    PASSWORD_WORKERS: int = 4
+    PASSWORD_QUEUE_TIMEOUT: float = 5.0
+
     model_config = _base_config
 
 
@@ -57,7 +147,39 @@ class NotificationSettings(BaseSettings):
     model_config = _base_config
 
 
+class WorkerSettings(BaseSettings):
+
+    # Outbox dispatcher, app.worker.tasks.dispatch_outbox
+    OUTBOX_BATCH_SIZE: int = 500
+    OUTBOX_DISPATCH_INTERVAL: float = 2.0
+
+    # Pooled mail delivery, app.worker.mailer
+    # Emails are grouped into batch tasks of up to MAIL_BATCH_SIZE, 1 disables
+    MAIL_BATCH_SIZE: int = 50
+    SMTP_POOL_SIZE: int = 8
+
+    # Seller webhooks, app.worker.webhooks
+    WEBHOOK_DISPATCH_INTERVAL: float = 1.0
+    # Due deliveries claimed per transaction, and events per POST
+    WEBHOOK_BATCH_SIZE: int = 1000
+    WEBHOOK_EVENTS_PER_POST: int = 100
+    # POSTs in flight, also the size of the HTTP connection pool
+    WEBHOOK_CONCURRENCY: int = 20
+    WEBHOOK_TIMEOUT: float = 10.0
+    # Retries back off exponentially from the delay up to the max delay,
+    # a delivery becomes a dead letter after the last attempt
+    WEBHOOK_MAX_ATTEMPTS: int = 8
+    WEBHOOK_RETRY_DELAY: float = 10.0
+    WEBHOOK_RETRY_MAX_DELAY: float = 3600.0
+    # Urls must be https and are only posted to on public addresses,
+    # allowing http and private addresses is for local development
+    WEBHOOK_ALLOW_PRIVATE: bool = False
+
+    model_config = _base_config
+
+
 app_settings = AppSettings()
 db_settings = DatabaseSettings()
 security_settings = SecuritySettings()
 notification_settings = NotificationSettings()
+worker_settings = WorkerSettings()
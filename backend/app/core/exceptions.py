@@ -6,6 +6,8 @@ class FastShipError(Exception):
     """Base exception for all exceptions in our fastship api"""
 
     status = status.HTTP_400_BAD_REQUEST
+    # Response headers, set on instances
+    headers: dict[str, str] | None = None
 
 
 class EntityNotFound(FastShipError):
@@ -30,6 +32,36 @@ class NothingToUpdate(FastShipError):
     """No data provided to update"""
 
 
+class InvalidCursor(FastShipError):
+    """Pagination cursor is invalid"""
+
+
+class InvalidBulkRequest(FastShipError):
+    """Body must be a JSON array or NDJSON of at most 1000 shipments"""
+
+
+class InvalidIdempotencyKey(FastShipError):
+    """Idempotency-Key must be 1 to 255 printable characters"""
+
+
+class IdempotencyKeyReused(FastShipError):
+    """Idempotency-Key was already used for a different request"""
+
+    status = status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class IdempotencyKeyInProgress(FastShipError):
+    """A request with this Idempotency-Key is still in progress"""
+
+    status = status.HTTP_409_CONFLICT
+
+
+class InvalidWebhookUrl(FastShipError):
+    """Webhook url must be https on a public host"""
+
+    status = status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 class BadCredentials(FastShipError):
     """User email or password is incorrect"""
 
@@ -42,6 +74,22 @@ class InvalidToken(FastShipError):
     status = status.HTTP_401_UNAUTHORIZED
 
 
+class ServiceBusy(FastShipError):
+    """Server is busy, try again shortly"""
+
+    status = status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class TooManyRequests(FastShipError):
+    """Too many requests, try again later"""
+
+    status = status.HTTP_429_TOO_MANY_REQUESTS
+
+    def __init__(self, retry_after: int):
+        super().__init__()
+        self.headers = {"Retry-After": str(retry_after)}
+
+
 class DeliveryPartnerNotAvailable(FastShipError):
     """Delivery partner/s do not service the destination"""
 
@@ -60,7 +108,11 @@ def _get_handler(status: int, detail: str | None):
 
         print(panel.Panel(f"Handled: {exception.__class__.__name__}"))
 
-        raise HTTPException(status_code=status, detail=detail)
+        raise HTTPException(
+            status_code=status,
+            detail=detail,
+            headers=getattr(exception, "headers", None),
+        )
 
     return handler
 
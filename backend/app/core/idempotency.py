@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import json
+from hashlib import sha256
+from time import monotonic
+from typing import Any, Callable, Coroutine
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from app.config import app_settings
+from app.core.exceptions import (
+    IdempotencyKeyInProgress,
+    IdempotencyKeyReused,
+    InvalidIdempotencyKey,
+)
+from app.core.security import verify_access_token
+from app.database.redis import (
+    claim_idempotency_key,
+    get_idempotency_record,
+    release_idempotency_key,
+    set_idempotency_record,
+)
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+async def _scope(request: Request) -> str | None:
+    """Id of the authenticated user, keys of different users never meet"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    data = await verify_access_token(token)
+    return data["user"]["id"] if data else None
+
+
+async def _fingerprint(request: Request) -> str:
+    # The body is cached on the request, the endpoint reads it again
+    body = await request.body()
+    return sha256(b"\n".join([request.url.query.encode(), body])).hexdigest()
+
+
+def _replay(record: dict) -> Response:
+    response = Response(
+        content=base64.b64decode(record["body"]), status_code=record["status"]
+    )
+    response.raw_headers = [
+        (name.encode(), value.encode()) for name, value in record["headers"]
+    ]
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+class IdempotentRoute(APIRoute):
+    """Route honouring an Idempotency-Key header. The first request with a
+    key runs and its response is stored in Redis, later requests with the
+    same key are answered from there without running the endpoint, and
+    duplicates arriving while it runs wait for its response"""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await handler(request)
+            if not 0 < len(key) <= 255 or not key.isprintable():
+                raise InvalidIdempotencyKey
+
+            user = await _scope(request)
+            if user is None:
+                # Unauthenticated, the endpoint answers 401
+                return await handler(request)
+
+            key = f"{user}:{request.method}:{request.url.path}:{key}"
+            fingerprint = await _fingerprint(request)
+            running = json.dumps({"fingerprint": fingerprint})
+
+            deadline = monotonic() + app_settings.IDEMPOTENCY_WAIT
+            delay = 0.01
+            while not await claim_idempotency_key(
+                key, running, app_settings.IDEMPOTENCY_LOCK_TTL
+            ):
+                data = await get_idempotency_record(key)
+                if data is None:
+                    # Released by a failed request, claim it again
+                    continue
+
+                record = json.loads(data)
+                if record["fingerprint"] != fingerprint:
+                    raise IdempotencyKeyReused
+                if "status" in record:
+                    return _replay(record)
+
+                if monotonic() >= deadline:
+                    raise IdempotencyKeyInProgress
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.2)
+
+            try:
+                response = await handler(request)
+            except Exception:
+                # Errors are not stored, a retry runs the endpoint again
+                await release_idempotency_key(key)
+                raise
+
+            if response.status_code >= 500 or not hasattr(response, "body"):
+                await release_idempotency_key(key)
+                return response
+
+            await set_idempotency_record(
+                key,
+                json.dumps(
+                    {
+                        "fingerprint": fingerprint,
+                        "status": response.status_code,
+                        "headers": [
+                            (name.decode(), value.decode())
+                            for name, value in response.raw_headers
+                        ],
+                        "body": base64.b64encode(response.body).decode(),
+                    }
+                ),
+                app_settings.IDEMPOTENCY_TTL,
+            )
+            return response
+
+        return route_handler
@@ -0,0 +1,63 @@
+import os
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Metrics are kept per process. With several uvicorn workers, set
+# PROMETHEUS_MULTIPROC_DIR to an empty directory shared by all of them
+# so every worker's values are summed into each scrape.
+
+REQUEST_DURATION = Histogram(
+    "fastship_http_request_duration_seconds",
+    "Time until the response starts, by route name",
+    ["route", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSES = Counter(
+    "fastship_http_responses_total",
+    "Responses by route name and status code",
+    ["route", "method", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "fastship_http_requests_in_flight",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+REQUESTS_SHED = Counter(
+    "fastship_http_requests_shed_total",
+    "Requests answered 503 by the in-flight cap",
+)
+
+SHIPMENTS_CREATED = Counter(
+    "fastship_shipments_created_total",
+    "Shipments created",
+)
+ASSIGNMENTS_FAILED = Counter(
+    "fastship_shipment_assignments_failed_total",
+    "Shipments no delivery partner was available for",
+)
+SHIPMENT_EVENTS = Counter(
+    "fastship_shipment_events_total",
+    "Shipment events recorded, by status",
+    ["status"],
+)
+
+
+def metrics_response() -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Reads the files every worker writes its values to
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
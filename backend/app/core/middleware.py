@@ -0,0 +1,159 @@
+from time import perf_counter
+from typing import Collection
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.exceptions import ServiceBusy
+from app.core.metrics import (
+    REQUEST_DURATION,
+    REQUESTS_IN_FLIGHT,
+    REQUESTS_SHED,
+    RESPONSES,
+)
+from app.database.queries import observe_request, track_queries
+
+
+def _slowest(statement: str | None) -> str:
+    if statement is None:
+        return ""
+    # Single line and short enough for a header
+    return " ".join(statement.split())[:200].encode("ascii", "replace").decode()
+
+
+class QueryStatsMiddleware:
+    """Records query count, database time and the slowest statement of
+    each request, and adds them as X-DB-* headers when debug is on"""
+
+    def __init__(self, app: ASGIApp, debug: bool = False):
+        self.app = app
+        self.debug = debug
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with track_queries(f"{scope['method']} {scope['path']}") as stats:
+
+            async def send_with_stats(message: Message):
+                if self.debug and message["type"] == "http.response.start":
+                    # Statements run while streaming the body are not included
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-db-query-count", str(stats.count).encode()),
+                        (b"x-db-query-time", f"{stats.duration * 1000:.2f}".encode()),
+                        (b"x-db-query-repeats", str(stats.repeated).encode()),
+                        (b"x-db-slowest-query", _slowest(stats.slowest).encode()),
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_stats)
+            finally:
+                # Route template rather than the path, keeps the label bounded
+                route = scope.get("route")
+                observe_request(getattr(route, "path", "unmatched"), stats)
+
+
+class RequestMetricsMiddleware:
+    """Records the time until each response starts and its status, by the
+    route name that also names the operation in the OpenAPI schema"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            if not observed:
+                observed = True
+                REQUEST_DURATION.labels(_route(scope), scope["method"]).observe(
+                    perf_counter() - start
+                )
+
+        async def send_with_metrics(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # Also when the app failed before a response started
+            observe()
+            RESPONSES.labels(_route(scope), scope["method"], str(status)).inc()
+
+
+def _route(scope: Scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "name", "unmatched")
+
+
+class LoadSheddingMiddleware:
+    """Answers 503 with Retry-After while `limit` requests are being
+    handled, instead of queueing more for a database connection. A request
+    counts until its response ends, streams included, except responses of
+    the `detached` routes, which hold no connection while streaming and
+    stop counting once they start. Requests for the `exempt` paths are
+    neither counted nor shed"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limit: int,
+        retry_after: int = 1,
+        detached: Collection[str] = (),
+        exempt: Collection[str] = (),
+    ):
+        self.app = app
+        self.limit = limit
+        self.retry_after = retry_after
+        self.detached = detached
+        self.exempt = exempt
+        self.in_flight = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Not routed yet, so exempt requests are matched by path
+        if scope["type"] != "http" or scope["path"] in self.exempt:
+            return await self.app(scope, receive, send)
+
+        if self.in_flight >= self.limit:
+            REQUESTS_SHED.inc()
+            response = JSONResponse(
+                {"detail": ServiceBusy.__doc__},
+                status_code=ServiceBusy.status,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        self.in_flight += 1
+        REQUESTS_IN_FLIGHT.inc()
+        counted = True
+
+        def release():
+            nonlocal counted
+            if counted:
+                counted = False
+                self.in_flight -= 1
+                REQUESTS_IN_FLIGHT.dec()
+
+        async def send_and_release(message: Message):
+            if message["type"] == "http.response.start" and _route(scope) in (
+                self.detached
+            ):
+                release()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_release)
+        finally:
+            release()
@@ -0,0 +1,90 @@
+import asyncio
+import hmac
+import random
+import re
+from datetime import datetime
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
+from pyinstrument.session import Session
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+HEADER = "X-FastShip-Profile"
+
+
+def _signature(secret: str, expires: int) -> str:
+    return hmac.new(secret.encode(), str(expires).encode(), sha256).hexdigest()
+
+
+def profile_header(secret: str | None, ttl: int = 300) -> str:
+    """Value of the profile header, accepted for ttl seconds"""
+    if not secret:
+        raise ValueError("Profile headers require PROFILE_SECRET")
+    expires = int(time()) + ttl
+    return f"{expires}.{_signature(secret, expires)}"
+
+
+class ProfilingMiddleware:
+    """Profiles a sampled fraction of requests, and requests with an
+    X-FastShip-Profile header signed with the secret, and writes a
+    speedscope file for each to a directory named after its route"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        directory: str,
+        sample_rate: float = 0.0,
+        secret: str | None = None,
+        interval: float = 0.001,
+    ):
+        self.app = app
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.interval = interval
+        self.header = HEADER.lower().encode()
+
+    def _requested(self, scope: Scope) -> bool:
+        if not self.secret:
+            return False
+        for name, value in scope["headers"]:
+            if name == self.header:
+                expires, _, signature = value.decode("latin-1").partition(".")
+                if not expires.isdigit() or int(expires) < time():
+                    return False
+                return hmac.compare_digest(
+                    signature, _signature(self.secret, int(expires))
+                )
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not (
+            random.random() < self.sample_rate or self._requested(scope)
+        ):
+            return await self.app(scope, receive, send)
+
+        # Only samples taken while this request's task runs, time spent
+        # awaiting the database or Redis shows as await frames
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session = profiler.stop()
+            route = getattr(scope.get("route"), "name", "unmatched")
+            # Rendering can take longer than the request, keep it off the loop
+            await asyncio.to_thread(self.write, route, session)
+
+    def write(self, route: str, session: Session) -> Path:
+        directory = self.directory / re.sub(r"[^\w.-]+", "_", route)
+        directory.mkdir(parents=True, exist_ok=True)
+        started = datetime.fromtimestamp(session.start_time)
+        path = directory / (
+            f"{started:%Y%m%dT%H%M%S.%f}-{session.duration * 1000:.0f}ms"
+            ".speedscope.json"
+        )
+        path.write_text(SpeedscopeRenderer().render(session))
+        return path
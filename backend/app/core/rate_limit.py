@@ -0,0 +1,78 @@
+import logging
+import math
+
+from fastapi import Request
+from redis.exceptions import ConnectionError, TimeoutError
+
+from app.config import app_settings
+from app.core.exceptions import TooManyRequests
+from app.database.redis import take_token
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token buckets in Redis, one per subject and route, so the limit
+    holds across every api process"""
+
+    def __init__(self, rate: float, burst: int, routes: dict[str, tuple[float, int]]):
+        self.rate = rate
+        self.burst = burst
+        self.routes = routes
+
+    def limit(self, route: str) -> tuple[float, int]:
+        return self.routes.get(route, (self.rate, self.burst))
+
+    async def check(self, request: Request, subject: str):
+        """Raises TooManyRequests with the seconds to wait when the
+        subject's bucket for the route is empty"""
+        route = request.scope.get("route")
+        name = route.name if route is not None else request.url.path
+        rate, burst = self.limit(name)
+        if rate <= 0:
+            return
+
+        try:
+            wait = await take_token(f"{name}:{subject}", rate, burst)
+        except (ConnectionError, TimeoutError) as error:
+            # Limits are protection, not worth failing requests over
+            logger.warning("Rate limit not checked: %s", error)
+            return
+
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+
+rate_limiter = RateLimiter(
+    app_settings.RATE_LIMIT_RATE,
+    app_settings.RATE_LIMIT_BURST,
+    app_settings.RATE_LIMITS,
+)
+
+
+_proxy_warned = False
+
+
+def _warn_untrusted_proxy(request: Request, host: str):
+    """Behind a proxy the client address is the proxy's unless uvicorn
+    trusts it, and every client would share one bucket"""
+    global _proxy_warned
+    forwarded = request.headers.get("x-forwarded-for")
+    if _proxy_warned or forwarded is None:
+        return
+    if host not in [address.strip() for address in forwarded.split(",")]:
+        _proxy_warned = True
+        logger.warning(
+            "X-Forwarded-For from %s was not used, clients behind it share "
+            "rate limits. Set FORWARDED_ALLOW_IPS to the proxy's addresses",
+            host,
+        )
+
+
+async def limit_client(request: Request):
+    """Rate limit by client address, for routes without a principal. The
+    address comes from X-Forwarded-For when uvicorn runs with proxy headers
+    and trusts the proxy through FORWARDED_ALLOW_IPS"""
+    host = request.client.host if request.client else "unknown"
+    _warn_untrusted_proxy(request, host)
+    await rate_limiter.check(request, f"ip:{host}")
@@ -1,6 +1,21 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from time import time
+from typing import Callable, Literal, TypeVar
+from uuid import UUID
+
 from fastapi.security import OAuth2PasswordBearer
+from passlib.context import CryptContext
 from pydantic import BaseModel
 
+from app.config import security_settings
+from app.core.cache import TTLCache
+from app.core.exceptions import ServiceBusy
+from app.database.redis import add_jti_to_blacklist, is_jti_blacklisted, on_invalidation
+from app.utils import decode_access_token
+
+T = TypeVar("T")
 
 oauth2_scheme_seller = OAuth2PasswordBearer(
     tokenUrl="/seller/token", scheme_name="Seller"
@@ -13,3 +28,112 @@ oauth2_scheme_partner = OAuth2PasswordBearer(
 class TokenData(BaseModel):
     access_token: str
     token_type: str
+
+
+class Principal(BaseModel):
+    """Authenticated seller or delivery partner, without their relationships"""
+
+    id: UUID
+    name: str
+    email_verified: bool
+    role: Literal["seller", "partner"]
+
+
+# Decoded tokens by token hash, trusted without a signature or blacklist check
+# until the token expires or the cache ttl passes, whichever is first
+_verified_tokens = TTLCache(
+    maxsize=security_settings.TOKEN_CACHE_SIZE,
+    ttl=security_settings.TOKEN_CACHE_TTL,
+)
+# Revoked since they may have been cached, a cached token is rechecked
+# with Redis before these expire
+_revoked_jtis = TTLCache(
+    maxsize=security_settings.TOKEN_CACHE_SIZE,
+    ttl=security_settings.TOKEN_CACHE_TTL,
+)
+
+
+def _on_revocation(jti: str | None):
+    if jti is None:
+        # Revocations may have been missed, check every token with Redis again
+        _verified_tokens.clear()
+    else:
+        _revoked_jtis.set(jti, True)
+
+
+on_invalidation("tokens", _on_revocation)
+
+
+async def verify_access_token(token: str) -> dict | None:
+    """Token data if the token is valid and not revoked, only tokens
+    this process has not seen recently are checked with Redis"""
+    key = sha256(token.encode()).digest()
+    data = _verified_tokens.get(key)
+
+    if data is None:
+        data = decode_access_token(token)
+        if data is None or await is_jti_blacklisted(data["jti"], data["exp"]):
+            return None
+        _verified_tokens.set(
+            key, data, ttl=min(security_settings.TOKEN_CACHE_TTL, data["exp"] - time())
+        )
+
+    if _revoked_jtis.get(data["jti"]):
+        return None
+
+    return data
+
+
+async def revoke_access_token(jti: str, exp: int):
+    """Blacklist a token until it expires, every process stops accepting it"""
+    _on_revocation(jti)
+    await add_jti_to_blacklist(jti, exp)
+
+
+class PasswordHasher:
+    """bcrypt on a bounded thread pool, so a login never blocks the event
+    loop, the bcrypt package releases the GIL while hashing"""
+
+    def __init__(self, rounds: int, workers: int, queue_timeout: float):
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="password")
+        self._slots = asyncio.Semaphore(workers)
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        # Shed load rather than queue logins without bound
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await self._slots.acquire()
+        except TimeoutError:
+            raise ServiceBusy
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(
+        self, password: str, password_hash: str
+    ) -> tuple[bool, str | None]:
+        """Whether the password matches, and a new hash when the stored one
+        was made with another cost"""
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+
+passwords = PasswordHasher(
+    rounds=security_settings.PASSWORD_BCRYPT_ROUNDS,
+    workers=security_settings.PASSWORD_WORKERS,
+    queue_timeout=security_settings.PASSWORD_QUEUE_TIMEOUT,
+)
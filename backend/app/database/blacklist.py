@@ -0,0 +1,119 @@
+"""Token blacklist maintenance
+
+cd backend && python -m app.database.blacklist report
+cd backend && python -m app.database.blacklist compact
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+from time import time
+
+from redis.exceptions import ResponseError
+
+from app.database.redis import BLACKLIST_PREFIX, _redis
+from app.utils import ACCESS_TOKEN_EXPIRY
+
+# Keys written as `SET jti blacklisted` before buckets
+LEGACY_PATTERN = "????????-????-????-????-????????????"
+
+
+@dataclass
+class BlacklistReport:
+    buckets: int = 0
+    revoked: int = 0
+    # Revoked tokens already past their expiry, removed by compact
+    expired: int = 0
+    legacy: int = 0
+    # Legacy keys that never expire
+    legacy_persistent: int = 0
+    # Bytes as reported by MEMORY USAGE, None where the command is disabled
+    memory: int | None = 0
+
+
+async def _memory_usage(keys: list) -> int | None:
+    if not keys:
+        return 0
+    # Managed Redis services may disable the MEMORY command
+    try:
+        first = await _redis.memory_usage(keys[0]) or 0
+    except ResponseError:
+        return None
+
+    async with _redis.pipeline(transaction=False) as pipe:
+        for key in keys[1:]:
+            pipe.memory_usage(key)
+        return first + sum(usage or 0 for usage in await pipe.execute())
+
+
+async def _bucket_keys() -> list:
+    return [key async for key in _redis.scan_iter(f"{BLACKLIST_PREFIX}*")]
+
+
+async def _legacy_keys() -> list:
+    return [key async for key in _redis.scan_iter(LEGACY_PATTERN)]
+
+
+async def blacklist_report() -> BlacklistReport:
+    report = BlacklistReport()
+    buckets = await _bucket_keys()
+    legacy = await _legacy_keys()
+    now = int(time())
+
+    async with _redis.pipeline(transaction=False) as pipe:
+        for key in buckets:
+            pipe.zcard(key)
+            pipe.zcount(key, "-inf", now)
+        for key in legacy:
+            pipe.ttl(key)
+        results = await pipe.execute()
+
+    report.buckets = len(buckets)
+    report.revoked = sum(results[0 : 2 * len(buckets) : 2])
+    report.expired = sum(results[1 : 2 * len(buckets) : 2])
+    report.legacy = len(legacy)
+    report.legacy_persistent = results[2 * len(buckets) :].count(-1)
+    report.memory = await _memory_usage(buckets + legacy)
+    return report
+
+
+async def compact_blacklist() -> BlacklistReport:
+    """Drop expired tokens from live buckets and give legacy keys an expiry,
+    a token revoked before buckets was issued at most ACCESS_TOKEN_EXPIRY ago"""
+    now = int(time())
+    legacy_ttl = int(ACCESS_TOKEN_EXPIRY.total_seconds())
+
+    async with _redis.pipeline(transaction=False) as pipe:
+        for key in await _bucket_keys():
+            pipe.zremrangebyscore(key, "-inf", now)
+        for key in await _legacy_keys():
+            pipe.expire(key, legacy_ttl, nx=True)
+        await pipe.execute()
+
+    return await blacklist_report()
+
+
+def _print(report: BlacklistReport):
+    memory = "unavailable" if report.memory is None else f"{report.memory} bytes"
+    print(f"buckets            {report.buckets}")
+    print(f"revoked tokens     {report.revoked}")
+    print(f"expired tokens     {report.expired}")
+    print(f"legacy keys        {report.legacy}")
+    print(f"  without expiry   {report.legacy_persistent}")
+    print(f"memory             {memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token blacklist maintenance")
+    parser.add_argument("command", choices=["report", "compact"])
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report = asyncio.run(blacklist_report())
+    else:
+        report = asyncio.run(compact_blacklist())
+    _print(report)
+
+
+if __name__ == "__main__":
+    main()
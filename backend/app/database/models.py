@@ -4,7 +4,7 @@ from uuid import UUID, uuid4
 from pydantic import EmailStr
 from sqlmodel import Column, Field, Relationship, SQLModel, select
 from sqlalchemy.dialects import postgresql
-from sqlalchemy import ARRAY, INTEGER
+from sqlalchemy import ARRAY, INTEGER, JSON, Index, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -18,6 +18,10 @@ class ShipmentStatus(str, Enum):
     cancelled = "cancelled"
 
 
+# Statuses after which a shipment no longer occupies partner capacity
+FINAL_SHIPMENT_STATUSES = (ShipmentStatus.delivered, ShipmentStatus.cancelled)
+
+
 class TagName(str, Enum):
     EXPRESS = "express"
     STANDARD = "standard"
@@ -36,6 +40,10 @@ class TagName(str, Enum):
 
 class ShipmentTag(SQLModel, table=True):
     __tablename__ = "shipment_tag"
+    __table_args__ = (
+        # Shipments by tag, the primary key only serves tags by shipment
+        Index("ix_shipment_tag_tag_id_shipment_id", "tag_id", "shipment_id"),
+    )
 
     shipment_id: UUID = Field(foreign_key="shipment.id", primary_key=True)
     tag_id: UUID = Field(foreign_key="tag.id", primary_key=True)
@@ -51,12 +59,22 @@ class Tag(SQLModel, table=True):
     shipments: list["Shipment"] = Relationship(
         back_populates="tags",
         link_model=ShipmentTag,
-        sa_relationship_kwargs={"lazy": "immediate"},
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
 
 
 class Shipment(SQLModel, table=True):
     __tablename__ = "shipment"
+    __table_args__ = (
+        # Keyset pagination of seller and partner shipment lists
+        Index("ix_shipment_seller_created_at", "seller_id", "created_at", "id"),
+        Index(
+            "ix_shipment_delivery_partner_created_at",
+            "delivery_partner_id",
+            "created_at",
+            "id",
+        ),
+    )
 
     id: UUID = Field(sa_column=Column(postgresql.UUID, default=uuid4, primary_key=True))
 
@@ -75,34 +93,38 @@ class Shipment(SQLModel, table=True):
     destination: int
 
     timeline: list["ShipmentEvent"] = Relationship(
-        back_populates="shipment", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="shipment", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
     estimated_delivery: datetime | None
 
+    # Denormalized from the latest timeline event, see ShipmentEventService
+    current_status: ShipmentStatus | None = Field(default=None, index=True)
+    current_location: int | None = Field(default=None)
+
     seller_id: UUID = Field(foreign_key="seller.id")
     seller: "Seller" = Relationship(
-        back_populates="shipments", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="shipments", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
     delivery_partner_id: UUID = Field(foreign_key="delivery_partner.id")
     delivery_partner: "DeliveryPartner" = Relationship(
-        back_populates="shipments", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="shipments", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
     review: "Review" = Relationship(
-        back_populates="shipment", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="shipment", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
     tags: list[Tag] = Relationship(
         back_populates="shipments",
         link_model=ShipmentTag,
-        sa_relationship_kwargs={"lazy": "immediate"},
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
 
     @property
     def status(self):
-        return self.timeline[-1].status if len(self.timeline) > 0 else None
+        return self.current_status
 
 
 class ShipmentEvent(SQLModel, table=True):
@@ -123,7 +145,7 @@ class ShipmentEvent(SQLModel, table=True):
 
     shipment_id: UUID = Field(foreign_key="shipment.id")
     shipment: Shipment = Relationship(
-        back_populates="timeline", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="timeline", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
 
@@ -151,7 +173,7 @@ class Seller(User, table=True):
     zip_code: int | None = Field(default=None)
 
     shipments: list[Shipment] = Relationship(
-        back_populates="seller", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="seller", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
 
@@ -159,7 +181,9 @@ class ServiceableLocation(SQLModel, table=True):
     __tablename__ = "serviceable_location"
 
     partner_id: UUID = Field(foreign_key="delivery_partner.id", primary_key=True)
-    location_id: int = Field(foreign_key="location.zip_code", primary_key=True)
+    location_id: int = Field(
+        foreign_key="location.zip_code", primary_key=True, index=True
+    )
 
 
 class DeliveryPartner(User, table=True):
@@ -178,26 +202,32 @@ class DeliveryPartner(User, table=True):
     serviceable_locations: list["Location"] = Relationship(
         back_populates="delivery_partners",
         link_model=ServiceableLocation,
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
     max_handling_capacity: int
+    # Maintained on assignment and status changes, see DeliveryPartnerService
+    active_shipment_count: int = Field(default=0)
 
     shipments: list[Shipment] = Relationship(
-        back_populates="delivery_partner", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="delivery_partner",
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
 
+    @property
+    def serviceable_zip_codes(self) -> list[int]:
+        return [location.zip_code for location in self.serviceable_locations]
+
     @property
     def active_shipments(self):
         return [
             shipment
             for shipment in self.shipments
-            if shipment.status
-            not in [ShipmentStatus.delivered, ShipmentStatus.cancelled]
+            if shipment.status not in FINAL_SHIPMENT_STATUSES
         ]
 
     @property
     def current_handling_capacity(self):
-        return self.max_handling_capacity - len(self.active_shipments)
+        return self.max_handling_capacity - self.active_shipment_count
 
 
 class Review(SQLModel, table=True):
@@ -217,7 +247,7 @@ class Review(SQLModel, table=True):
 
     shipment_id: UUID = Field(foreign_key="shipment.id")
     shipment: Shipment = Relationship(
-        back_populates="review", sa_relationship_kwargs={"lazy": "selectin"}
+        back_populates="review", sa_relationship_kwargs={"lazy": "raise_on_sql"}
     )
 
 
@@ -234,5 +264,91 @@ class Location(SQLModel, table=True):
     delivery_partners: list[DeliveryPartner] = Relationship(
         back_populates="serviceable_locations",
         link_model=ServiceableLocation,
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
+
+
+class OutboxMessage(SQLModel, table=True):
+    """Celery task call stored in the same transaction as the change that
+    triggered it, sent to the broker by the outbox dispatcher"""
+
+    __tablename__ = "outbox_message"
+    __table_args__ = (Index("ix_outbox_message_created_at", "created_at"),)
+
+    id: UUID = Field(sa_column=Column(postgresql.UUID, default=uuid4, primary_key=True))
+
+    created_at: datetime = Field(
+        sa_column=Column(
+            postgresql.TIMESTAMP,
+            default=datetime.now,
+        )
+    )
+
+    task: str
+    payload: dict = Field(
+        sa_column=Column(JSON().with_variant(postgresql.JSONB(), "postgresql"))
+    )
+
+    attempts: int = Field(default=0)
+
+
+class Webhook(SQLModel, table=True):
+    """Endpoint a seller registered to receive its shipment events"""
+
+    __tablename__ = "webhook"
+
+    id: UUID = Field(sa_column=Column(postgresql.UUID, default=uuid4, primary_key=True))
+
+    created_at: datetime = Field(
+        sa_column=Column(
+            postgresql.TIMESTAMP,
+            default=datetime.now,
+        )
+    )
+
+    url: str
+    # Shared with the seller when registered, signs every delivery
+    secret: str = Field(exclude=True)
+
+    seller_id: UUID = Field(foreign_key="seller.id", index=True)
+
+
+class WebhookDelivery(SQLModel, table=True):
+    """Shipment event waiting to be posted to a webhook, deleted once
+    delivered and kept as a dead letter when it runs out of attempts"""
+
+    __tablename__ = "webhook_delivery"
+    __table_args__ = (
+        Index(
+            "ix_webhook_delivery_pending",
+            "next_attempt_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+        # Finds a webhook's deliveries waiting for a retry or leased,
+        # which later ones are held back by
+        Index(
+            "ix_webhook_delivery_webhook_id_next_attempt_at",
+            "webhook_id",
+            "next_attempt_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+    )
+
+    id: UUID = Field(sa_column=Column(postgresql.UUID, default=uuid4, primary_key=True))
+
+    created_at: datetime = Field(
+        sa_column=Column(
+            postgresql.TIMESTAMP,
+            default=datetime.now,
+        )
+    )
+
+    webhook_id: UUID = Field(foreign_key="webhook.id", index=True)
+    payload: dict = Field(
+        sa_column=Column(JSON().with_variant(postgresql.JSONB(), "postgresql"))
+    )
+
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.now)
+    last_error: str | None = Field(default=None)
+    dead_at: datetime | None = Field(default=None)
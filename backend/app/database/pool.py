@@ -0,0 +1,76 @@
+from time import perf_counter
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "fastship_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    ["database"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "fastship_db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after the pool timeout",
+    ["database"],
+)
+POOL_CONNECTION_HELD = Histogram(
+    "fastship_db_pool_connection_held_seconds",
+    "Time a connection is checked out of the pool",
+    ["database"],
+)
+POOL_CHECKED_OUT = Gauge(
+    "fastship_db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "fastship_db_pool_overflow",
+    "Connections open beyond the pool size",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited, the pool
+    events only fire once a connection has been handed out"""
+
+    # Metrics label, set by instrument_pool
+    database = "primary"
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(self.database).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.database).observe(perf_counter() - start)
+
+
+def instrument_pool(engine: AsyncEngine, database: str = "primary"):
+    pool = engine.sync_engine.pool
+    if isinstance(pool, InstrumentedPool):
+        pool.database = database
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = perf_counter()
+        POOL_CHECKED_OUT.labels(database).inc()
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            POOL_OVERFLOW.labels(database).set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            POOL_CONNECTION_HELD.labels(database).observe(
+                perf_counter() - checked_out_at
+            )
+            POOL_CHECKED_OUT.labels(database).dec()
@@ -0,0 +1,34 @@
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.database.models import DeliveryPartner, Shipment
+
+# Relationship loading profiles per endpoint.
+# Model relationships are lazy="raise_on_sql", so a query only loads what
+# its profile lists and touching anything else raises instead of querying.
+
+# Shipment response, ShipmentRead
+SHIPMENT_DETAIL = (
+    selectinload(Shipment.timeline),  # type: ignore
+    selectinload(Shipment.tags),  # type: ignore
+)
+
+# Public tracking page
+SHIPMENT_TRACK = (
+    selectinload(Shipment.timeline),  # type: ignore
+    joinedload(Shipment.delivery_partner),  # type: ignore
+)
+
+# Status changes, event notifications need the seller and partner names
+SHIPMENT_UPDATE = SHIPMENT_DETAIL + (
+    joinedload(Shipment.seller),  # type: ignore
+    joinedload(Shipment.delivery_partner),  # type: ignore
+)
+
+# Batched scans, only the notification emails read relationships
+SHIPMENT_SCAN = (
+    joinedload(Shipment.seller),  # type: ignore
+    joinedload(Shipment.delivery_partner),  # type: ignore
+)
+
+# Delivery partner response, DeliveryPartnerRead
+PARTNER_DETAIL = (selectinload(DeliveryPartner.serviceable_locations),)  # type: ignore
@@ -0,0 +1,91 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+QUERIES_PER_REQUEST = Histogram(
+    "fastship_db_queries_per_request",
+    "SQL statements issued while handling a request",
+    ["route"],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+QUERY_TIME_PER_REQUEST = Histogram(
+    "fastship_db_query_seconds_per_request",
+    "Time spent executing SQL statements while handling a request",
+    ["route"],
+)
+REPEATED_QUERIES_PER_REQUEST = Histogram(
+    "fastship_db_repeated_queries_per_request",
+    "Executions of the most repeated statement in a request, "
+    "high values point at N+1 loading",
+    ["route"],
+    buckets=(1, 2, 3, 5, 10, 25, 50),
+)
+
+
+@dataclass
+class QueryStats:
+    """Statements executed inside a track_queries block"""
+
+    label: str = ""
+    count: int = 0
+    duration: float = 0.0
+    slowest: str | None = None
+    slowest_duration: float = 0.0
+    statements: Counter[str] = field(default_factory=Counter)
+    # Blocks tracked while this one was active, one per request under test
+    nested: list["QueryStats"] = field(default_factory=list)
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        if duration >= self.slowest_duration:
+            self.slowest = statement
+            self.slowest_duration = duration
+
+    @property
+    def repeated(self) -> int:
+        """Executions of the most repeated statement"""
+        return max(self.statements.values(), default=0)
+
+
+_active: ContextVar[tuple[QueryStats, ...]] = ContextVar("active_queries", default=())
+
+
+@contextmanager
+def track_queries(label: str = ""):
+    """Collect statements run in this context, including inside
+    tasks started from it, until the block exits"""
+    stats = QueryStats(label)
+    parents = _active.get()
+    token = _active.set((*parents, stats))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+        if parents:
+            parents[-1].nested.append(stats)
+
+
+def instrument_queries(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - conn.info.pop("query_start")
+        for stats in _active.get():
+            stats.record(statement, duration)
+
+
+def observe_request(route: str, stats: QueryStats):
+    QUERIES_PER_REQUEST.labels(route).observe(stats.count)
+    QUERY_TIME_PER_REQUEST.labels(route).observe(stats.duration)
+    REPEATED_QUERIES_PER_REQUEST.labels(route).observe(stats.repeated)
@@ -1,18 +1,244 @@
+import asyncio
+import logging
+from time import perf_counter
+from typing import Callable
+from uuid import UUID
+
+from prometheus_client import Histogram
 from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError, TimeoutError
 
 from app.config import db_settings
 
+logger = logging.getLogger(__name__)
+
+REDIS_ROUND_TRIP = Histogram(
+    "fastship_redis_round_trip_seconds",
+    "Time from sending a Redis command, or a pipeline of them, to its reply",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_ROUND_TRIP.labels("PIPELINE").observe(perf_counter() - start)
+
+
+class InstrumentedRedis(Redis):
+    """Records the round trip time of every command by command name"""
+
+    async def execute_command(self, *args, **options):
+        start = perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_ROUND_TRIP.labels(args[0]).observe(perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+_redis = InstrumentedRedis(
+    host=db_settings.REDIS_HOST,
+    port=int(db_settings.REDIS_PORT),
+    db=0,
+)
 
-_token_blacklist = Redis(
+# Pub/sub keeps the in-process caches of all api processes coherent
+_pubsub = InstrumentedRedis(
     host=db_settings.REDIS_HOST,
     port=int(db_settings.REDIS_PORT),
     db=0,
 )
 
+INVALIDATION_PREFIX = "fastship:invalidate:"
+BLACKLIST_PREFIX = "blacklist:"
+CACHE_PREFIX = "cache:"
+CACHE_VERSION_PREFIX = "cache_version:"
+IDEMPOTENCY_PREFIX = "idempotency:"
+RATE_LIMIT_PREFIX = "rate:"
+
+# Token bucket refilled at ARGV[1] tokens a second up to ARGV[2], takes one
+# token and returns 0, or the milliseconds until one is available. Atomic,
+# and timed by the Redis clock so api hosts need not agree on the time
+_take_token = _redis.register_script("""
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+    local tokens = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = math.ceil((1 - tokens) / rate * 1000)
+    end
+
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+    -- Gone once full again, a full bucket is the same as none
+    redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1)
+    return wait
+    """)
+
+# Stores ARGV[2] at KEYS[1] for ARGV[3] seconds only while the version at
+# KEYS[2] is still ARGV[1], so a value read before a change is not cached
+# after the change dropped it. Returns whether it was stored
+_set_cached_if_version = _redis.register_script("""
+    local version = redis.call('GET', KEYS[2]) or ''
+    if version ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+    """)
+
+# Handlers by channel, called with the published message, or None
+# when messages may have been missed and everything should be dropped
+_invalidation_handlers: dict[str, Callable[[str | None], None]] = {}
+
+
+def blacklist_bucket(exp: int) -> int:
+    return int(exp) // db_settings.BLACKLIST_BUCKET_SECONDS
+
+
+def blacklist_key(bucket: int) -> str:
+    return f"{BLACKLIST_PREFIX}{bucket}"
+
+
+async def add_jti_to_blacklist(jti: str, exp: int):
+    """Revoke a token until it expires, its jti is stored as 16 raw bytes
+    scored by expiry in the sorted set of its expiry bucket"""
+    bucket = blacklist_bucket(exp)
+    async with _redis.pipeline(transaction=False) as pipe:
+        pipe.zadd(blacklist_key(bucket), {UUID(jti).bytes: int(exp)})
+        pipe.expireat(
+            blacklist_key(bucket), (bucket + 1) * db_settings.BLACKLIST_BUCKET_SECONDS
+        )
+        await pipe.execute()
+
+    # Processes drop the token from their verified token caches
+    await publish_invalidation("tokens", jti)
+
+
+async def is_jti_blacklisted(jti: str, exp: int) -> bool:
+    async with _redis.pipeline(transaction=False) as pipe:
+        pipe.zscore(blacklist_key(blacklist_bucket(exp)), UUID(jti).bytes)
+        # Plain keys written before buckets, expired by `compact`
+        pipe.exists(jti)
+        score, legacy = await pipe.execute()
+    return score is not None or bool(legacy)
+
+
+async def mark_recent_write(client: str, seconds: float):
+    await _redis.set(f"recent_write:{client}", 1, px=int(seconds * 1000))
+
+
+async def has_recent_write(client: str) -> bool:
+    return bool(await _redis.exists(f"recent_write:{client}"))
+
+
+async def get_cached(key: str) -> bytes | None:
+    return await _redis.get(CACHE_PREFIX + key)
+
+
+async def get_cache_version(key: str) -> str:
+    """Take before reading what will be cached, and pass to set_cached"""
+    version = await _redis.get(CACHE_VERSION_PREFIX + key)
+    return version.decode() if version is not None else ""
+
+
+async def set_cached(key: str, value: str | bytes, seconds: int, version: str) -> bool:
+    """Store the value unless the key was invalidated since the version"""
+    return bool(
+        await _set_cached_if_version(
+            keys=[CACHE_PREFIX + key, CACHE_VERSION_PREFIX + key],
+            args=[version, value, seconds],
+        )
+    )
+
+
+async def invalidate_cached(*keys: str, seconds: int):
+    """Delete the values and bump their versions, which are kept for the
+    seconds a value read before this may still be stored in"""
+    if not keys:
+        return
+    async with _redis.pipeline(transaction=True) as pipe:
+        pipe.delete(*(CACHE_PREFIX + key for key in keys))
+        for key in keys:
+            pipe.incr(CACHE_VERSION_PREFIX + key)
+            pipe.expire(CACHE_VERSION_PREFIX + key, seconds)
+        await pipe.execute()
+
+
+async def claim_idempotency_key(key: str, record: str, seconds: int) -> bool:
+    """Store the record unless the key is already taken"""
+    return bool(await _redis.set(IDEMPOTENCY_PREFIX + key, record, ex=seconds, nx=True))
+
+
+async def get_idempotency_record(key: str) -> bytes | None:
+    return await _redis.get(IDEMPOTENCY_PREFIX + key)
+
+
+async def set_idempotency_record(key: str, record: str, seconds: int):
+    await _redis.set(IDEMPOTENCY_PREFIX + key, record, ex=seconds)
+
+
+async def release_idempotency_key(key: str):
+    await _redis.delete(IDEMPOTENCY_PREFIX + key)
+
+
+async def take_token(key: str, rate: float, burst: int) -> float:
+    """Seconds until the bucket has a token, 0 when one was taken"""
+    wait = await _take_token(keys=[RATE_LIMIT_PREFIX + key], args=[rate, burst])
+    return wait / 1000
+
+
+def on_invalidation(channel: str, handler: Callable[[str | None], None]):
+    _invalidation_handlers[INVALIDATION_PREFIX + channel] = handler
+
+
+async def publish_invalidation(channel: str, message: str = ""):
+    await _pubsub.publish(INVALIDATION_PREFIX + channel, message)
+
+
+async def listen_for_invalidations():
+    """Run for the lifetime of the app, dispatching invalidation messages
+    published by any process to the local handlers"""
+    while True:
+        try:
+            async with _pubsub.pubsub() as pubsub:
+                await pubsub.subscribe(*_invalidation_handlers)
 
-async def add_jti_to_blacklist(jti: str):
-    await _token_blacklist.set(jti, "blacklisted")
+                # Published while not subscribed is lost
+                for handler in _invalidation_handlers.values():
+                    handler(None)
 
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"].decode()
+                    handler = _invalidation_handlers.get(channel)
+                    if handler is None:
+                        continue
+                    try:
+                        handler(message["data"].decode())
+                    except Exception:
+                        # A bad message must not stop every other cache's
+                        logger.exception("Invalidation on %s failed", channel)
 
-async def is_jti_blacklisted(jti: str) -> bool:
-    return await _token_blacklist.exists(jti)
+        except (ConnectionError, TimeoutError) as error:
+            logger.warning("Invalidation listener disconnected: %s", error)
+            await asyncio.sleep(1)
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+from itertools import count
+from time import monotonic
+from typing import Literal
+
+from fastapi import Request
+from sqlalchemy.exc import DBAPIError
+from redis.exceptions import ConnectionError, TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.database.redis import has_recent_write, mark_recent_write
+
+logger = logging.getLogger(__name__)
+
+
+def client_key(request: Request) -> str | None:
+    """Identifies a client by its credentials, anonymous clients have none"""
+    authorization = request.headers.get("authorization")
+    if authorization is None:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()[:32]
+
+
+class ReadSessionRouter:
+    """Sessions for read-only requests on a replica picked round robin or
+    by fewest checked out connections. Falls back to the primary when no
+    replica is reachable and for clients that wrote in the last
+    `read_your_writes` seconds."""
+
+    def __init__(
+        self,
+        primary: async_sessionmaker[AsyncSession],
+        replicas: list[AsyncEngine],
+        selection: Literal["round_robin", "least_connections"] = "round_robin",
+        retry_after: float = 30.0,
+        read_your_writes: float = 5.0,
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.selection = selection
+        self.retry_after = retry_after
+        self.read_your_writes = read_your_writes
+        self._turn = count()
+        self._down_until: dict[AsyncEngine, float] = {}
+
+    def candidates(self) -> list[AsyncEngine]:
+        now = monotonic()
+        up = [
+            replica
+            for replica in self.replicas
+            if self._down_until.get(replica, 0) <= now
+        ]
+        if not up:
+            return []
+
+        if self.selection == "least_connections":
+            return sorted(up, key=lambda replica: replica.pool.checkedout())  # type: ignore
+
+        start = next(self._turn) % len(up)
+        return up[start:] + up[:start]
+
+    async def session(self, client: str | None = None) -> AsyncSession:
+        # Nothing to choose from, and no Redis round trip to choose
+        if not self.replicas:
+            return self.primary()
+
+        if client is None or not await self._recent_write(client):
+            for replica in self.candidates():
+                session = AsyncSession(replica, expire_on_commit=False)
+                try:
+                    # Connect now, so an unreachable replica is skipped here
+                    # instead of failing the request on its first query
+                    await session.connection()
+                    return session
+                except (OSError, DBAPIError):
+                    await session.close()
+                    self._down_until[replica] = monotonic() + self.retry_after
+
+        return self.primary()
+
+    async def _recent_write(self, client: str) -> bool:
+        try:
+            return await has_recent_write(client)
+        except (ConnectionError, TimeoutError) as error:
+            # Unknown, so read from the primary, which has every write
+            logger.warning("Recent write not checked: %s", error)
+            return True
+
+    async def mark_write(self, client: str | None):
+        # Only matters when reads can go elsewhere
+        if self.replicas and client is not None:
+            try:
+                await mark_recent_write(client, self.read_your_writes)
+            except (ConnectionError, TimeoutError) as error:
+                # The write is committed, failing its response helps no one
+                logger.warning("Recent write not marked: %s", error)
@@ -1,30 +1,86 @@
-
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session
 from sqlmodel import SQLModel
 
 from app.config import db_settings
+from app.database.pool import InstrumentedPool, instrument_pool
+from app.database.queries import instrument_queries
+from app.database.replicas import ReadSessionRouter, client_key
+
+
+def _create_engine(url: str, database: str):
+    engine = create_async_engine(
+        url=url,
+        echo=db_settings.DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=db_settings.DB_POOL_SIZE,
+        max_overflow=db_settings.DB_MAX_OVERFLOW,
+        pool_timeout=db_settings.DB_POOL_TIMEOUT,
+        pool_recycle=db_settings.DB_POOL_RECYCLE,
+        pool_pre_ping=db_settings.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": db_settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "statement_timeout": str(db_settings.DB_STATEMENT_TIMEOUT),
+            },
+        },
+    )
+    instrument_pool(engine, database)
+    instrument_queries(engine)
+    return engine
 
-engine = create_async_engine(
-    url=db_settings.POSTGRES_URL,
-    # Log sql queries
-    echo=True
+
+engine = _create_engine(db_settings.POSTGRES_URL, "primary")
+
+# One factory for the process, sessions are cheap but factories are not
+async_session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+read_sessions = ReadSessionRouter(
+    async_session,
+    [
+        _create_engine(url, f"replica{index}")
+        for index, url in enumerate(db_settings.DB_REPLICA_URLS)
+    ],
+    selection=db_settings.DB_REPLICA_SELECTION,
+    retry_after=db_settings.DB_REPLICA_RETRY_AFTER,
+    read_your_writes=db_settings.DB_READ_YOUR_WRITES,
 )
 
 
+@event.listens_for(Session, "after_commit")
+def _remember_commit(session: Session):
+    session.info["committed"] = True
+
+
 async def create_db_tables():
     async with engine.begin() as connection:
         from app.database.models import Shipment  # noqa: F401
+
         await connection.run_sync(SQLModel.metadata.create_all)
 
 
-async def get_session():
-    async_session = sessionmaker(
-        bind=engine,
-        class_=AsyncSession,
-        expire_on_commit=False
-    )
-
+async def get_session(request: Request):
     async with async_session() as session:
         yield session
 
+        # Send this client's reads to the primary for a while,
+        # replicas may not have its write yet
+        if session.info.get("committed"):
+            await read_sessions.mark_write(client_key(request))
+
+
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    """For streamed responses, which run after the request's dependencies
+    have closed their sessions and must open their own"""
+    return async_session
+
+
+async def get_read_session(request: Request):
+    async with await read_sessions.session(client_key(request)) as session:
+        yield session
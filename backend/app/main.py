@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,7 +6,16 @@ from fastapi.routing import APIRoute
 from scalar_fastapi import get_scalar_api_reference
 
 from app.api.tag import APITag
+from app.config import app_settings, db_settings
+from app.core.metrics import metrics_response
+from app.core.middleware import (
+    LoadSheddingMiddleware,
+    QueryStatsMiddleware,
+    RequestMetricsMiddleware,
+)
+from app.core.profiling import ProfilingMiddleware
 from app.core.exceptions import add_exception_handlers
+from app.database.redis import listen_for_invalidations
 from app.database.session import create_db_tables
 from app.api.router import master_router
 
@@ -13,7 +23,11 @@ from app.api.router import master_router
 @asynccontextmanager
 async def lifespan_handler(app: FastAPI):
     await create_db_tables()
+
+    # Keeps in-process caches coherent across api processes
+    invalidations = asyncio.create_task(listen_for_invalidations())
     yield
+    invalidations.cancel()
 
 
 description = """
@@ -58,6 +72,32 @@ app = FastAPI(
     generate_unique_id_function=custom_generate_unique_id_function,
 )
 
+# Innermost, profiles cover the endpoint rather than the other middleware
+if app_settings.PROFILE_SAMPLE_RATE or app_settings.PROFILE_SECRET:
+    app.add_middleware(
+        ProfilingMiddleware,
+        directory=app_settings.PROFILE_DIR,
+        sample_rate=app_settings.PROFILE_SAMPLE_RATE,
+        secret=app_settings.PROFILE_SECRET,
+        interval=app_settings.PROFILE_INTERVAL,
+    )
+
+app.add_middleware(QueryStatsMiddleware, debug=app_settings.DEBUG)
+app.add_middleware(RequestMetricsMiddleware)
+
+# Inside CORS only, a shed request costs no other middleware and browsers
+# can still read its 503
+app.add_middleware(
+    LoadSheddingMiddleware,
+    limit=app_settings.MAX_IN_FLIGHT_REQUESTS
+    or 2 * (db_settings.DB_POOL_SIZE + db_settings.DB_MAX_OVERFLOW),
+    retry_after=app_settings.LOAD_SHED_RETRY_AFTER,
+    # Server-sent events wait on Redis, not the database
+    detached={"stream_shipment_events"},
+    # Scrapes must get through when the process is busiest
+    exempt={"/metrics"},
+)
+
 app.add_middleware(
     CORSMiddleware, allow_origins=["http://localhost:5500"], allow_methods=["*"]
 )
@@ -69,3 +109,8 @@ add_exception_handlers(app)
 @app.get("/scalar", include_in_schema=False)
 def get_scalar_docs():
     return get_scalar_api_reference(openapi_url=app.openapi_url, title="Scalar API")
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return metrics_response()
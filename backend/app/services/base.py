@@ -1,5 +1,9 @@
+from typing import Sequence
 from uuid import UUID
+from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.interfaces import ORMOption
 from sqlmodel import SQLModel
 
 
@@ -8,8 +12,18 @@ class BaseService:
         self.model = model
         self.session = session
 
-    async def _get(self, id: UUID):
-        return await self.session.get(self.model, id)
+    async def _get(self, id: UUID, profile: Sequence[ORMOption] = ()):
+        # Reload when a profile is given, an instance already in the
+        # session would otherwise keep its unloaded relationships
+        return await self.session.get(
+            self.model, id, options=profile, populate_existing=bool(profile)
+        )
+
+    def _insert_ignore(self, table: Table):
+        # INSERT .. ON CONFLICT DO NOTHING for the session's database
+        if self.session.bind.dialect.name == "postgresql":  # type: ignore
+            return postgresql.insert(table).on_conflict_do_nothing()
+        return sqlite.insert(table).on_conflict_do_nothing()
 
     async def _add(self, entity: SQLModel):
         self.session.add(entity)
@@ -1,28 +1,41 @@
+from collections import defaultdict
 from typing import Sequence
-from sqlmodel import select
+from uuid import UUID
+from sqlalchemy import bindparam
+from sqlmodel import select, update
 from app.api.schemas.delivery_partner import DeliveryPartnerCreate
 from app.core.exceptions import DeliveryPartnerNotAvailable
-from app.database.models import DeliveryPartner, Location, Shipment
+from app.database.models import (
+    DeliveryPartner,
+    Location,
+    ServiceableLocation,
+    Shipment,
+)
+from app.database.profiles import PARTNER_DETAIL
 from app.services.user import UserService
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
-
 class DeliveryPartnerService(UserService):
+    role = "partner"
+
     def __init__(self, session: AsyncSession):
         super().__init__(DeliveryPartner, session)  # type: ignore
 
     async def add(self, delivery_partner: DeliveryPartnerCreate):
+        locations = []
+        for zip_code in delivery_partner.serviceable_zip_codes:
+            location = await self.session.get(Location, zip_code)
+            locations.append(location if location else Location(zip_code=zip_code))
+
         partner: DeliveryPartner = await self._add_user(
-            delivery_partner.model_dump(exclude={"serviceable_zip_codes"}),
+            {
+                **delivery_partner.model_dump(exclude={"serviceable_zip_codes"}),
+                "serviceable_locations": locations,
+            },
             "partner",
         )  # type: ignore
-        for zip_code in delivery_partner.serviceable_zip_codes:
-            location = await self.session.get(Location, zip_code)
-            partner.serviceable_locations.append(
-                location if location else Location(zip_code=zip_code)
-            )
-        return await self._update(partner)
+        return await self.get(partner.id, PARTNER_DETAIL)
 
     async def get_partner_by_zipcode(self, zipcode: int) -> Sequence[DeliveryPartner]:
         return (
@@ -33,16 +46,126 @@ class DeliveryPartnerService(UserService):
             )
         ).all()
 
-    async def assign_shipment(self, shipment: Shipment):
-        eligible_partners = await self.get_partner_by_zipcode(shipment.destination)
+    async def _take_available_partner(
+        self, zipcode: int, skip_locked: bool
+    ) -> DeliveryPartner | None:
+        # Lock the least loaded partner with capacity and take one slot,
+        # a single UPDATE .. WHERE id = (SELECT .. FOR UPDATE) .. RETURNING
+        available = (
+            select(DeliveryPartner.id)
+            .join(
+                ServiceableLocation,
+                ServiceableLocation.partner_id == DeliveryPartner.id,  # type: ignore
+            )
+            .where(
+                ServiceableLocation.location_id == zipcode,
+                DeliveryPartner.active_shipment_count  # type: ignore
+                < DeliveryPartner.max_handling_capacity,
+            )
+            .order_by(DeliveryPartner.active_shipment_count)  # type: ignore
+            .limit(1)
+            .with_for_update(of=DeliveryPartner, skip_locked=skip_locked)  # type: ignore
+            .correlate(None)
+            .scalar_subquery()
+        )
+        return await self.session.scalar(
+            update(DeliveryPartner)
+            .where(DeliveryPartner.id == available)  # type: ignore
+            .values(active_shipment_count=DeliveryPartner.active_shipment_count + 1)
+            .returning(DeliveryPartner)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
 
-        for partner in eligible_partners:
-            if partner.current_handling_capacity > 0:
-                partner.shipments.append(shipment)
+    async def assign_shipment(self, shipment: Shipment) -> DeliveryPartner:
+        # Skip partners locked by concurrent assignments first, then wait
+        # for a lock so a busy but available partner is not missed.
+        # The lock is held until the shipment is committed.
+        for skip_locked in (True, False):
+            partner = await self._take_available_partner(
+                shipment.destination, skip_locked
+            )
+            if partner is not None:
                 return partner
 
         raise DeliveryPartnerNotAvailable
 
+    async def assign_shipments(
+        self, shipments: Sequence[Shipment]
+    ) -> list[DeliveryPartner | None]:
+        """Partner for each shipment from one locked capacity snapshot,
+        None where no partner serving the destination has capacity left"""
+        rows = (
+            await self.session.execute(
+                select(DeliveryPartner, ServiceableLocation.location_id)
+                .join(
+                    ServiceableLocation,
+                    ServiceableLocation.partner_id == DeliveryPartner.id,  # type: ignore
+                )
+                .where(
+                    ServiceableLocation.location_id.in_(  # type: ignore
+                        {shipment.destination for shipment in shipments}
+                    ),
+                    DeliveryPartner.active_shipment_count  # type: ignore
+                    < DeliveryPartner.max_handling_capacity,
+                )
+                # Same lock order in every batch, so concurrent batches
+                # wait for each other instead of deadlocking
+                .order_by(DeliveryPartner.id)  # type: ignore
+                .with_for_update(of=DeliveryPartner)  # type: ignore
+                .execution_options(populate_existing=True)
+            )
+        ).all()
+
+        partners_by_zipcode: dict[int, list[DeliveryPartner]] = defaultdict(list)
+        active = {}
+        for partner, zipcode in rows:
+            partners_by_zipcode[zipcode].append(partner)
+            active[partner.id] = partner.active_shipment_count
+
+        assigned: list[DeliveryPartner | None] = []
+        for shipment in shipments:
+            # Least loaded partner first, as for a single assignment
+            available = [
+                partner
+                for partner in partners_by_zipcode[shipment.destination]
+                if active[partner.id] < partner.max_handling_capacity
+            ]
+            partner = min(available, key=lambda p: active[p.id], default=None)
+            if partner is not None:
+                active[partner.id] += 1
+            assigned.append(partner)
+
+        deltas = {
+            partner.id: active[partner.id] - partner.active_shipment_count
+            for partner, _ in rows
+        }
+        await self.change_active_shipment_counts(
+            {id: delta for id, delta in deltas.items() if delta}
+        )
+
+        return assigned
+
+    async def change_active_shipment_counts(self, deltas: dict[UUID, int]):
+        if not deltas:
+            return
+
+        table = DeliveryPartner.__table__  # type: ignore
+        await self.session.execute(
+            update(table)
+            .where(table.c.id == bindparam("partner_id"))
+            .values(
+                active_shipment_count=table.c.active_shipment_count + bindparam("delta")
+            ),
+            [{"partner_id": id, "delta": delta} for id, delta in deltas.items()],
+        )
+
+    async def change_active_shipment_count(self, partner_id: UUID, delta: int):
+        await self.session.execute(
+            update(DeliveryPartner)
+            .where(DeliveryPartner.id == partner_id)  # type: ignore
+            .values(active_shipment_count=DeliveryPartner.active_shipment_count + delta)
+        )
+
     async def update(self, partner: DeliveryPartner):
         return await self._update(partner)
 
@@ -0,0 +1,73 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import Sequence
+from uuid import UUID
+
+from app.config import app_settings
+from app.database.models import ShipmentEvent
+from app.database.redis import on_invalidation, publish_invalidation
+
+# Published on the invalidation pub/sub, so the one subscription each api
+# process already holds also feeds the event streams
+CHANNEL = "shipment_events"
+
+# Queued instead of an event when a stream may have missed some
+RESYNC = None
+
+
+async def publish_shipment_events(events: Sequence[ShipmentEvent]):
+    """Call after committing the events"""
+    if events:
+        await publish_invalidation(
+            CHANNEL, json.dumps([event.model_dump(mode="json") for event in events])
+        )
+
+
+class ShipmentEventBroker:
+    """Fans shipment events out to the streams open in this process, each
+    stream reads from its own bounded queue"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._streams: dict[str, set[asyncio.Queue[str | None]]] = defaultdict(set)
+
+    def subscribe(self, shipment_id: UUID) -> asyncio.Queue[str | None]:
+        queue: asyncio.Queue[str | None] = asyncio.Queue(self.queue_size)
+        self._streams[str(shipment_id)].add(queue)
+        return queue
+
+    def unsubscribe(self, shipment_id: UUID, queue: asyncio.Queue[str | None]):
+        streams = self._streams.get(str(shipment_id))
+        if streams is not None:
+            streams.discard(queue)
+            if not streams:
+                del self._streams[str(shipment_id)]
+
+    def dispatch(self, message: str | None):
+        if message is None:
+            for streams in self._streams.values():
+                for queue in streams:
+                    self._offer(queue, RESYNC)
+            return
+
+        for event in json.loads(message):
+            for queue in self._streams.get(event["shipment_id"], ()):
+                self._offer(queue, json.dumps(event))
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue[str | None], item: str | None):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # A client too slow to keep up refetches instead of falling behind
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    def __len__(self) -> int:
+        return sum(len(streams) for streams in self._streams.values())
+
+
+shipment_events = ShipmentEventBroker(app_settings.EVENT_STREAM_QUEUE_SIZE)
+on_invalidation(CHANNEL, shipment_events.dispatch)
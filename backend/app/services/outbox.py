@@ -0,0 +1,24 @@
+from celery import Task
+from sqlmodel import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import OutboxMessage
+from app.services.base import BaseService
+
+
+class OutboxService(BaseService):
+    def __init__(self, session: AsyncSession):
+        super().__init__(OutboxMessage, session)
+
+    def enqueue(self, task: Task, **kwargs):
+        # Committed by the caller along with its own changes,
+        # app.worker.tasks.dispatch_outbox sends it to the broker
+        self.session.add(OutboxMessage(task=task.name, payload=kwargs))
+
+    async def enqueue_many(self, task: Task, payloads: list[dict]):
+        # One multi-row insert, also committed by the caller
+        if payloads:
+            await self.session.execute(
+                insert(OutboxMessage),
+                [{"task": task.name, "payload": payload} for payload in payloads],
+            )
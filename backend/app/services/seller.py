@@ -1,16 +1,14 @@
 from app.services.user import UserService
 
-from passlib.context import CryptContext
-
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.schemas.seller import SellerCreate
 from app.database.models import Seller
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class SellerService(UserService):
+    role = "seller"
+
     def __init__(self, session: AsyncSession):
         super().__init__(Seller, session)  # type: ignore
 
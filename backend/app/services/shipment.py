@@ -1,21 +1,55 @@
 from datetime import datetime, timedelta
-from uuid import UUID
+from uuid import UUID, uuid4
 from fastapi import HTTPException, status
+from sqlalchemy import ColumnElement, tuple_
+from typing import AsyncIterator, Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
-
-from app.api.schemas.shipment import ShipmentCreate, ShipmentReview, ShipmentUpdate
-from app.core.exceptions import ClientNotAuthorized, EntityNotFound
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import ORMOption
+from sqlmodel import asc, delete, desc, exists, func, insert, select
+
+from app.api.schemas.pagination import (
+    PaginationParams,
+    ShipmentFilterParams,
+    TagFilterParams,
+    decode_cursor,
+    encode_cursor,
+)
+from app.api.schemas.shipment import (
+    ShipmentCreate,
+    ShipmentReview,
+    ShipmentScan,
+    ShipmentUpdate,
+)
+from app.core.exceptions import (
+    ClientNotAuthorized,
+    DeliveryPartnerNotAvailable,
+    EntityNotFound,
+    FastShipError,
+)
+from app.core.metrics import ASSIGNMENTS_FAILED, SHIPMENT_EVENTS, SHIPMENTS_CREATED
+from app.core.security import Principal
 from app.database.models import (
     DeliveryPartner,
     Review,
     Seller,
     Shipment,
     ShipmentStatus,
+    ShipmentTag,
+    Tag,
     TagName,
 )
+from app.database.profiles import (
+    SHIPMENT_DETAIL,
+    SHIPMENT_SCAN,
+    SHIPMENT_TRACK,
+    SHIPMENT_UPDATE,
+)
 from app.services.base import BaseService
 from app.services.deliver_partner import DeliveryPartnerService
 from app.services.shipment_event import ShipmentEventService
+from app.services.tag import tag_catalog
+from app.services.tracking import TrackingPage, render_tracking_page, tracking_pages
 from app.utils import decode_url_safe_token
 
 
@@ -30,39 +64,255 @@ class ShipmentService(BaseService):
         self.partner_service = partner_service
         self.event_service = event_service
 
-    async def get(self, id: UUID) -> Shipment | None:
-        return await self._get(id)
+    async def get(self, id: UUID, profile: Sequence[ORMOption] = ()) -> Shipment | None:
+        return await self._get(id, profile)
 
-    async def add(self, shipment_create: ShipmentCreate, seller: Seller) -> Shipment:
-        new_shipment = Shipment(
-            **shipment_create.model_dump(),
-            status=ShipmentStatus.placed,
-            estimated_delivery=datetime.now() + timedelta(days=3),
-            seller_id=seller.id,
+    async def get_tracking_page(self, id: UUID) -> TrackingPage:
+        page = await tracking_pages.get(id)
+
+        if page is None:
+            # Taken before the read, a change committed after it is not
+            # overwritten by this render
+            version = await tracking_pages.version(id)
+            shipment = await self.get(id, SHIPMENT_TRACK)
+            if shipment is None:
+                raise EntityNotFound
+
+            page = render_tracking_page(shipment)
+            await tracking_pages.set(id, page, version)
+
+        return page
+
+    async def get_by_tags(
+        self,
+        tags: TagFilterParams,
+        pagination: PaginationParams,
+        filters: ShipmentFilterParams,
+        profile: Sequence[ORMOption] = (),
+    ) -> dict:
+        return await self._paginate(
+            await self._tag_conditions(tags), pagination, filters, profile
         )
 
-        partner = await self.partner_service.assign_shipment(new_shipment)
+    async def stream_by_tags(
+        self,
+        tags: TagFilterParams,
+        pagination: PaginationParams,
+        filters: ShipmentFilterParams,
+        profile: Sequence[ORMOption] = (),
+    ) -> AsyncIterator[Sequence[Shipment]]:
+        """Every matching shipment, one page at a time"""
+        conditions = await self._tag_conditions(tags)
+        pagination = pagination.model_copy(update={"include_total": False})
+
+        while True:
+            page = await self._paginate(conditions, pagination, filters, profile)
+            yield page["shipments"]
+
+            # Nothing from earlier pages stays in the identity map,
+            # memory use does not grow with the number of matches
+            self.session.expunge_all()
+
+            if page["next_cursor"] is None:
+                return
+            pagination = pagination.model_copy(update={"cursor": page["next_cursor"]})
+
+    async def _tag_conditions(self, tags: TagFilterParams) -> list[ColumnElement[bool]]:
+        tag_ids = [(await self._tag(name)).id for name in tags.tag_name]
+
+        # Semi-joins on shipment_tag, served by its indexes either way round
+        def tagged(*ids: UUID):
+            return exists().where(
+                ShipmentTag.shipment_id == Shipment.id,
+                ShipmentTag.tag_id.in_(ids),  # type: ignore
+            )
+
+        conditions = (
+            [tagged(id) for id in tag_ids]
+            if tags.match == "all"
+            else [tagged(*tag_ids)]
+        )
+        if tags.seller_id:
+            conditions.append(Shipment.seller_id == tags.seller_id)
 
-        # Add the delivery partner foreign key
-        new_shipment.delivery_partner_id = partner.id
+        return conditions
 
-        shipment = await self._add(new_shipment)
+    async def get_seller_shipments(
+        self,
+        seller_id: UUID,
+        pagination: PaginationParams,
+        filters: ShipmentFilterParams,
+    ) -> dict:
+        return await self._paginate(
+            [Shipment.seller_id == seller_id], pagination, filters
+        )
 
-        event = await self.event_service.add(
-            shipment=shipment,
-            location=seller.zip_code,
-            status=ShipmentStatus.placed,
-            description=f"assigned to {partner.name}",
+    async def get_partner_shipments(
+        self,
+        partner_id: UUID,
+        pagination: PaginationParams,
+        filters: ShipmentFilterParams,
+    ) -> dict:
+        return await self._paginate(
+            [Shipment.delivery_partner_id == partner_id], pagination, filters
         )
 
-        shipment.timeline.append(event)
+    async def _paginate(
+        self,
+        conditions: list[ColumnElement[bool]],
+        pagination: PaginationParams,
+        filters: ShipmentFilterParams,
+        profile: Sequence[ORMOption] = (),
+    ) -> dict:
+        conditions = list(conditions)
+        if filters.status:
+            conditions.append(Shipment.current_status.in_(filters.status))  # type: ignore
+        if filters.created_after:
+            conditions.append(Shipment.created_at >= filters.created_after)
+        if filters.created_before:
+            conditions.append(Shipment.created_at < filters.created_before)
+
+        # Seek past the last seen row on the (created_at, id) index
+        # instead of skipping an offset
+        key = tuple_(Shipment.created_at, Shipment.id)
+        query = select(Shipment).where(*conditions)
+
+        if pagination.cursor:
+            last_key = tuple_(*decode_cursor(pagination.cursor))
+            query = query.where(
+                key > last_key if pagination.order == "asc" else key < last_key
+            )
+
+        order = asc if pagination.order == "asc" else desc
+        query = query.order_by(order(Shipment.created_at), order(Shipment.id))
+        shipments = (
+            await self.session.scalars(
+                query.limit(pagination.pageSize + 1).options(*profile)
+            )
+        ).all()
+
+        next_cursor = None
+        if len(shipments) > pagination.pageSize:
+            shipments = shipments[: pagination.pageSize]
+            next_cursor = encode_cursor(shipments[-1].created_at, shipments[-1].id)
+
+        total_shipments = None
+        if pagination.include_total:
+            total_shipments = await self.session.scalar(
+                select(func.count()).select_from(Shipment).where(*conditions)
+            )
+
+        return {
+            "shipments": shipments,
+            "total_shipments": total_shipments,
+            "next_cursor": next_cursor,
+        }
+
+    async def add(
+        self, shipment_create: ShipmentCreate, principal: Principal
+    ) -> Shipment:
+        # Origin location of the first event
+        seller = await self.session.get(Seller, principal.id)
+
+        shipment = self._new_shipment(shipment_create, seller, datetime.now())
+        try:
+            partner = await self.partner_service.assign_shipment(shipment)
+        except DeliveryPartnerNotAvailable:
+            ASSIGNMENTS_FAILED.inc()
+            raise
+
+        (shipment,) = await self._insert_placed([shipment], [partner], seller)
+        await self.session.commit()
+        self._count_created(1)
 
         return shipment
 
+    async def add_bulk(
+        self, shipment_creates: Sequence[ShipmentCreate], principal: Principal
+    ) -> list[Shipment | FastShipError]:
+        """Create many shipments in one transaction, returns the shipment
+        or the error for each item so one failure does not abort the rest"""
+        seller = await self.session.get(Seller, principal.id)
+        now = datetime.now()
+
+        shipments = [
+            self._new_shipment(shipment_create, seller, now)
+            for shipment_create in shipment_creates
+        ]
+        partners = await self.partner_service.assign_shipments(shipments)
+
+        results: list[Shipment | FastShipError] = [
+            DeliveryPartnerNotAvailable() for _ in shipments
+        ]
+        assigned = [index for index, partner in enumerate(partners) if partner]
+        if assigned:
+            inserted = await self._insert_placed(
+                [shipments[index] for index in assigned],
+                [partners[index] for index in assigned],  # type: ignore
+                seller,
+            )
+            for index, shipment in zip(assigned, inserted):
+                results[index] = shipment
+
+        await self.session.commit()
+        self._count_created(len(assigned))
+        ASSIGNMENTS_FAILED.inc(len(shipments) - len(assigned))
+
+        return results
+
+    @staticmethod
+    def _count_created(count: int):
+        SHIPMENTS_CREATED.inc(count)
+        SHIPMENT_EVENTS.labels(ShipmentStatus.placed.value).inc(count)
+
+    def _new_shipment(
+        self, shipment_create: ShipmentCreate, seller: Seller, now: datetime
+    ) -> Shipment:
+        return Shipment(
+            **shipment_create.model_dump(),
+            id=uuid4(),
+            created_at=now,
+            estimated_delivery=now + timedelta(days=3),
+            current_status=ShipmentStatus.placed,
+            current_location=seller.zip_code,
+            seller_id=seller.id,
+        )
+
+    async def _insert_placed(
+        self,
+        shipments: Sequence[Shipment],
+        partners: Sequence[DeliveryPartner],
+        seller: Seller,
+    ) -> Sequence[Shipment]:
+        """Insert new shipments and their placed events, returning rows
+        that serialize as ShipmentRead without being loaded again"""
+        inserted = (
+            await self.session.scalars(
+                insert(Shipment).returning(Shipment, sort_by_parameter_order=True),
+                [
+                    {**shipment.model_dump(), "delivery_partner_id": partner.id}
+                    for shipment, partner in zip(shipments, partners)
+                ],
+            )
+        ).all()
+
+        for shipment, partner in zip(inserted, partners):
+            set_committed_value(shipment, "seller", seller)
+            set_committed_value(shipment, "delivery_partner", partner)
+
+        events = await self.event_service.add_placed(inserted, seller.zip_code)
+
+        # Nothing else is attached to a new shipment yet
+        for shipment, event in zip(inserted, events):
+            set_committed_value(shipment, "timeline", [event])
+            set_committed_value(shipment, "tags", [])
+
+        return inserted
+
     async def update(
-        self, id: UUID, shipment_update: ShipmentUpdate, partner: DeliveryPartner
+        self, id: UUID, shipment_update: ShipmentUpdate, partner: Principal
     ) -> Shipment:
-        shipment = await self.get(id)
+        shipment = await self.get(id, SHIPMENT_UPDATE)
 
         if shipment is None:
             raise EntityNotFound
@@ -70,15 +320,65 @@ class ShipmentService(BaseService):
         if shipment.delivery_partner_id != partner.id:
             raise ClientNotAuthorized
 
-        update = shipment_update.model_dump(exclude_none=True)
+        update = shipment_update.model_dump(
+            exclude_none=True, exclude={"estimated_delivery"}
+        )
 
         if shipment_update.estimated_delivery:
             shipment.estimated_delivery = shipment_update.estimated_delivery
 
-        if len(update) > 1 or not shipment_update.estimated_delivery:
+        if update:
             await self.event_service.add(shipment=shipment, **update)
 
-        return await self._update(shipment)
+        shipment = await self._update(shipment)
+        if not update:
+            # Only the estimated delivery changed, no new event dropped the page
+            await tracking_pages.invalidate([shipment.id])
+
+        return shipment
+
+    async def record_scans(
+        self, scans: Sequence[ShipmentScan], partner: Principal
+    ) -> list[str | FastShipError]:
+        """Record a batch of scans of the partner's shipments, returns
+        recorded, duplicate or the error for each scan"""
+        shipments = {
+            shipment.id: shipment
+            for shipment in (
+                await self.session.scalars(
+                    select(Shipment)
+                    .where(
+                        Shipment.id.in_({scan.shipment_id for scan in scans})  # type: ignore
+                    )
+                    .options(*SHIPMENT_SCAN)
+                    .execution_options(populate_existing=True)
+                )
+            ).unique()
+        }
+
+        results: list[str | FastShipError] = []
+        accepted: list[tuple[Shipment, ShipmentScan]] = []
+        positions: list[int] = []
+        for index, scan in enumerate(scans):
+            shipment = shipments.get(scan.shipment_id)
+            if shipment is None:
+                results.append(EntityNotFound())
+            elif shipment.delivery_partner_id != partner.id:
+                results.append(ClientNotAuthorized())
+            else:
+                results.append("recorded")
+                accepted.append((shipment, scan))
+                positions.append(index)
+
+        if accepted:
+            new = await self.event_service.add_scans(accepted)
+            for index, is_new in zip(positions, new):
+                if not is_new:
+                    results[index] = "duplicate"
+            await self.session.commit()
+            await self.event_service.publish_recorded()
+
+        return results
 
     async def rate(self, token: str, rating: int, comment: str | None):
         token_data = decode_url_safe_token(token)
@@ -98,9 +398,9 @@ class ShipmentService(BaseService):
         self.session.add(new_review)
         await self.session.commit()
 
-    async def cancel(self, id: UUID, seller: Seller) -> Shipment:
+    async def cancel(self, id: UUID, seller: Principal) -> Shipment:
         # Validate seller
-        shipment = await self.get(id)
+        shipment = await self.get(id, SHIPMENT_UPDATE)
 
         if shipment is None:
             raise EntityNotFound
@@ -120,25 +420,56 @@ class ShipmentService(BaseService):
         shipment = await self.get(id)
         if shipment is not None:
             await self._delete(shipment)
+            await tracking_pages.invalidate([id])
 
     async def add_tag(self, id: UUID, tag_name: TagName):
-        shipment = await self.get(id)
+        shipment = await self.get(id, SHIPMENT_DETAIL)
         if shipment is None:
             raise EntityNotFound
 
-        shipment.tags.append(await tag_name.tag(self.session))
+        tag = await self._tag(tag_name)
+
+        # Written to the link table directly, tagging twice is a no-op
+        await self.session.execute(
+            self._insert_ignore(ShipmentTag.__table__).values(  # type: ignore
+                shipment_id=shipment.id, tag_id=tag.id
+            )
+        )
+        await self.session.commit()
+
+        if tag.id not in {tag.id for tag in shipment.tags}:
+            set_committed_value(shipment, "tags", [*shipment.tags, tag])
 
-        return await self._update(shipment)
+        return shipment
 
     async def remove_tag(self, id: UUID, tag_name: TagName):
-        shipment = await self.get(id)
+        shipment = await self.get(id, SHIPMENT_DETAIL)
 
         if shipment is None:
             raise EntityNotFound
 
-        try:
-            shipment.tags.remove(await tag_name.tag(self.session))
-        except ValueError:
+        tag = await self._tag(tag_name)
+
+        result = await self.session.execute(
+            delete(ShipmentTag).where(
+                ShipmentTag.shipment_id == shipment.id,  # type: ignore
+                ShipmentTag.tag_id == tag.id,  # type: ignore
+            )
+        )
+        if result.rowcount == 0:  # type: ignore
+            raise EntityNotFound
+        await self.session.commit()
+
+        set_committed_value(
+            shipment, "tags", [other for other in shipment.tags if other.id != tag.id]
+        )
+
+        return shipment
+
+    async def _tag(self, tag_name: TagName) -> Tag:
+        tag = await tag_catalog.get(self.session, tag_name)
+
+        if tag is None:
             raise EntityNotFound
 
-        return await self._update(shipment)
+        return tag
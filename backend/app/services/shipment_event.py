@@ -1,13 +1,47 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Sequence
+from uuid import UUID, uuid4, uuid5
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import desc, insert, select, update
+
+from app.api.schemas.shipment import ShipmentScan
 from app.config import app_settings
-from app.database.models import Shipment, ShipmentEvent, ShipmentStatus
+from app.core.metrics import SHIPMENT_EVENTS
+from app.database.models import (
+    FINAL_SHIPMENT_STATUSES,
+    Shipment,
+    ShipmentEvent,
+    ShipmentStatus,
+)
 from app.services.base import BaseService
+from app.services.deliver_partner import DeliveryPartnerService
+from app.services.event_stream import publish_shipment_events
+from app.services.outbox import OutboxService
+from app.services.tracking import tracking_pages
+from app.services.webhook import WebhookService
 from app.utils import generate_url_safe_token
 from app.worker.tasks import send_email_with_template
 
+# Namespace of scanned event ids, see ShipmentEventService.add_scans
+SCAN_NAMESPACE = UUID("670062d8-2a3d-43cf-b443-eeeb4572ea78")
+
+
+def _local_naive(timestamp: datetime) -> datetime:
+    # Event times are stored as naive local time, like datetime.now()
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
 
 class ShipmentEventService(BaseService):
     def __init__(self, session):
         super().__init__(ShipmentEvent, session)
+        self.partner_service = DeliveryPartnerService(session)
+        self.outbox = OutboxService(session)
+        self.webhooks = WebhookService(session)
+        # Events written since the last publish_recorded
+        self._recorded: list[ShipmentEvent] = []
 
     async def add(
         self,
@@ -16,13 +50,15 @@ class ShipmentEventService(BaseService):
         status: ShipmentStatus | None = None,
         description: str | None = None,
     ):
-        if not location or not status:
-            last_event = await self.get_latest_event(shipment)
+        previous_status = shipment.current_status
 
-            location = location if location else last_event.location
-            status = status if status else last_event.status
+        location = location if location else shipment.current_location
+        status = status if status else shipment.current_status
 
         new_event = ShipmentEvent(
+            # Set here, the webhook payload is built before the insert
+            id=uuid4(),
+            created_at=datetime.now(),
             location=location,
             status=status,
             description=(
@@ -33,15 +69,52 @@ class ShipmentEventService(BaseService):
             shipment_id=shipment.id,
         )
 
+        # Committed along with the event
+        shipment.current_status = status
+        shipment.current_location = location
+        self.session.add(shipment)
+
+        await self._update_partner_capacity(shipment, previous_status, status)
         await self._notify(shipment, status)
+        await self.webhooks.enqueue([(shipment, new_event)])
 
-        return await self._add(new_event)
+        event = await self._add(new_event)
+        self._recorded.append(event)
+        await self.publish_recorded()
+
+        return event
+
+    async def publish_recorded(self):
+        """Call after committing new events, they are counted, streams get
+        them and cached tracking pages of their shipments are dropped"""
+        events, self._recorded = self._recorded, []
+        for status, count in Counter(
+            ShipmentStatus(event.status).value for event in events
+        ).items():
+            SHIPMENT_EVENTS.labels(status).inc(count)
+        await tracking_pages.invalidate({event.shipment_id for event in events})
+        await publish_shipment_events(events)
 
     async def get_latest_event(self, shipment: Shipment):
         timeline = shipment.timeline
         timeline.sort(key=lambda item: item.created_at)
         return timeline[-1]
 
+    async def _update_partner_capacity(
+        self,
+        shipment: Shipment,
+        previous: ShipmentStatus | None,
+        current: ShipmentStatus,
+    ):
+        # Only transitions into or out of a final status free or take capacity
+        was_active = previous not in FINAL_SHIPMENT_STATUSES
+        is_active = current not in FINAL_SHIPMENT_STATUSES
+
+        if was_active != is_active:
+            await self.partner_service.change_active_shipment_count(
+                shipment.delivery_partner_id, 1 if is_active else -1
+            )
+
     def _generate_description(self, status: ShipmentStatus, location: int):
         match status:
             case ShipmentStatus.placed:
@@ -61,10 +134,157 @@ class ShipmentEventService(BaseService):
             case _:
                 return f"scanned at {location}"
 
+    async def add_placed(
+        self, shipments: Sequence[Shipment], location: int
+    ) -> Sequence[ShipmentEvent]:
+        """Initial events for new shipments in one multi-row insert, the
+        shipments need their seller and delivery partner set"""
+        events = (
+            await self.session.scalars(
+                insert(ShipmentEvent).returning(
+                    ShipmentEvent, sort_by_parameter_order=True
+                ),
+                [
+                    {
+                        "id": uuid4(),
+                        "created_at": shipment.created_at,
+                        "location": location,
+                        "status": ShipmentStatus.placed,
+                        "description": f"assigned to {shipment.delivery_partner.name}",
+                        "shipment_id": shipment.id,
+                    }
+                    for shipment in shipments
+                ],
+            )
+        ).all()
+
+        await self.outbox.enqueue_many(
+            send_email_with_template,
+            [self._email(shipment, ShipmentStatus.placed) for shipment in shipments],
+        )
+        await self.webhooks.enqueue(zip(shipments, events))
+
+        return events
+
+    async def add_scans(
+        self, scans: Sequence[tuple[Shipment, ShipmentScan]]
+    ) -> list[bool]:
+        """Record scanned events in one insert and move each shipment to its
+        latest event, returns whether each scan was new or a replay.
+        Call publish_recorded once committed"""
+        # Same scan, same id, so a replayed scan conflicts instead of
+        # adding a second event
+        events = {}
+        ids = []
+        for shipment, scan in scans:
+            timestamp = _local_naive(scan.timestamp)
+            id = uuid5(
+                SCAN_NAMESPACE,
+                f"{shipment.id}/{scan.status.value}/{scan.location}/{timestamp.isoformat()}",
+            )
+            ids.append(id)
+            events.setdefault(
+                id,
+                {
+                    "id": id,
+                    "created_at": timestamp,
+                    "shipment_id": shipment.id,
+                    "status": scan.status,
+                    "location": scan.location,
+                    "description": scan.description
+                    or self._generate_description(scan.status, scan.location),
+                },
+            )
+
+        table = ShipmentEvent.__table__  # type: ignore
+        recorded = set(
+            (
+                await self.session.scalars(
+                    self._insert_ignore(table)
+                    .values(list(events.values()))
+                    .returning(table.c.id)
+                )
+            ).all()
+        )
+
+        shipment_of = {shipment.id: shipment for shipment, _ in scans}
+        new_events = [
+            ShipmentEvent(**event) for id, event in events.items() if id in recorded
+        ]
+        await self.webhooks.enqueue(
+            (shipment_of[event.shipment_id], event) for event in new_events
+        )
+        self._recorded.extend(new_events)
+
+        # Each recorded id counts once, a repeat within the batch is a replay
+        new = []
+        for id in ids:
+            new.append(id in recorded)
+            recorded.discard(id)
+
+        shipments = {
+            shipment.id: shipment for (shipment, _), is_new in zip(scans, new) if is_new
+        }
+        if shipments:
+            await self._update_current_status(shipments)
+
+        return new
+
+    async def _update_current_status(self, shipments: dict[UUID, Shipment]):
+        # Latest by the scanner's timestamp, scans may arrive out of order
+        latest = (
+            select(ShipmentEvent)
+            .where(ShipmentEvent.shipment_id == Shipment.id)
+            .order_by(desc(ShipmentEvent.created_at))  # type: ignore
+            .limit(1)
+            .correlate(Shipment)
+        )
+        rows = await self.session.execute(
+            update(Shipment)
+            .where(Shipment.id.in_(shipments))  # type: ignore
+            .values(
+                current_status=latest.with_only_columns(
+                    ShipmentEvent.status
+                ).scalar_subquery(),
+                current_location=latest.with_only_columns(
+                    ShipmentEvent.location
+                ).scalar_subquery(),
+            )
+            .returning(Shipment.id, Shipment.current_status, Shipment.current_location)
+            .execution_options(synchronize_session=False)
+        )
+
+        deltas: dict[UUID, int] = defaultdict(int)
+        emails = []
+        for id, status, location in rows.all():
+            shipment = shipments[id]
+            previous = shipment.current_status
+            set_committed_value(shipment, "current_status", status)
+            set_committed_value(shipment, "current_location", location)
+            if status == previous:
+                continue
+
+            was_active = previous not in FINAL_SHIPMENT_STATUSES
+            is_active = status not in FINAL_SHIPMENT_STATUSES
+            if was_active != is_active:
+                deltas[shipment.delivery_partner_id] += 1 if is_active else -1
+
+            if email := self._email(shipment, status):
+                emails.append(email)
+
+        await self.partner_service.change_active_shipment_counts(
+            {id: delta for id, delta in deltas.items() if delta}
+        )
+        await self.outbox.enqueue_many(send_email_with_template, emails)
+
     async def _notify(self, shipment: Shipment, status: ShipmentStatus):
-        if status == ShipmentStatus.in_transit:
-            return
+        email = self._email(shipment, status)
+        if email is not None:
+            self.outbox.enqueue(send_email_with_template, **email)
 
+    def _email(self, shipment: Shipment, status: ShipmentStatus) -> dict | None:
+        """Keyword arguments of send_email_with_template, None for statuses
+        the client is not emailed about"""
         subject: str
         context = {}
         template_name: str
@@ -95,9 +315,12 @@ class ShipmentEventService(BaseService):
                 subject = "Your Order is Cancelled ❌"
                 template_name = "mail_cancelled.html"
 
-        send_email_with_template(
-            recipients=[shipment.client_contact_email],
-            subject=subject,
-            context=context,
-            template_name=template_name,
-        )
+            case _:
+                return None
+
+        return {
+            "recipients": [shipment.client_contact_email],
+            "subject": subject,
+            "context": context,
+            "template_name": template_name,
+        }
@@ -0,0 +1,45 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.database.models import Tag, TagName
+from app.database.redis import on_invalidation
+
+
+class TagCatalog:
+    """Tags by name, loaded once per process. The api never writes the tag
+    table, whatever changes it publishes to the "tags" invalidation channel
+    and every process reloads its catalog. Names missing after a reload stay
+    missing until the next invalidation"""
+
+    def __init__(self):
+        self._tags: dict[TagName, Tag] | None = None
+        self._missing: set[TagName] = set()
+
+    async def get(self, session: AsyncSession, name: TagName) -> Tag | None:
+        if name in self._missing:
+            return None
+        tag = self._tags.get(name) if self._tags is not None else None
+
+        # A tag added since the catalog was loaded is picked up on a miss
+        if tag is None:
+            await self._load(session)
+            tag = self._tags.get(name)  # type: ignore
+            if tag is None:
+                self._missing.add(name)
+
+        return tag
+
+    async def _load(self, session: AsyncSession):
+        tags = (await session.scalars(select(Tag))).all()
+        # Detached, so no request expires or refreshes the shared copies
+        for tag in tags:
+            session.expunge(tag)
+        self._tags = {tag.name: tag for tag in tags}
+
+    def invalidate(self, message: str | None = None):
+        self._tags = None
+        self._missing = set()
+
+
+tag_catalog = TagCatalog()
+on_invalidation("tags", tag_catalog.invalidate)
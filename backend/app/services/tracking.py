@@ -0,0 +1,158 @@
+import json
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import sha256
+from typing import Iterable, Mapping
+from uuid import UUID
+
+from jinja2 import Environment, FileSystemLoader
+
+from app.config import app_settings
+from app.core.cache import TTLCache
+from app.database.models import Shipment
+from app.database.redis import (
+    get_cache_version,
+    get_cached,
+    invalidate_cached,
+    on_invalidation,
+    publish_invalidation,
+    set_cached,
+)
+from app.utils import TEMPLATE_DIR
+
+# Same settings as the routers' Jinja2Templates
+_templates = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=True)
+
+
+@dataclass
+class TrackingPage:
+    body: str
+    etag: str
+    # Time of the latest event, in UTC
+    last_modified: datetime
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": format_datetime(self.last_modified, usegmt=True),
+            "Cache-Control": f"public, max-age={app_settings.TRACKING_MAX_AGE}",
+        }
+
+    def not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        """Whether the client's copy is current, If-None-Match wins over
+        If-Modified-Since when both are sent"""
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return self.etag in [tag.strip() for tag in if_none_match.split(",")]
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            # HTTP dates have no fraction of a second
+            return self.last_modified.replace(microsecond=0) <= since
+
+        return False
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {**asdict(self), "last_modified": self.last_modified.isoformat()}
+        )
+
+    @classmethod
+    def loads(cls, data: bytes) -> "TrackingPage":
+        page = json.loads(data)
+        page["last_modified"] = datetime.fromisoformat(page["last_modified"])
+        return cls(**page)
+
+
+def render_tracking_page(shipment: Shipment) -> TrackingPage:
+    """Shipment needs the SHIPMENT_TRACK profile"""
+    timeline = sorted(shipment.timeline, key=lambda event: event.created_at)
+
+    context = shipment.model_dump()
+    context["status"] = shipment.status
+    context["partner"] = shipment.delivery_partner.name
+    context["timeline"] = timeline[::-1]
+
+    body = _templates.get_template("track.html").render(context)
+
+    return TrackingPage(
+        body=body,
+        # Changes with any new event, and with edits like the estimated delivery
+        etag=f'"{timeline[-1].id.hex[:16]}-{sha256(body.encode()).hexdigest()[:16]}"',
+        # Event times are naive local time
+        last_modified=timeline[-1].created_at.astimezone(timezone.utc),
+    )
+
+
+class TrackingPageCache:
+    """Rendered tracking pages by shipment id, in process and in Redis,
+    dropped everywhere when the shipment changes. A page rendered from a
+    read older than the latest change is not stored"""
+
+    def __init__(self):
+        self._pages = TTLCache(
+            maxsize=app_settings.TRACKING_CACHE_SIZE,
+            ttl=app_settings.TRACKING_CACHE_TTL,
+        )
+        # Invalidations seen by this process
+        self._invalidations = 0
+
+    @staticmethod
+    def _key(id: UUID) -> str:
+        return f"tracking:{id.hex}"
+
+    async def get(self, id: UUID) -> TrackingPage | None:
+        page = self._pages.get(id)
+
+        if page is None:
+            data = await get_cached(self._key(id))
+            if data is not None:
+                page = TrackingPage.loads(data)
+                self._pages.set(id, page)
+
+        return page
+
+    async def version(self, id: UUID) -> tuple[int, str]:
+        """Take before reading the shipment, and pass to set"""
+        return self._invalidations, await get_cache_version(self._key(id))
+
+    async def set(self, id: UUID, page: TrackingPage, version: tuple[int, str]):
+        invalidations, cached = version
+        stored = await set_cached(
+            self._key(id), page.dumps(), app_settings.TRACKING_CACHE_TTL, cached
+        )
+        # Neither changed in Redis nor, by a message, in this process
+        if stored and invalidations == self._invalidations:
+            self._pages.set(id, page)
+
+    async def invalidate(self, ids: Iterable[UUID]):
+        """Call after committing changes to the shipments"""
+        ids = list(ids)
+        if not ids:
+            return
+
+        self._invalidations += 1
+        for id in ids:
+            self._pages.pop(id)
+        await invalidate_cached(
+            *(self._key(id) for id in ids), seconds=app_settings.TRACKING_CACHE_TTL
+        )
+        await publish_invalidation("tracking", ",".join(id.hex for id in ids))
+
+    def on_invalidation(self, message: str | None):
+        self._invalidations += 1
+        if message is None:
+            self._pages.clear()
+            return
+        for id in message.split(","):
+            self._pages.pop(UUID(id))
+
+
+tracking_pages = TrackingPageCache()
+on_invalidation("tracking", tracking_pages.on_invalidation)
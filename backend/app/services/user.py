@@ -1,12 +1,21 @@
 from datetime import timedelta
+from typing import Literal, Sequence
 from uuid import UUID
 from pydantic import EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from passlib.context import CryptContext
-from app.core.exceptions import ClientNotVerified, EntityNotFound, InvalidToken
+from sqlalchemy.orm.interfaces import ORMOption
+from app.core.cache import TTLCache
+from app.core.exceptions import (
+    ClientNotAuthorized,
+    ClientNotVerified,
+    EntityNotFound,
+    InvalidToken,
+)
+from app.core.security import Principal, passwords
 from app.database.models import User
 from app.services.base import BaseService
+from app.services.outbox import OutboxService
 from app.utils import (
     decode_url_safe_token,
     generate_access_token,
@@ -16,21 +25,60 @@ from app.config import app_settings
 from app.config import security_settings
 from app.worker.tasks import send_email_with_template
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Principals by (role, id), shared by all requests of this process
+_principal_cache = TTLCache(
+    maxsize=security_settings.PRINCIPAL_CACHE_SIZE,
+    ttl=security_settings.PRINCIPAL_CACHE_TTL,
+)
 
 
 class UserService(BaseService):
+    role: Literal["seller", "partner"]
+
     def __init__(self, model: User, session: AsyncSession):
         self.model = model
         self.session = session
+        self.outbox = OutboxService(session)
+
+    async def get(self, id: UUID, profile: Sequence[ORMOption] = ()):
+        return await self._get(id, profile)
+
+    async def get_principal(self, id: UUID) -> Principal:
+        principal = _principal_cache.get((self.role, id))
+
+        if principal is None:
+            # Only the columns needed to authorize a request
+            user = (
+                await self.session.execute(
+                    select(
+                        self.model.id, self.model.name, self.model.email_verified
+                    ).where(self.model.id == id)
+                )
+            ).one_or_none()
+
+            if user is None:
+                raise ClientNotAuthorized
+
+            principal = Principal(
+                id=user.id,
+                name=user.name,
+                email_verified=user.email_verified,
+                role=self.role,
+            )
+            _principal_cache.set((self.role, id), principal)
+
+        return principal
 
     async def _add_user(self, data: dict, router_prefix: str) -> User:
-        user = self.model(**data, password_hash=password_context.hash(data["password"]))
-        user = await self._add(user)
+        user = self.model(**data, password_hash=await passwords.hash(data["password"]))
+        self.session.add(user)
+        # Assign the id for the verification token
+        await self.session.flush()
 
-        token = generate_url_safe_token({"email": user.email, "id": user.id})
+        token = generate_url_safe_token({"email": user.email, "id": str(user.id)})
 
-        send_email_with_template(
+        self.outbox.enqueue(
+            send_email_with_template,
             recipients=[user.email],
             subject="Verify Your Account With FastShip",
             context={
@@ -40,7 +88,7 @@ class UserService(BaseService):
             template_name="mail_email_verify.html",
         )
 
-        return user
+        return await self._add(user)
 
     async def verify_email(self, token: str):
         token_data = decode_url_safe_token(token)
@@ -52,6 +100,8 @@ class UserService(BaseService):
         user.email_verified = True
         await self._update(user)
 
+        _principal_cache.pop((self.role, user.id))
+
     async def _get_by_email(self, email: str) -> User | None:
         return await self.session.scalar(
             select(self.model).where(self.model.email == email)
@@ -61,12 +111,23 @@ class UserService(BaseService):
         # Validate the credentials
         user = await self._get_by_email(email)
 
-        if user is None or not password_context.verify(password, user.password_hash):
+        if user is None:
+            raise EntityNotFound
+
+        valid, new_hash = await passwords.verify_and_update(
+            password, user.password_hash
+        )
+        if not valid:
             raise EntityNotFound
 
         if not user.email_verified:
             raise ClientNotVerified
 
+        # Stored with another bcrypt cost
+        if new_hash is not None:
+            user.password_hash = new_hash
+            await self.session.commit()
+
         return generate_access_token(
             data={"user": {"name": user.name, "id": str(user.id)}}
         )
@@ -81,7 +142,8 @@ class UserService(BaseService):
             {"id": str(user.id)}, salt=security_settings.SECURITY_SALT
         )
 
-        send_email_with_template(
+        self.outbox.enqueue(
+            send_email_with_template,
             recipients=[user.email],
             subject="FastShip Account Password Reset",
             context={
@@ -90,6 +152,7 @@ class UserService(BaseService):
             },
             template_name="mail_password_reset.html",
         )
+        await self.session.commit()
 
     async def reset_password(self, token: str, password: str) -> bool:
         token_data = decode_url_safe_token(
@@ -100,7 +163,7 @@ class UserService(BaseService):
             return False
 
         user = await self._get(UUID(token_data["id"]))
-        user.password_hash = password_context.hash(password)
+        user.password_hash = await passwords.hash(password)
 
         await self._update(user)
 
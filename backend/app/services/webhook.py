@@ -0,0 +1,147 @@
+import secrets
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, Sequence
+from urllib.parse import urlsplit
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, insert, select, update
+
+from app.config import worker_settings
+from app.core.exceptions import EntityNotFound, InvalidWebhookUrl
+from app.database.models import Shipment, ShipmentEvent, Webhook, WebhookDelivery
+from app.services.base import BaseService
+from app.worker.webhooks import is_public_address
+
+
+def _check_url(url: str):
+    """Deliveries are posted from inside our network, so only to https
+    urls of public hosts. The dispatcher checks the resolved address of
+    every post too, a hostname can point anywhere later"""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if parts.scheme != "https" or host == "localhost" or host.endswith(".localhost"):
+        raise InvalidWebhookUrl
+
+    try:
+        public = is_public_address(host)
+    except ValueError:
+        # A hostname, resolved when posting
+        return
+    if not public:
+        raise InvalidWebhookUrl
+
+
+class WebhookService(BaseService):
+    def __init__(self, session: AsyncSession):
+        super().__init__(Webhook, session)
+
+    async def add(self, seller_id: UUID, url: str) -> Webhook:
+        if not worker_settings.WEBHOOK_ALLOW_PRIVATE:
+            _check_url(url)
+
+        return await self._add(
+            Webhook(url=url, secret=secrets.token_urlsafe(32), seller_id=seller_id)
+        )
+
+    async def get_seller_webhooks(self, seller_id: UUID) -> Sequence[Webhook]:
+        return (
+            await self.session.scalars(
+                select(Webhook)
+                .where(Webhook.seller_id == seller_id)
+                .order_by(Webhook.created_at)  # type: ignore
+            )
+        ).all()
+
+    async def _get_own(self, id: UUID, seller_id: UUID) -> Webhook:
+        webhook = await self._get(id)
+
+        if webhook is None or webhook.seller_id != seller_id:
+            raise EntityNotFound
+
+        return webhook
+
+    async def delete(self, id: UUID, seller_id: UUID) -> None:
+        webhook = await self._get_own(id, seller_id)
+
+        # Pending deliveries and dead letters go with it
+        await self.session.execute(
+            delete(WebhookDelivery).where(
+                WebhookDelivery.webhook_id == webhook.id  # type: ignore
+            )
+        )
+        await self._delete(webhook)
+        await self.session.commit()
+
+    async def get_dead_letters(
+        self, id: UUID, seller_id: UUID, limit: int
+    ) -> Sequence[WebhookDelivery]:
+        webhook = await self._get_own(id, seller_id)
+
+        return (
+            await self.session.scalars(
+                select(WebhookDelivery)
+                .where(
+                    WebhookDelivery.webhook_id == webhook.id,
+                    WebhookDelivery.dead_at != None,  # noqa: E711
+                )
+                .order_by(WebhookDelivery.created_at)  # type: ignore
+                .limit(limit)
+            )
+        ).all()
+
+    async def redeliver(self, id: UUID, seller_id: UUID) -> int:
+        """Queue the webhook's dead letters again with fresh attempts,
+        returns how many"""
+        webhook = await self._get_own(id, seller_id)
+
+        result = await self.session.execute(
+            update(WebhookDelivery)
+            .where(
+                WebhookDelivery.webhook_id == webhook.id,  # type: ignore
+                WebhookDelivery.dead_at != None,  # noqa: E711
+            )
+            .values(attempts=0, dead_at=None, next_attempt_at=datetime.now())
+        )
+        await self.session.commit()
+
+        return result.rowcount  # type: ignore
+
+    async def enqueue(self, events: Iterable[tuple[Shipment, ShipmentEvent]]):
+        """Deliveries of new events to their sellers' webhooks, committed
+        by the caller with the events, app.worker.tasks.dispatch_webhooks
+        posts them"""
+        by_seller: dict[UUID, list[ShipmentEvent]] = defaultdict(list)
+        for shipment, event in events:
+            by_seller[shipment.seller_id].append(event)
+
+        if not by_seller:
+            return
+
+        webhooks = (
+            await self.session.execute(
+                select(Webhook.id, Webhook.seller_id).where(
+                    Webhook.seller_id.in_(by_seller)  # type: ignore
+                )
+            )
+        ).all()
+
+        # One multi-row insert for every webhook and event
+        if webhooks:
+            now = datetime.now()
+            await self.session.execute(
+                insert(WebhookDelivery),
+                [
+                    {
+                        "webhook_id": webhook_id,
+                        "payload": event.model_dump(mode="json"),
+                        # Strictly increasing, each webhook is posted its
+                        # events in this order
+                        "created_at": now + timedelta(microseconds=index),
+                        "next_attempt_at": now,
+                    }
+                    for webhook_id, seller_id in webhooks
+                    for index, event in enumerate(by_seller[seller_id])
+                ],
+            )
@@ -1,15 +1,20 @@
 from uuid import UUID
 from fastapi.testclient import TestClient
 from httpx import ASGITransport, AsyncClient
+import pytest
 import pytest_asyncio
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
-from app.database.session import get_session
+from app.database.queries import instrument_queries, track_queries
+from app.database.redis import RATE_LIMIT_PREFIX, _redis
+from app.database.session import get_read_session, get_session, get_session_factory
 from app.main import app
 from app.tests import example
 
 engine = create_async_engine(url="sqlite+aiosqlite:///:memory:")
+instrument_queries(engine)
 test_session = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -30,6 +35,48 @@ async def client():
         yield client
 
 
+@pytest_asyncio.fixture
+async def session():
+    async with test_session() as session:
+        yield session
+
+
+@pytest.fixture
+def queries():
+    """SQL statements sent to the test database while the fixture is active"""
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture(autouse=True)
+def query_budget(request: pytest.FixtureRequest):
+    """Fails a test marked query_budget(n) when any request it makes,
+    or the test itself if it makes none, runs more than n statements"""
+    marker = request.node.get_closest_marker("query_budget")
+    if marker is None:
+        yield None
+        return
+
+    budget = marker.args[0]
+    with track_queries(request.node.name) as stats:
+        yield stats
+
+    over = [
+        f"{tracked.label}: {tracked.count} queries, "
+        f"most repeated ran {tracked.repeated} times"
+        for tracked in stats.nested or [stats]
+        if tracked.count > budget
+    ]
+    if over:
+        pytest.fail(f"Query budget of {budget} exceeded\n" + "\n".join(over))
+
+
 @pytest_asyncio.fixture(scope="session")
 async def seller_token(client: AsyncClient):
     response = await client.post(
@@ -44,11 +91,27 @@ async def seller_token(client: AsyncClient):
     return response.json()["access_token"]
 
 
+@pytest_asyncio.fixture(scope="session")
+async def partner_token(client: AsyncClient):
+    response = await client.post(
+        "/partner/token",
+        data={
+            "grant_type": "password",
+            "username": example.DELIVERY_PARTNER["email"],
+            "password": example.DELIVERY_PARTNER["password"],
+        },
+    )
+    assert "access_token" in response.json()
+    return response.json()["access_token"]
+
+
 @pytest_asyncio.fixture(scope="session", autouse=True)
 async def setup_and_teardown():
     print("🧪 starting tests...")
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    app.dependency_overrides[get_session_factory] = lambda: test_session
 
     async with engine.begin() as connection:
         from app.database.models import DeliveryPartner, Seller, Shipment  # noqa: F401
@@ -58,6 +121,10 @@ async def setup_and_teardown():
     async with test_session() as session:
         await example.create_test_data(session)
 
+    # Buckets left by an earlier run would limit this one
+    async for key in _redis.scan_iter(f"{RATE_LIMIT_PREFIX}*"):
+        await _redis.delete(key)
+
     yield
 
     async with engine.begin() as connection:
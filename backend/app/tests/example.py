@@ -1,7 +1,7 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.models import DeliveryPartner, Location, Seller
-from app.services.user import password_context
+from app.core.security import passwords
 
 SELLER = {
     "name": "RainForest",
@@ -14,7 +14,7 @@ DELIVERY_PARTNER = {
     "email": "phl@xmailg.one",
     "password": "tough",
     "zip_code": 11002,
-    "max_handling_capacity": 2,
+    "max_handling_capacity": 50,
     "serviceable_zip_codes": [11001, 11002, 11003, 11004, 11005],
 }
 SHIPMENT = {
@@ -30,15 +30,15 @@ async def create_test_data(session: AsyncSession):
         Seller(
             **SELLER,
             email_verified=True,
-            password_hash=password_context.hash(SELLER["password"]),
+            password_hash=passwords.context.hash(SELLER["password"]),
         )
     )
     session.add(
         DeliveryPartner(
             **DELIVERY_PARTNER,
             email_verified=True,
-            password_hash=password_context.hash(DELIVERY_PARTNER["password"]),
-            servicable_locations=[
+            password_hash=passwords.context.hash(DELIVERY_PARTNER["password"]),
+            serviceable_locations=[
                 Location(zip_code=zip_code)
                 for zip_code in DELIVERY_PARTNER["serviceable_zip_codes"]
             ],
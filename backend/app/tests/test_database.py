@@ -0,0 +1,203 @@
+import asyncio
+from time import time
+from uuid import uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY
+from redis.exceptions import ConnectionError
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import db_settings
+from app.core.middleware import QueryStatsMiddleware
+from app.database.blacklist import blacklist_report, compact_blacklist
+from app.database.pool import InstrumentedPool, instrument_pool
+from app.database.redis import (
+    _redis,
+    add_jti_to_blacklist,
+    blacklist_bucket,
+    blacklist_key,
+    is_jti_blacklisted,
+)
+from app.database import replicas
+from app.database.replicas import ReadSessionRouter
+from app.main import app
+from app.utils import ACCESS_TOKEN_EXPIRY
+
+
+def sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name, {"database": "test"}) or 0
+
+
+async def test_pool_metrics():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        poolclass=InstrumentedPool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    instrument_pool(engine, "test")
+
+    waits = sample("fastship_db_pool_checkout_wait_seconds_count")
+    timeouts = sample("fastship_db_pool_checkout_timeouts_total")
+    held = sample("fastship_db_pool_connection_held_seconds_count")
+    checked_out = sample("fastship_db_pool_checked_out")
+
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+        assert sample("fastship_db_pool_checked_out") == checked_out + 1
+
+        # Only connection is in use
+        with pytest.raises(TimeoutError):
+            async with engine.connect():
+                pass
+
+    assert sample("fastship_db_pool_checked_out") == checked_out
+    assert sample("fastship_db_pool_checkout_wait_seconds_count") == waits + 2
+    assert sample("fastship_db_pool_checkout_timeouts_total") == timeouts + 1
+    assert sample("fastship_db_pool_connection_held_seconds_count") == held + 1
+
+    await engine.dispose()
+
+
+async def test_query_stats(seller_token: str):
+    route = {"route": "/seller/shipments"}
+    requests = (
+        REGISTRY.get_sample_value("fastship_db_queries_per_request_count", route) or 0
+    )
+
+    # Debug headers on top of the app's own instrumentation
+    async with AsyncClient(
+        transport=ASGITransport(QueryStatsMiddleware(app, debug=True)),
+        base_url="http://test",
+    ) as client:
+        # Second request finds the principal cached
+        for _ in range(2):
+            response = await client.get(
+                "/seller/shipments",
+                headers={"Authorization": f"Bearer {seller_token}"},
+            )
+
+    assert response.status_code == 200
+    # Page and total count
+    assert response.headers["x-db-query-count"] == "2"
+    assert response.headers["x-db-query-repeats"] == "1"
+    assert float(response.headers["x-db-query-time"]) > 0
+    assert response.headers["x-db-slowest-query"].startswith("SELECT")
+    # Both middlewares observe the request
+    assert (
+        REGISTRY.get_sample_value("fastship_db_queries_per_request_count", route)
+        == requests + 4
+    )
+
+
+async def _database(path, name: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path / name}.db")
+    async with engine.begin() as connection:
+        await connection.execute(text("CREATE TABLE source (name TEXT)"))
+        await connection.execute(text(f"INSERT INTO source VALUES ('{name}')"))
+    return engine
+
+
+async def _source(router: ReadSessionRouter, client: str | None = None) -> str:
+    async with await router.session(client) as session:
+        return await session.scalar(text("SELECT name FROM source"))
+
+
+async def test_read_replica_routing(tmp_path):
+    primary = async_sessionmaker(await _database(tmp_path, "primary"))
+    replicas = [
+        await _database(tmp_path, "replica_a"),
+        await _database(tmp_path, "replica_b"),
+    ]
+    router = ReadSessionRouter(primary, replicas, read_your_writes=0.5)
+
+    # Round robin
+    assert {await _source(router), await _source(router)} == {
+        "replica_a",
+        "replica_b",
+    }
+
+    # Read your writes, then back to the replicas
+    await router.mark_write("client")
+    assert await _source(router, "client") == "primary"
+    assert await _source(router, "other") != "primary"
+    await asyncio.sleep(0.6)
+    assert await _source(router, "client") != "primary"
+
+    # Least connections avoids the busy replica
+    router.selection = "least_connections"
+    async with replicas[0].connect():
+        assert await _source(router) == "replica_b"
+
+
+async def test_read_replica_fallback(tmp_path):
+    primary = async_sessionmaker(await _database(tmp_path, "primary"))
+    unreachable = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db"
+    )
+    router = ReadSessionRouter(primary, [unreachable], retry_after=60)
+
+    assert await _source(router) == "primary"
+    # Skipped without another connection attempt
+    assert router.candidates() == []
+
+
+async def test_read_replica_redis_down(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    async def redis_down(*args):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(replicas, "has_recent_write", redis_down)
+    monkeypatch.setattr(replicas, "mark_recent_write", redis_down)
+    primary = async_sessionmaker(await _database(tmp_path, "primary"))
+
+    # Without replicas Redis is not asked
+    router = ReadSessionRouter(primary, [])
+    assert await _source(router, "client") == "primary"
+
+    # With them, a client that may have written reads from the primary
+    router = ReadSessionRouter(primary, [await _database(tmp_path, "replica_a")])
+    await router.mark_write("client")
+    assert await _source(router, "client") == "primary"
+    assert await _source(router) == "replica_a"
+
+
+async def test_token_blacklist(monkeypatch: pytest.MonkeyPatch):
+    # One bucket for all tokens, so an expired one is kept until compacted
+    monkeypatch.setattr(db_settings, "BLACKLIST_BUCKET_SECONDS", 10**10)
+    now = int(time())
+    revoked, expired, legacy = (str(uuid4()) for _ in range(3))
+
+    await add_jti_to_blacklist(revoked, now + 3600)
+    await add_jti_to_blacklist(expired, now - 1)
+    await _redis.set(legacy, "blacklisted")
+
+    assert await is_jti_blacklisted(revoked, now + 3600)
+    assert await is_jti_blacklisted(legacy, now + 3600)
+    assert not await is_jti_blacklisted(str(uuid4()), now + 3600)
+
+    report = await blacklist_report()
+    assert report.expired >= 1
+    assert report.legacy_persistent >= 1
+
+    report = await compact_blacklist()
+    assert report.expired == 0
+    assert report.legacy_persistent == 0
+    assert await is_jti_blacklisted(revoked, now + 3600)
+    assert not await is_jti_blacklisted(expired, now - 1)
+    assert 0 < await _redis.ttl(legacy) <= ACCESS_TOKEN_EXPIRY.total_seconds()
+
+    await _redis.delete(blacklist_key(0), legacy)
+
+
+async def test_token_blacklist_bucket_expiry():
+    exp = int(time()) + 60
+    await add_jti_to_blacklist(str(uuid4()), exp)
+
+    # The bucket outlives its tokens by less than a bucket
+    bucket = blacklist_bucket(exp)
+    expires_at = await _redis.expiretime(blacklist_key(bucket))
+    assert exp <= expires_at <= exp + db_settings.BLACKLIST_BUCKET_SECONDS
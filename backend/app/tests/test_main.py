@@ -1,6 +1,29 @@
-from httpx import AsyncClient
+import asyncio
+from time import perf_counter
+from types import SimpleNamespace
 
+from httpx import ASGITransport, AsyncClient
+from passlib.context import CryptContext
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from app.config import AppSettings, security_settings
+from app.core import security
+from app.core.exceptions import ServiceBusy
+from app.core.middleware import LoadSheddingMiddleware
+from app.core import rate_limit
+from app.core.rate_limit import rate_limiter
+from app.core.security import PasswordHasher, passwords
+from app.database.models import Seller
+from app.database.redis import (
+    add_jti_to_blacklist,
+    is_jti_blacklisted,
+    listen_for_invalidations,
+)
+from app.main import app
 from app.tests import example
+from app.utils import decode_access_token
 
 
 async def test_app(client: AsyncClient):
@@ -19,3 +42,290 @@ async def test_seller_login(client: AsyncClient):
     )
 
     print(response.json())
+
+
+async def test_seller_profile(client: AsyncClient, seller_token: str):
+    response = await client.get(
+        "/seller/me", headers={"Authorization": f"Bearer {seller_token}"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["email"] == example.SELLER["email"]
+
+
+async def _login(client: AsyncClient) -> dict:
+    response = await client.post(
+        "/seller/token",
+        data={
+            "grant_type": "password",
+            "username": example.SELLER["email"],
+            "password": example.SELLER["password"],
+        },
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def test_seller_logout(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    headers = await _login(client)
+
+    checks = 0
+
+    async def counting_check(jti: str, exp: int) -> bool:
+        nonlocal checks
+        checks += 1
+        return await is_jti_blacklisted(jti, exp)
+
+    monkeypatch.setattr(security, "is_jti_blacklisted", counting_check)
+
+    for _ in range(3):
+        response = await client.get("/seller/me", headers=headers)
+        assert response.status_code == 200
+    # Verified once, then served from the token cache
+    assert checks == 1
+
+    response = await client.get("/seller/logout", headers=headers)
+    assert response.status_code == 200
+
+    response = await client.get("/seller/me", headers=headers)
+    assert response.status_code == 401
+
+
+async def test_token_revoked_by_other_process(client: AsyncClient):
+    headers = await _login(client)
+    response = await client.get("/seller/me", headers=headers)
+    assert response.status_code == 200
+
+    data = decode_access_token(headers["Authorization"].removeprefix("Bearer "))
+
+    listener = asyncio.create_task(listen_for_invalidations())
+    try:
+        async with asyncio.timeout(2):
+            # Subscribing clears the cache, then the token is cached again
+            while len(security._verified_tokens):
+                await asyncio.sleep(0.01)
+            response = await client.get("/seller/me", headers=headers)
+            assert response.status_code == 200
+
+            # Another process only reaches this one through pub/sub
+            await add_jti_to_blacklist(data["jti"], data["exp"])
+            while not security._revoked_jtis.get(data["jti"]):
+                await asyncio.sleep(0.01)
+    finally:
+        listener.cancel()
+
+    response = await client.get("/seller/me", headers=headers)
+    assert response.status_code == 401
+
+
+async def test_password_hashing_off_event_loop():
+    gaps = []
+
+    async def ticker():
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(0.01)
+            gaps.append(perf_counter() - start)
+
+    ticking = asyncio.create_task(ticker())
+    try:
+        password_hash = await passwords.hash("lovetrees")
+        assert await passwords.verify_and_update("lovetrees", password_hash) == (
+            True,
+            None,
+        )
+    finally:
+        ticking.cancel()
+
+    # bcrypt takes far longer than a tick, the loop kept running meanwhile
+    assert len(gaps) > 5
+    assert max(gaps) < 0.1
+
+
+async def test_password_hashing_queue_timeout():
+    hasher = PasswordHasher(rounds=4, workers=1, queue_timeout=0.05)
+
+    # The only worker is taken
+    async with hasher._slots:
+        with pytest.raises(ServiceBusy):
+            await hasher.hash("lovetrees")
+
+    assert (
+        await hasher.verify_and_update("lovetrees", await hasher.hash("lovetrees"))
+    )[0]
+
+
+async def test_seller_login_rehash(client: AsyncClient, session: AsyncSession):
+    # Hashed with a lower cost than configured
+    seller = Seller(
+        name="Rehash",
+        email="rehash@xmailg.one",
+        email_verified=True,
+        password_hash=CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("cheap"),
+        zip_code=11001,
+    )
+    session.add(seller)
+    await session.commit()
+
+    response = await client.post(
+        "/seller/token",
+        data={"grant_type": "password", "username": seller.email, "password": "cheap"},
+    )
+    assert response.status_code == 200
+
+    await session.refresh(seller)
+    rounds = security_settings.PASSWORD_BCRYPT_ROUNDS
+    assert seller.password_hash.startswith(f"$2b${rounds:02d}$")
+    assert passwords.context.verify("cheap", seller.password_hash)
+
+
+async def test_rate_limits(
+    client: AsyncClient, seller_token: str, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(
+        rate_limiter,
+        "routes",
+        {"login_seller": (0.01, 2), "get_seller_profile": (0.01, 1)},
+    )
+
+    # Logins by client address, failed ones count too
+    statuses = []
+    for _ in range(3):
+        response = await client.post(
+            "/seller/token",
+            data={"username": example.SELLER["email"], "password": "guess"},
+        )
+        statuses.append(response.status_code)
+    assert 429 not in statuses[:2] and statuses[2] == 429
+    assert int(response.headers["retry-after"]) > 0
+
+    # Per seller and route
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    assert (await client.get("/seller/me", headers=headers)).status_code == 200
+    response = await client.get("/seller/me", headers=headers)
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many requests, try again later"}
+    assert (await client.get("/seller/shipments", headers=headers)).status_code == 200
+
+
+async def test_rate_limits_behind_proxy(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+):
+    monkeypatch.setattr(rate_limiter, "routes", {"login_seller": (0.01, 1)})
+    monkeypatch.setattr(rate_limit, "_proxy_warned", False)
+
+    async def login(client: AsyncClient, forwarded_for: str) -> int:
+        response = await client.post(
+            "/seller/token",
+            data={"username": example.SELLER["email"], "password": "guess"},
+            headers={"X-Forwarded-For": forwarded_for},
+        )
+        return response.status_code
+
+    # Trusted, as with FORWARDED_ALLOW_IPS, each client has its own bucket
+    proxied = ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1")
+    async with AsyncClient(
+        transport=ASGITransport(proxied, client=("127.0.0.1", 1234)),
+        base_url="http://test",
+    ) as client:
+        assert await login(client, "203.0.113.1") != 429
+        assert await login(client, "203.0.113.2") != 429
+        assert await login(client, "203.0.113.1") == 429
+    assert "X-Forwarded-For" not in caplog.text
+
+    # Not trusted, clients share the proxy's bucket, which is logged
+    async with AsyncClient(
+        transport=ASGITransport(app, client=("198.51.100.9", 1234)),
+        base_url="http://test",
+    ) as client:
+        await login(client, "203.0.113.3")
+    assert "FORWARDED_ALLOW_IPS" in caplog.text
+
+
+async def test_load_shedding():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        if scope["path"] != "/metrics":
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    shedding = LoadSheddingMiddleware(
+        slow_app, limit=1, retry_after=2, exempt={"/metrics"}
+    )
+    async with AsyncClient(
+        transport=ASGITransport(shedding), base_url="http://test"
+    ) as client:
+        first = asyncio.create_task(client.get("/"))
+        while shedding.in_flight == 0:
+            await asyncio.sleep(0)
+
+        response = await client.get("/")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "2"
+
+        # Exempt paths are neither shed nor counted
+        assert (await client.get("/metrics")).status_code == 200
+        assert shedding.in_flight == 1
+
+        release.set()
+        assert (await first).status_code == 200
+        assert shedding.in_flight == 0
+        assert (await client.get("/")).status_code == 200
+
+
+async def test_load_shedding_app(client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    if app.middleware_stack is None:
+        app.middleware_stack = app.build_middleware_stack()
+    middleware = app.middleware_stack
+    while not isinstance(middleware, LoadSheddingMiddleware):
+        middleware = middleware.app
+    monkeypatch.setattr(middleware, "limit", 0)
+
+    # Shed inside CORS, so browsers can read the 503
+    origin = {"Origin": "http://localhost:5500"}
+    response = await client.get("/scalar", headers=origin)
+    assert response.status_code == 503
+    assert response.headers["access-control-allow-origin"] == origin["Origin"]
+
+    assert (await client.get("/metrics")).status_code == 200
+
+
+def test_app_settings_env_file(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    # Read from the .env of the working directory, like the other settings
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".env").write_text("RATE_LIMIT_BURST=7\nMAX_IN_FLIGHT_REQUESTS=3\n")
+
+    settings = AppSettings()
+    assert settings.RATE_LIMIT_BURST == 7
+    assert settings.MAX_IN_FLIGHT_REQUESTS == 3
+
+
+async def test_load_shedding_streams():
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def streaming_app(scope, receive, send):
+        scope["route"] = SimpleNamespace(name=scope["path"].strip("/"))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        started.set()
+        await release.wait()
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    shedding = LoadSheddingMiddleware(streaming_app, limit=1, detached={"events"})
+    for path, in_flight in (("/ndjson", 1), ("/events", 0)):
+        started.clear()
+        release.clear()
+        task = asyncio.create_task(
+            shedding(
+                {"type": "http", "method": "GET", "path": path},
+                receive=None,
+                send=lambda message: asyncio.sleep(0),
+            )
+        )
+        await started.wait()
+        # Counted while streaming unless the route is detached
+        assert shedding.in_flight == in_flight
+        release.set()
+        await task
+        assert shedding.in_flight == 0
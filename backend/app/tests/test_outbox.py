@@ -0,0 +1,117 @@
+from uuid import UUID
+
+from aiosmtpd.controller import Controller
+from fastapi_mail import ConnectionConfig
+from httpx import AsyncClient
+from kombu.exceptions import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, select
+
+from app.config import notification_settings
+from app.database.models import OutboxMessage, Shipment, ShipmentEvent
+from app.tests import example
+from app.utils import TEMPLATE_DIR
+from app.worker import tasks
+from app.worker.mailer import Mailer
+
+
+async def test_shipment_notification_outbox(
+    client: AsyncClient,
+    seller_token: str,
+    session: AsyncSession,
+    monkeypatch,
+):
+    response = await client.post(
+        "/shipment/",
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    assert response.status_code == 201
+
+    # Stored with the shipment, not sent yet
+    message = await session.scalar(select(OutboxMessage))
+    assert message.task == tasks.send_email_with_template.name
+    assert message.payload["recipients"] == [example.SHIPMENT["client_contact_email"]]
+
+    # Broker down, nothing is lost
+    def broker_down(*args, **kwargs):
+        raise OperationalError
+
+    monkeypatch.setattr(tasks.app, "send_task", broker_down)
+    assert await tasks.dispatch_outbox_batch(session, batch_size=10) == 0
+
+    sent = []
+    monkeypatch.setattr(
+        tasks.app, "send_task", lambda task, kwargs, **_: sent.append((task, kwargs))
+    )
+    assert await tasks.dispatch_outbox_batch(session, batch_size=10) == 1
+
+    # Emails are published as one batch for the pooled mailer
+    assert sent == [(tasks.send_email_batch.name, {"emails": [message.payload]})]
+    # and dropped from the outbox
+    session.expunge_all()
+    assert (await session.scalars(select(OutboxMessage))).all() == []
+
+    # Not left for the seller's shipment counts in test_shipment
+    id = UUID(response.json()["id"])
+    await session.execute(delete(ShipmentEvent).where(ShipmentEvent.shipment_id == id))
+    await session.execute(delete(Shipment).where(Shipment.id == id))
+    await session.commit()
+
+
+def test_send_email_batch_retries_failed(monkeypatch):
+    emails = [{"recipients": [f"client{i}@example.com"]} for i in range(3)]
+    batches = []
+
+    async def send_batch(batch):
+        batches.append(batch)
+        # The second email fails once
+        return [batch[1]] if len(batches) == 1 else []
+
+    monkeypatch.setattr(tasks.mailer, "send_batch", send_batch)
+
+    # Run in process, including the retry, with the dispatcher's kwargs
+    result = tasks.send_email_batch.apply(kwargs={"emails": emails})
+    assert result.successful()
+    assert batches == [emails, [emails[1]]]
+
+
+async def test_mailer_batch_reuses_connections():
+    received = []
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            received.append((session.peer, envelope.rcpt_tos))
+            return "250 OK"
+
+    smtp = Controller(Handler(), hostname="127.0.0.1", port=8025)
+    smtp.start()
+    try:
+        mailer = Mailer(
+            ConnectionConfig(
+                **notification_settings.model_dump(exclude={"MAIL_PORT"}),
+                MAIL_PORT=8025,
+                TEMPLATE_FOLDER=TEMPLATE_DIR,
+            ),
+            pool_size=2,
+        )
+        emails = [
+            {
+                "recipients": [f"client{i}@example.com"],
+                "subject": "Shipment placed",
+                "context": {"id": i, "seller": "Seller", "partner": "Partner"},
+                "template_name": "mail_placed.html",
+            }
+            for i in range(10)
+        ]
+
+        assert await mailer.send_batch(emails) == []
+        await mailer.pool.close()
+    finally:
+        smtp.stop()
+
+    assert sorted(rcpt for _, rcpt in received) == sorted(
+        email["recipients"] for email in emails
+    )
+    # Ten messages over at most two connections
+    assert len({peer for peer, _ in received}) <= 2
@@ -0,0 +1,16 @@
+from httpx import AsyncClient
+
+from app.tests import example
+
+base_url = "/partner/"
+
+
+async def test_partner_profile(client: AsyncClient, partner_token: str):
+    response = await client.get(
+        f"{base_url}me", headers={"Authorization": f"Bearer {partner_token}"}
+    )
+
+    assert response.status_code == 200
+    assert sorted(response.json()["serviceable_zip_codes"]) == sorted(
+        example.DELIVERY_PARTNER["serviceable_zip_codes"]
+    )
@@ -1,5 +1,29 @@
-from httpx import AsyncClient
+import asyncio
+import base64
+import json
+from pathlib import Path
+from uuid import UUID
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
 
+from app.database.models import (
+    DeliveryPartner,
+    Location,
+    Shipment,
+    ShipmentStatus,
+    Tag,
+    TagName,
+)
+from app.database.redis import listen_for_invalidations, publish_invalidation
+from app.api.routers.shipment import _server_sent_events
+from app.core.profiling import HEADER, ProfilingMiddleware, profile_header
+from app.main import app
+from app.services.event_stream import RESYNC, shipment_events
+from app.services.tag import tag_catalog
+from app.services.tracking import tracking_pages
 from app.tests import example
 
 base_url = "/shipment/"
@@ -11,6 +35,7 @@ async def test_submit_shipment_auth(client: AsyncClient):
     print(response.json())
 
 
+@pytest.mark.query_budget(6)
 async def test_submit_shipment(client: AsyncClient, seller_token: str):
     # Submit Shipment
     response = await client.post(
@@ -25,7 +50,698 @@ async def test_submit_shipment(client: AsyncClient, seller_token: str):
     response = await client.get(
         base_url,
         params={"id": response.json()["id"]},
+        headers={"Authorization": f"Bearer {seller_token}"},
     )
 
     # Check if the shipment is created
     assert response.status_code == 200
+
+
+async def test_submit_shipment_queries(
+    client: AsyncClient, seller_token: str, queries: list[str]
+):
+    headers = {"Authorization": f"Bearer {seller_token}"}
+
+    # Authenticated principal is cached after the first request
+    await client.post(base_url, json=example.SHIPMENT, headers=headers)
+
+    counts = []
+    for _ in range(3):
+        queries.clear()
+        response = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+        assert response.status_code == 201
+        assert response.json()["timeline"][0]["status"] == "placed"
+        counts.append(len(queries))
+
+    # Seller, partner assignment, shipment, event and outbox inserts,
+    # and the seller's webhooks
+    assert counts == [6, 6, 6]
+
+
+async def test_submit_shipment_partner_capacity(
+    client: AsyncClient, seller_token: str, session: AsyncSession
+):
+    # Partner with room for a single shipment
+    session.add(
+        DeliveryPartner(
+            name="Single",
+            email="single@xmailg.one",
+            email_verified=True,
+            password_hash="-",
+            max_handling_capacity=1,
+            serviceable_locations=[Location(zip_code=12001)],
+        )
+    )
+    await session.commit()
+
+    shipment = {**example.SHIPMENT, "destination": 12001}
+    headers = {"Authorization": f"Bearer {seller_token}"}
+
+    response = await client.post(base_url, json=shipment, headers=headers)
+    assert response.status_code == 201
+
+    # Partner is at capacity now
+    response = await client.post(base_url, json=shipment, headers=headers)
+    assert response.status_code == 406
+
+
+@pytest.mark.query_budget(10)
+async def test_cancel_shipment(
+    client: AsyncClient, seller_token: str, session: AsyncSession
+):
+    headers = {"Authorization": f"Bearer {seller_token}"}
+
+    response = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+    assert response.status_code == 201
+
+    id = response.json()["id"]
+    shipment = await session.get(Shipment, UUID(id))
+    assert shipment.current_status == ShipmentStatus.placed
+
+    response = await client.get(f"{base_url}cancel", params={"id": id}, headers=headers)
+    assert response.status_code == 200
+
+    await session.refresh(shipment)
+    assert shipment.current_status == ShipmentStatus.cancelled
+
+
+@pytest.mark.query_budget(2)
+async def test_seller_shipments_pagination(client: AsyncClient, seller_token: str):
+    headers = {"Authorization": f"Bearer {seller_token}"}
+
+    response = await client.get(
+        "/seller/shipments", params={"pageSize": 2}, headers=headers
+    )
+    assert response.status_code == 200
+    page = response.json()
+    total_shipments = page["total_shipments"]
+    assert total_shipments == 7
+
+    # Follow the cursors without counting again
+    seen = len(page["shipments"])
+    while page["next_cursor"]:
+        response = await client.get(
+            "/seller/shipments",
+            params={
+                "pageSize": 2,
+                "cursor": page["next_cursor"],
+                "include_total": False,
+            },
+            headers=headers,
+        )
+        page = response.json()
+        assert page["total_shipments"] is None
+        seen += len(page["shipments"])
+
+    assert seen == total_shipments
+
+    response = await client.get(
+        "/seller/shipments",
+        params={"status": [ShipmentStatus.cancelled.value]},
+        headers=headers,
+    )
+    assert response.json()["total_shipments"] == 1
+
+    for cursor in (
+        "invalid",
+        base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", 5]').decode(),
+        base64.urlsafe_b64encode(b"{}").decode(),
+    ):
+        response = await client.get(
+            "/seller/shipments", params={"cursor": cursor}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.query_budget(10)
+async def test_update_and_track_shipment(
+    client: AsyncClient, seller_token: str, partner_token: str
+):
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = response.json()["id"]
+
+    # Partner scans the shipment
+    response = await client.patch(
+        base_url,
+        params={"id": id},
+        json={"status": ShipmentStatus.in_transit.value, "location": 11003},
+        headers={"Authorization": f"Bearer {partner_token}"},
+    )
+    assert response.status_code == 200
+    assert len(response.json()["timeline"]) == 2
+
+    response = await client.get(f"{base_url}track", params={"id": id})
+    assert response.status_code == 200
+    assert example.DELIVERY_PARTNER["name"] in response.text
+
+
+async def test_tracking_page_cache(
+    client: AsyncClient, seller_token: str, partner_token: str, queries: list[str]
+):
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = response.json()["id"]
+    track = f"{base_url}track"
+
+    response = await client.get(track, params={"id": id})
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+
+    # Served from the cache
+    queries.clear()
+    response = await client.get(track, params={"id": id})
+    assert response.headers["etag"] == etag
+    assert queries == []
+
+    # Revalidation
+    response = await client.get(
+        track, params={"id": id}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    response = await client.get(
+        track, params={"id": id}, headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    # A new event replaces the page
+    await client.patch(
+        base_url,
+        params={"id": id},
+        json={"status": ShipmentStatus.in_transit.value, "location": 11003},
+        headers={"Authorization": f"Bearer {partner_token}"},
+    )
+    response = await client.get(
+        track, params={"id": id}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert "In Transit" in response.text
+    assert response.headers["etag"] != etag
+    etag = response.headers["etag"]
+
+    # So does an edit without an event
+    await client.patch(
+        base_url,
+        params={"id": id},
+        json={"estimated_delivery": "2030-01-02T10:00:00"},
+        headers={"Authorization": f"Bearer {partner_token}"},
+    )
+    response = await client.get(
+        track, params={"id": id}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert "02-01-2030 10:00" in response.text
+
+    # A page rendered before a change is not stored after the change
+    page = await tracking_pages.get(UUID(id))
+    version = await tracking_pages.version(UUID(id))
+    await tracking_pages.invalidate([UUID(id)])
+    await tracking_pages.set(UUID(id), page, version)
+    assert await tracking_pages.get(UUID(id)) is None
+
+
+async def test_shipment_event_stream(
+    client: AsyncClient, seller_token: str, partner_token: str
+):
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = UUID(response.json()["id"])
+
+    response = await client.get(f"{base_url}{UUID(int=0)}/events/stream")
+    assert response.status_code == 404
+    assert len(shipment_events) == 0
+
+    queue = shipment_events.subscribe(id)
+    listener = asyncio.create_task(listen_for_invalidations())
+    try:
+        async with asyncio.timeout(2):
+            # Told to resync when the subscription starts
+            assert await queue.get() is RESYNC
+
+            await client.patch(
+                base_url,
+                params={"id": str(id)},
+                json={"status": ShipmentStatus.in_transit.value, "location": 11003},
+                headers={"Authorization": f"Bearer {partner_token}"},
+            )
+            event = json.loads(await queue.get())
+            assert event["shipment_id"] == str(id)
+            assert event["status"] == ShipmentStatus.in_transit.value
+    finally:
+        listener.cancel()
+        shipment_events.unsubscribe(id, queue)
+    assert len(shipment_events) == 0
+
+    # Wire format. An event after the status was read and before the stream
+    # starts is kept, and a full queue turns into a resync
+    queue = shipment_events.subscribe(id)
+    message = json.dumps([{"shipment_id": str(id), "status": "delivered"}])
+    shipment_events.dispatch(message)
+    stream = _server_sent_events(id, json.dumps({"status": "placed"}), queue)
+    assert await anext(stream) == 'event: status\ndata: {"status": "placed"}\n\n'
+    assert await anext(stream) == (
+        "event: shipment_event\n"
+        f'data: {{"shipment_id": "{id}", "status": "delivered"}}\n\n'
+    )
+    for _ in range(shipment_events.queue_size + 1):
+        shipment_events.dispatch(message)
+    assert await anext(stream) == "event: resync\ndata: {}\n\n"
+    await stream.aclose()
+    assert len(shipment_events) == 0
+
+
+async def test_idempotency_key(
+    client: AsyncClient, seller_token: str, partner_token: str, queries: list[str]
+):
+    headers = {"Authorization": f"Bearer {seller_token}", "Idempotency-Key": "a1"}
+
+    first = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+    assert first.status_code == 201
+
+    # Replayed without touching the database
+    queries.clear()
+    retry = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+    assert queries == []
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+
+    response = await client.post(
+        base_url, json={**example.SHIPMENT, "weight": 2}, headers=headers
+    )
+    assert response.status_code == 422
+
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={**headers, "Idempotency-Key": "k" * 256},
+    )
+    assert response.status_code == 400
+
+    # A duplicate in flight waits for the first response
+    headers["Idempotency-Key"] = "a2"
+    responses = await asyncio.gather(
+        *(client.post(base_url, json=example.SHIPMENT, headers=headers) for _ in "ab")
+    )
+    assert responses[0].json()["id"] == responses[1].json()["id"]
+    assert sum("idempotent-replayed" in r.headers for r in responses) == 1
+
+    # Errors are not stored
+    partner = {"Authorization": f"Bearer {partner_token}", "Idempotency-Key": "a3"}
+    for _ in range(2):
+        response = await client.patch(
+            base_url,
+            params={"id": str(UUID(int=0))},
+            json={"status": ShipmentStatus.in_transit.value},
+            headers=partner,
+        )
+        assert response.status_code == 404
+        assert "idempotent-replayed" not in response.headers
+
+
+async def test_shipment_tags(
+    client: AsyncClient,
+    seller_token: str,
+    session: AsyncSession,
+    queries: list[str],
+):
+    session.add(Tag(name=TagName.EXPRESS, instruction="Deliver within 24 hours"))
+    await session.commit()
+    # What the "tags" invalidation does in every process
+    tag_catalog.invalidate()
+
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = response.json()["id"]
+
+    response = await client.get(
+        f"{base_url}tag", params={"id": id, "tag_name": TagName.EXPRESS.value}
+    )
+    assert response.status_code == 200
+    assert response.json()["tags"][0]["name"] == TagName.EXPRESS.value
+
+    # Tagging again is a no-op, and the tag comes from the catalog
+    queries.clear()
+    response = await client.get(
+        f"{base_url}tag", params={"id": id, "tag_name": TagName.EXPRESS.value}
+    )
+    assert len(response.json()["tags"]) == 1
+    assert not any(query.endswith("FROM tag") for query in queries)
+
+    response = await client.get(
+        f"{base_url}tagged", params={"tag_name": TagName.EXPRESS.value}
+    )
+    assert [shipment["id"] for shipment in response.json()["shipments"]] == [id]
+
+    response = await client.delete(
+        f"{base_url}tag", params={"id": id, "tag_name": TagName.EXPRESS.value}
+    )
+    assert response.json()["tags"] == []
+
+    response = await client.delete(
+        f"{base_url}tag", params={"id": id, "tag_name": TagName.EXPRESS.value}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.query_budget(6)
+async def test_shipments_with_tags(
+    client: AsyncClient, seller_token: str, session: AsyncSession
+):
+    session.add(Tag(name=TagName.FRAGILE, instruction="Handle with care"))
+    session.add(Tag(name=TagName.GIFT, instruction="Hide the invoice"))
+    await session.commit()
+    tag_catalog.invalidate()
+
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    ids = []
+    for tag_names in ([TagName.FRAGILE], [TagName.FRAGILE, TagName.GIFT]):
+        response = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+        ids.append(response.json()["id"])
+        for tag_name in tag_names:
+            await client.get(
+                f"{base_url}tag", params={"id": ids[-1], "tag_name": tag_name.value}
+            )
+
+    tags = {"tag_name": [TagName.FRAGILE.value, TagName.GIFT.value]}
+
+    response = await client.get(f"{base_url}tagged", params=tags)
+    assert response.json()["total_shipments"] == 2
+
+    response = await client.get(f"{base_url}tagged", params={**tags, "match": "all"})
+    assert [shipment["id"] for shipment in response.json()["shipments"]] == [ids[1]]
+
+    response = await client.get(
+        f"{base_url}tagged", params={**tags, "status": "delivered"}
+    )
+    assert response.json()["shipments"] == []
+
+    # Streamed past the page size, one shipment per line
+    response = await client.get(
+        f"{base_url}tagged",
+        params={**tags, "pageSize": 1},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ids
+    assert [tag["name"] for tag in lines[1]["tags"]] == ["fragile", "gift"]
+
+
+async def test_tag_catalog_invalidation(session: AsyncSession):
+    await tag_catalog.get(session, TagName.EXPRESS)
+
+    listener = asyncio.create_task(listen_for_invalidations())
+    try:
+        async with asyncio.timeout(2):
+            # Subscribing drops the catalog, anything before it may be missed
+            while tag_catalog._tags is not None:
+                await asyncio.sleep(0.01)
+            await tag_catalog.get(session, TagName.EXPRESS)
+
+            # A malformed message is logged, the listener keeps going
+            await publish_invalidation("tracking", "not a uuid")
+            await publish_invalidation("tags")
+            while tag_catalog._tags is not None:
+                await asyncio.sleep(0.01)
+        assert not listener.done()
+    finally:
+        listener.cancel()
+
+
+async def test_tag_catalog_miss(session: AsyncSession, queries: list[str]):
+    # One reload on the first miss, none after it
+    queries.clear()
+    assert await tag_catalog.get(session, TagName.HEAVY) is None
+    assert await tag_catalog.get(session, TagName.HEAVY) is None
+    assert len([query for query in queries if query.endswith("FROM tag")]) == 1
+
+    session.add(Tag(name=TagName.HEAVY, instruction="Lift with two people"))
+    await session.commit()
+    queries.clear()
+    assert await tag_catalog.get(session, TagName.HEAVY) is None
+    assert queries == []
+
+    # Until the next invalidation
+    tag_catalog.invalidate()
+    tag = await tag_catalog.get(session, TagName.HEAVY)
+    assert tag.instruction == "Lift with two people"
+
+
+@pytest.mark.query_budget(7)
+async def test_submit_shipments_bulk(
+    client: AsyncClient, seller_token: str, session: AsyncSession
+):
+    partner = DeliveryPartner(
+        name="Bulk",
+        email="bulk@xmailg.one",
+        email_verified=True,
+        password_hash="-",
+        max_handling_capacity=3,
+        serviceable_locations=[Location(zip_code=12002)],
+    )
+    session.add(partner)
+    await session.commit()
+
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    shipment = {**example.SHIPMENT, "destination": 12002}
+
+    response = await client.post(
+        f"{base_url}bulk",
+        json=[
+            shipment,
+            {**shipment, "weight": 100},
+            {**shipment, "destination": 99999},
+            shipment,
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (2, 2)
+
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[1]["error"].startswith("weight")
+    assert results[2]["error"] == "Delivery partner/s do not service the destination"
+
+    # Created with their initial event
+    response = await client.get(
+        base_url, params={"id": results[0]["id"]}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["timeline"][0]["description"] == "assigned to Bulk"
+
+    # NDJSON, a bad line and the partner running out of capacity fail alone
+    response = await client.post(
+        f"{base_url}bulk",
+        content="\n".join([json.dumps(shipment), "{not json", json.dumps(shipment)]),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert [bool(result["id"]) for result in response.json()["results"]] == [
+        True,
+        False,
+        False,
+    ]
+
+    await session.refresh(partner)
+    assert partner.active_shipment_count == 3
+
+    response = await client.post(f"{base_url}bulk", json={}, headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.query_budget(6)
+async def test_submit_shipment_scans(
+    client: AsyncClient,
+    seller_token: str,
+    partner_token: str,
+    session: AsyncSession,
+):
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = response.json()["id"]
+
+    headers = {"Authorization": f"Bearer {partner_token}"}
+    in_transit = {
+        "shipment_id": id,
+        "status": "in_transit",
+        "location": 11003,
+        "timestamp": "2030-01-01T10:00:00",
+    }
+    out_for_delivery = {
+        "shipment_id": id,
+        "status": "out_for_delivery",
+        "location": 11004,
+        "timestamp": "2030-01-01T12:00:00",
+    }
+
+    response = await client.post(
+        f"{base_url}events",
+        json=[
+            out_for_delivery,
+            in_transit,
+            in_transit,
+            {**in_transit, "shipment_id": "00000000-0000-0000-0000-000000000000"},
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["recorded"], body["duplicates"], body["rejected"]) == (2, 1, 1)
+
+    # Replayed batch records nothing
+    response = await client.post(
+        f"{base_url}events", json=[out_for_delivery, in_transit], headers=headers
+    )
+    assert response.json()["duplicates"] == 2
+
+    # Latest by scan time, not by arrival
+    shipment = await session.get(Shipment, UUID(id))
+    assert shipment.current_status == ShipmentStatus.out_for_delivery
+    assert shipment.current_location == 11004
+
+    response = await client.get(
+        base_url, params={"id": id}, headers={"Authorization": f"Bearer {seller_token}"}
+    )
+    timeline = response.json()["timeline"]
+    assert len(timeline) == 3
+    assert "2030-01-01T10:00:00" in [event["created_at"] for event in timeline]
+
+    # Delivered frees the partner's capacity
+    partner = await session.get(DeliveryPartner, shipment.delivery_partner_id)
+    active = partner.active_shipment_count
+    response = await client.post(
+        f"{base_url}events",
+        json=[
+            {**out_for_delivery, "status": "delivered", "timestamp": "2030-01-01T13:00"}
+        ],
+        headers=headers,
+    )
+    assert response.json()["recorded"] == 1
+    await session.refresh(partner)
+    assert partner.active_shipment_count == active - 1
+
+    # Shipment of another partner
+    other = await session.scalar(select(Shipment).where(Shipment.destination == 12001))
+    response = await client.post(
+        f"{base_url}events",
+        json=[{**in_transit, "shipment_id": str(other.id)}],
+        headers=headers,
+    )
+    assert response.json()["results"][0]["error"] == (
+        "Client is not authorized to perform the action"
+    )
+
+
+async def test_metrics(client: AsyncClient, seller_token: str):
+    def sample(name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    created = sample("fastship_shipments_created_total")
+    placed = sample("fastship_shipment_events_total", status="placed")
+    failed = sample("fastship_shipment_assignments_failed_total")
+    requests = sample(
+        "fastship_http_request_duration_seconds_count",
+        route="Create Shipment",
+        method="POST",
+    )
+
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    response = await client.post(base_url, json=example.SHIPMENT, headers=headers)
+    assert response.status_code == 201
+    response = await client.post(
+        base_url, json={**example.SHIPMENT, "destination": 99999}, headers=headers
+    )
+    assert response.status_code == 406
+
+    assert sample("fastship_shipments_created_total") == created + 1
+    assert sample("fastship_shipment_events_total", status="placed") == placed + 1
+    assert sample("fastship_shipment_assignments_failed_total") == failed + 1
+    assert (
+        sample(
+            "fastship_http_request_duration_seconds_count",
+            route="Create Shipment",
+            method="POST",
+        )
+        == requests + 2
+    )
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in (
+        'fastship_http_responses_total{method="POST",route="Create Shipment",status="406"}',
+        "fastship_db_pool_checkout_wait_seconds",
+        "fastship_redis_round_trip_seconds_bucket",
+    ):
+        assert name in response.text
+
+
+async def test_request_profiling(
+    client: AsyncClient, seller_token: str, tmp_path: Path
+):
+    response = await client.post(
+        base_url,
+        json=example.SHIPMENT,
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    id = response.json()["id"]
+
+    with pytest.raises(ValueError, match="PROFILE_SECRET"):
+        profile_header(None)
+
+    profiling = ProfilingMiddleware(app, str(tmp_path), secret="secret")
+    async with AsyncClient(
+        transport=ASGITransport(profiling), base_url="http://test"
+    ) as profiled:
+        # Not profiled without a valid signature
+        for value in (
+            None,
+            "not signed",
+            profile_header("other"),
+            profile_header("secret", ttl=-1),
+        ):
+            headers = {HEADER: value} if value else {}
+            response = await profiled.get(
+                f"{base_url}track", params={"id": id}, headers=headers
+            )
+            assert response.status_code == 200
+        assert list(tmp_path.iterdir()) == []
+
+        response = await profiled.get(
+            f"{base_url}track",
+            params={"id": id},
+            headers={HEADER: profile_header("secret")},
+        )
+        assert response.status_code == 200
+        [profile] = (tmp_path / "get_tracking").iterdir()
+        assert profile.name.endswith(".speedscope.json")
+        data = json.loads(profile.read_text())
+        assert data["$schema"] == "https://www.speedscope.app/file-format-schema.json"
+
+        # Sampled
+        profiling.sample_rate = 1.0
+        await profiled.get(
+            "/seller/me", headers={"Authorization": f"Bearer {seller_token}"}
+        )
+        assert len(list((tmp_path / "get_seller_profile").iterdir())) == 1
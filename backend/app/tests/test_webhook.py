@@ -0,0 +1,212 @@
+import hmac
+import json
+from datetime import datetime
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from httpx import AsyncClient
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select, update
+
+from app.config import worker_settings
+from app.database.models import ShipmentStatus, Webhook, WebhookDelivery
+from app.tests import example
+from app.worker.webhooks import (
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    WebhookDispatcher,
+    is_public_address,
+)
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Webhook receiver, records each POST and fails on /down"""
+
+    protocol_version = "HTTP/1.1"
+    received: list[tuple[str, int, dict, bytes]] = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append(
+            (self.path, self.client_address[1], dict(self.headers), body)
+        )
+        status = 500 if self.path == "/down" else 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _verify(secret: str, headers: dict, body: bytes) -> bool:
+    message = f"{headers[TIMESTAMP_HEADER]}.".encode() + body
+    expected = hmac.new(secret.encode(), message, sha256).hexdigest()
+    return hmac.compare_digest(headers[SIGNATURE_HEADER], f"sha256={expected}")
+
+
+def _dispatcher(**options) -> WebhookDispatcher:
+    return WebhookDispatcher(
+        **{
+            "concurrency": 2,
+            "timeout": 5,
+            "events_per_post": 2,
+            "max_attempts": 2,
+            "retry_delay": 60,
+            "retry_max_delay": 600,
+            "allow_private": True,
+            **options,
+        }
+    )
+
+
+async def test_webhook_url_checks(client: AsyncClient, seller_token: str):
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    for url in (
+        "not a url",
+        "http://example.com/events",
+        "https://localhost/events",
+        "https://127.0.0.1/events",
+        "https://169.254.169.254/latest/meta-data",
+        "https://10.0.0.1/events",
+        "https://[::1]/events",
+    ):
+        response = await client.post(
+            "/seller/webhooks", json={"url": url}, headers=headers
+        )
+        assert response.status_code == 422, url
+
+    # A public name is checked again by address when posting
+    assert not is_public_address("::ffff:127.0.0.1")
+    dispatcher = _dispatcher(allow_private=False)
+    try:
+        webhook = Webhook(url="http://localhost:9/events", secret="s")
+        error = await dispatcher.post(webhook, [{}])
+        assert "non-public address" in error
+    finally:
+        await dispatcher.close()
+
+
+async def test_webhook_delivery(
+    client: AsyncClient,
+    seller_token: str,
+    partner_token: str,
+    session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(worker_settings, "WEBHOOK_ALLOW_PRIVATE", True)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    headers = {"Authorization": f"Bearer {seller_token}"}
+
+    response = await client.post(
+        "/seller/webhooks", json={"url": f"{base}/events"}, headers=headers
+    )
+    assert response.status_code == 201
+    up = response.json()
+    response = await client.post(
+        "/seller/webhooks", json={"url": f"{base}/down"}, headers=headers
+    )
+    down = response.json()
+
+    response = await client.get("/seller/webhooks", headers=headers)
+    assert [webhook["id"] for webhook in response.json()] == [up["id"], down["id"]]
+    assert "secret" not in response.json()[0]
+
+    # Each event is queued for both webhooks with the shipment
+    ids = []
+    for _ in range(5):
+        response = await client.post(
+            "/shipment/", json=example.SHIPMENT, headers=headers
+        )
+        ids.append(response.json()["id"])
+    await client.patch(
+        "/shipment/",
+        params={"id": ids[0]},
+        json={"status": ShipmentStatus.in_transit.value, "location": 11003},
+        headers={"Authorization": f"Bearer {partner_token}"},
+    )
+    pending = (await session.scalars(select(WebhookDelivery))).all()
+    assert len(pending) == 2 * 6
+
+    # Claimed under a lease, not again by another dispatcher meanwhile
+    dispatcher = _dispatcher()
+    claimed = await dispatcher._claim(session, batch_size=100)
+    assert sum(len(group) for _, group in claimed) == 12
+    assert await dispatcher._claim(session, batch_size=100) == []
+    await session.execute(
+        update(WebhookDelivery).values(next_attempt_at=datetime.now())
+    )
+    await session.commit()
+
+    StandIn.received.clear()
+    try:
+        assert await dispatcher.dispatch(session, batch_size=100) == 12
+        posts = [post for post in StandIn.received if post[0] == "/events"]
+        events = [
+            event for _, _, _, body in posts for event in json.loads(body)["events"]
+        ]
+        # Batched, in order and signed
+        assert len(posts) == 3
+        assert [event["shipment_id"] for event in events] == ids + [ids[0]]
+        assert events[-1]["status"] == ShipmentStatus.in_transit.value
+        assert all(_verify(up["secret"], headers, body) for *_, headers, body in posts)
+        # Over pooled connections
+        assert len({port for _, port, _, _ in StandIn.received}) <= 2
+
+        # Only the first batch of a failing webhook was tried, the rest waits
+        failed = (await session.scalars(select(WebhookDelivery))).all()
+        assert len(failed) == 6
+        assert sorted(delivery.attempts for delivery in failed) == [0] * 4 + [1] * 2
+        assert all(delivery.next_attempt_at > datetime.now() for delivery in failed)
+        assert {d.last_error for d in failed if d.attempts} == {"HTTP 500"}
+
+        # Not due yet
+        assert await dispatcher.dispatch(session, batch_size=100) == 0
+
+        # A newer event waits behind the retries of the failing webhook
+        await client.patch(
+            "/shipment/",
+            params={"id": ids[1]},
+            json={"status": ShipmentStatus.in_transit.value, "location": 11003},
+            headers={"Authorization": f"Bearer {partner_token}"},
+        )
+        StandIn.received.clear()
+        assert await dispatcher.dispatch(session, batch_size=100) == 1
+        assert [post[0] for post in StandIn.received] == ["/events"]
+
+        # Dead lettered after the last attempt
+        await session.execute(
+            update(WebhookDelivery).values(next_attempt_at=datetime.now())
+        )
+        await session.commit()
+        await dispatcher.dispatch(session, batch_size=100)
+    finally:
+        await dispatcher.close()
+        server.shutdown()
+
+    response = await client.get(
+        f"/seller/webhooks/{down['id']}/dead_letters", headers=headers
+    )
+    assert [letter["attempts"] for letter in response.json()] == [2, 2]
+    response = await client.post(
+        f"/seller/webhooks/{down['id']}/redeliver", headers=headers
+    )
+    assert response.json() == {"detail": "2 deliveries queued"}
+
+    # Sellers only
+    response = await client.delete(
+        f"/seller/webhooks/{down['id']}",
+        headers={"Authorization": f"Bearer {partner_token}"},
+    )
+    assert response.status_code == 401
+    for webhook in (up, down):
+        response = await client.delete(
+            f"/seller/webhooks/{webhook['id']}", headers=headers
+        )
+        assert response.status_code == 200
+    session.expunge_all()
+    assert (await session.scalars(select(WebhookDelivery))).all() == []
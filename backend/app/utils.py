@@ -14,10 +14,12 @@ _serializer = URLSafeTimedSerializer(security_settings.JWT_SECRET)
 APP_DIR = Path(__file__).resolve().parent
 TEMPLATE_DIR = APP_DIR / "templates"
 
+ACCESS_TOKEN_EXPIRY = timedelta(days=7)
+
 
 def generate_access_token(
     data: dict,
-    expiry: timedelta = timedelta(days=7),
+    expiry: timedelta = ACCESS_TOKEN_EXPIRY,
 ) -> str:
     return jwt.encode(
         payload={
@@ -0,0 +1,164 @@
+import asyncio
+from concurrent.futures import Future
+from email.message import Message
+from email.utils import formataddr
+from threading import Lock, Thread
+from typing import Any, Coroutine, TypeVar
+
+import aiosmtplib
+from fastapi_mail import ConnectionConfig, MessageSchema, MessageType
+from fastapi_mail.msg import MailMsg
+
+T = TypeVar("T")
+
+
+class EventLoopThread:
+    """A long-lived asyncio loop in a daemon thread, sync callers submit
+    coroutines to it instead of starting a loop per call"""
+
+    def __init__(self, name: str = "mailer-loop"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # Started on first use, so a forked worker process gets its own
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                Thread(
+                    target=self._loop.run_forever, name=self.name, daemon=True
+                ).start()
+            return self._loop
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        return self.submit(coro).result()
+
+
+class SMTPPool:
+    """Persistent SMTP connections, each send holds one connection
+    exclusively so at most `size` messages are in flight"""
+
+    def __init__(self, config: ConnectionConfig, size: int):
+        self.config = config
+        self.size = size
+        self._idle: asyncio.LifoQueue[aiosmtplib.SMTP] | None = None
+
+    def _client(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=self.config.MAIL_SERVER,
+            port=self.config.MAIL_PORT,
+            timeout=self.config.TIMEOUT,
+            use_tls=self.config.MAIL_SSL_TLS,
+            start_tls=self.config.MAIL_STARTTLS,
+            validate_certs=self.config.VALIDATE_CERTS,
+            local_hostname=self.config.LOCAL_HOSTNAME,
+        )
+
+    async def _connect(self, client: aiosmtplib.SMTP):
+        await client.connect()
+        if self.config.USE_CREDENTIALS:
+            await client.login(
+                self.config.MAIL_USERNAME,
+                self.config.MAIL_PASSWORD.get_secret_value(),
+            )
+
+    async def send(self, message: Message):
+        # Created lazily, the queue belongs to the loop it is first used on
+        if self._idle is None:
+            self._idle = asyncio.LifoQueue()
+            for _ in range(self.size):
+                self._idle.put_nowait(self._client())
+
+        client = await self._idle.get()
+        try:
+            if not client.is_connected:
+                await self._connect(client)
+            try:
+                await client.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                # Idle connection was dropped by the server, retry once
+                client.close()
+                await self._connect(client)
+                await client.send_message(message)
+        except Exception:
+            client.close()
+            raise
+        finally:
+            self._idle.put_nowait(client)
+
+    async def close(self):
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            client = self._idle.get_nowait()
+            if client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
+        self._idle = None
+
+
+class Mailer:
+    """Renders templates once per environment and delivers messages
+    concurrently over a pool of SMTP connections"""
+
+    def __init__(self, config: ConnectionConfig, pool_size: int):
+        self.config = config
+        self.pool = SMTPPool(config, pool_size)
+        self.templates = config.template_engine() if config.TEMPLATE_FOLDER else None
+
+    def _sender(self) -> str:
+        if self.config.MAIL_FROM_NAME is not None:
+            return formataddr((self.config.MAIL_FROM_NAME, self.config.MAIL_FROM))
+        return self.config.MAIL_FROM
+
+    async def build(
+        self,
+        recipients: list[str],
+        subject: str,
+        body: str | None = None,
+        context: dict | None = None,
+        template_name: str | None = None,
+    ) -> Message:
+        if template_name:
+            if self.templates is None:
+                raise ValueError("Templates require TEMPLATE_FOLDER")
+            schema = MessageSchema(
+                recipients=recipients,  # type: ignore
+                subject=subject,
+                template_body=self.templates.get_template(template_name).render(
+                    **(context or {})
+                ),
+                subtype=MessageType.html,
+            )
+        else:
+            schema = MessageSchema(
+                recipients=recipients,  # type: ignore
+                subject=subject,
+                body=body,
+                subtype=MessageType.plain,
+            )
+
+        return await MailMsg(schema)._message(self._sender())
+
+    async def send(self, **email) -> None:
+        message = await self.build(**email)
+        if not self.config.SUPPRESS_SEND:
+            await self.pool.send(message)
+
+    async def send_batch(self, emails: list[dict]) -> list[dict]:
+        """Send all emails concurrently, returns the ones that failed"""
+        results = await asyncio.gather(
+            *(self.send(**email) for email in emails), return_exceptions=True
+        )
+        return [
+            email
+            for email, result in zip(emails, results)
+            if isinstance(result, Exception)
+        ]
@@ -1,30 +1,76 @@
+from datetime import datetime
+from time import perf_counter
+from typing import Sequence
+
 from asgiref.sync import async_to_sync
 from celery import Celery
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from fastapi_mail import ConnectionConfig
+from kombu.exceptions import OperationalError
+from prometheus_client import Histogram
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import delete, select
 
-from app.config import db_settings, notification_settings
+from app.config import db_settings, notification_settings, worker_settings
+from app.database.models import OutboxMessage
 from app.utils import TEMPLATE_DIR
+from app.worker.mailer import EventLoopThread, Mailer
+from app.worker.webhooks import WebhookDispatcher
+
+TASK_PUBLISH = Histogram(
+    "fastship_celery_publish_seconds",
+    "Time to publish a task to the broker, by task",
+    ["task"],
+)
+OUTBOX_LAG = Histogram(
+    "fastship_outbox_lag_seconds",
+    "Time from storing an outbox message to publishing its task",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
 
-fast_mail = FastMail(
+# One loop and SMTP connection pool per worker process,
+# reused by every mail task instead of connecting per message
+mailer = Mailer(
     ConnectionConfig(
         **notification_settings.model_dump(),
         TEMPLATE_FOLDER=TEMPLATE_DIR,
-    )
+    ),
+    pool_size=worker_settings.SMTP_POOL_SIZE,
 )
+mailer_loop = EventLoopThread()
 
-
-send_message = async_to_sync(fast_mail.send_message)
+# Likewise one HTTP connection pool per worker process for webhooks
+webhook_dispatcher = WebhookDispatcher(
+    concurrency=worker_settings.WEBHOOK_CONCURRENCY,
+    timeout=worker_settings.WEBHOOK_TIMEOUT,
+    events_per_post=worker_settings.WEBHOOK_EVENTS_PER_POST,
+    max_attempts=worker_settings.WEBHOOK_MAX_ATTEMPTS,
+    retry_delay=worker_settings.WEBHOOK_RETRY_DELAY,
+    retry_max_delay=worker_settings.WEBHOOK_RETRY_MAX_DELAY,
+    allow_private=worker_settings.WEBHOOK_ALLOW_PRIVATE,
+)
+webhook_loop = EventLoopThread("webhook-loop")
 
 app = Celery("api_tasks", broker=db_settings.REDIS_URL(9))
 
+app.conf.beat_schedule = {
+    "dispatch-outbox": {
+        "task": "app.worker.tasks.dispatch_outbox",
+        "schedule": worker_settings.OUTBOX_DISPATCH_INTERVAL,
+    },
+    "dispatch-webhooks": {
+        "task": "app.worker.tasks.dispatch_webhooks",
+        "schedule": worker_settings.WEBHOOK_DISPATCH_INTERVAL,
+    },
+}
+
+# Every dispatch runs on a fresh event loop, so connections are not pooled
+outbox_engine = create_async_engine(url=db_settings.POSTGRES_URL, poolclass=NullPool)
+
 
 @app.task
 def send_mail(recipients: list[str], subject: str, body: str):
-    send_message(
-        MessageSchema(
-            recipients=recipients, subject=subject, body=body, subtype=MessageType.plain
-        )
-    )
+    mailer_loop.run(mailer.send(recipients=recipients, subject=subject, body=body))
 
     return "Message Sent!"
 
@@ -36,12 +82,122 @@ def send_email_with_template(
     context: dict,
     template_name: str,
 ):
-    send_message(
-        message=MessageSchema(
+    mailer_loop.run(
+        mailer.send(
             recipients=recipients,
             subject=subject,
-            template_body=context,
-            subtype=MessageType.html,
-        ),
-        template_name=template_name,
+            context=context,
+            template_name=template_name,
+        )
     )
+
+
+@app.task(bind=True, max_retries=3)
+def send_email_batch(self, emails: list[dict]):
+    # Keyword arguments of send_mail or send_email_with_template per email
+    failed = mailer_loop.run(mailer.send_batch(emails))
+
+    if failed:
+        # Only the failed emails are sent again. The dispatcher publishes
+        # with kwargs, which a retry keeps unless replaced
+        raise self.retry(kwargs={"emails": failed}, countdown=2**self.request.retries)
+
+    return len(emails)
+
+
+EMAIL_TASKS = {send_mail.name, send_email_with_template.name}
+
+
+def _group_outbox(
+    messages: Sequence[OutboxMessage], mail_batch_size: int
+) -> list[tuple[str, dict, list[OutboxMessage]]]:
+    """Task, kwargs and the outbox rows for each broker publish"""
+    publishes = []
+    emails: list[OutboxMessage] = []
+
+    def flush():
+        publishes.append(
+            (send_email_batch.name, {"emails": [e.payload for e in emails]}, emails)
+        )
+
+    for message in messages:
+        if mail_batch_size > 1 and message.task in EMAIL_TASKS:
+            emails.append(message)
+            if len(emails) == mail_batch_size:
+                flush()
+                emails = []
+        else:
+            publishes.append((message.task, message.payload, [message]))
+
+    if emails:
+        flush()
+
+    return publishes
+
+
+async def dispatch_outbox_batch(
+    session: AsyncSession,
+    batch_size: int,
+    mail_batch_size: int = worker_settings.MAIL_BATCH_SIZE,
+) -> int:
+    # Concurrent dispatchers take disjoint batches
+    messages = (
+        await session.scalars(
+            select(OutboxMessage)
+            .order_by(OutboxMessage.created_at)  # type: ignore
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+    ).all()
+
+    dispatched: list[OutboxMessage] = []
+    for task, kwargs, group in _group_outbox(messages, mail_batch_size):
+        for message in group:
+            message.attempts += 1
+        start = perf_counter()
+        try:
+            app.send_task(task, kwargs=kwargs, retry=False)
+        except OperationalError:
+            # Broker is unavailable, the rest stays for the next run
+            break
+        TASK_PUBLISH.labels(task).observe(perf_counter() - start)
+
+        now = datetime.now()
+        for message in group:
+            OUTBOX_LAG.observe((now - message.created_at).total_seconds())
+        dispatched.extend(group)
+
+    # Published messages are not kept, the table only holds pending ones
+    if dispatched:
+        await session.execute(
+            delete(OutboxMessage).where(
+                OutboxMessage.id.in_([message.id for message in dispatched])  # type: ignore
+            )
+        )
+    await session.commit()
+    return len(dispatched)
+
+
+async def _dispatch_outbox(batch_size: int) -> int:
+    async with AsyncSession(outbox_engine, expire_on_commit=False) as session:
+        total = 0
+        while True:
+            dispatched = await dispatch_outbox_batch(session, batch_size)
+            total += dispatched
+            if dispatched < batch_size:
+                return total
+
+
+@app.task
+def dispatch_outbox():
+    return async_to_sync(_dispatch_outbox)(worker_settings.OUTBOX_BATCH_SIZE)
+
+
+async def _dispatch_webhooks(batch_size: int) -> int:
+    async with AsyncSession(outbox_engine, expire_on_commit=False) as session:
+        return await webhook_dispatcher.dispatch(session, batch_size)
+
+
+@app.task
+def dispatch_webhooks():
+    return webhook_loop.run(_dispatch_webhooks(worker_settings.WEBHOOK_BATCH_SIZE))
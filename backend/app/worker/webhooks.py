@@ -0,0 +1,318 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import math
+import random
+import socket
+from datetime import datetime, timedelta
+from hashlib import sha256
+from time import time
+from typing import Iterable, Sequence
+
+import httpcore
+import httpx
+from sqlalchemy import case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlmodel import delete, exists, select, update
+
+from app.database.models import Webhook, WebhookDelivery
+
+TIMESTAMP_HEADER = "X-FastShip-Timestamp"
+SIGNATURE_HEADER = "X-FastShip-Signature"
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """Hex HMAC-SHA256 of `timestamp.body` with the webhook's secret,
+    receivers should also reject old timestamps to stop replays"""
+    message = f"{timestamp}.".encode() + body
+    return hmac.new(secret.encode(), message, sha256).hexdigest()
+
+
+def is_public_address(address: str) -> bool:
+    """Whether the ip address is on the internet, rather than loopback,
+    link-local like cloud metadata, private or otherwise reserved"""
+    ip = ipaddress.ip_address(address)
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class PublicNetworkBackend(httpcore.AsyncNetworkBackend):
+    """Connects only to public addresses. The host is resolved here and
+    the checked address is the one connected to, so a hostname cannot be
+    pointed at internal services, not even after it was checked. TLS is
+    still verified against the hostname"""
+
+    def __init__(self):
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+        socket_options: Iterable | None = None,
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+        except OSError as error:
+            raise httpcore.ConnectError(str(error))
+
+        resolved = [address[4][0] for address in addresses]
+        blocked = [address for address in resolved if not is_public_address(address)]
+        if not resolved or blocked:
+            raise httpcore.ConnectError(f"{host} resolves to a non-public address")
+
+        return await self._backend.connect_tcp(
+            resolved[0], port, timeout, local_address, socket_options
+        )
+
+    async def connect_unix_socket(self, path: str, timeout=None, socket_options=None):
+        raise httpcore.ConnectError("Unix sockets are not allowed")
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+class PublicTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, limits: httpx.Limits):
+        super().__init__(limits=limits, trust_env=False)
+        # Same pool as httpx builds, connecting through the checked backend
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(trust_env=False),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=PublicNetworkBackend(),
+        )
+
+
+class WebhookDispatcher:
+    """Posts due deliveries to their webhooks in signed batches over a pool
+    of HTTP connections, failures are retried with exponential backoff.
+    Only public addresses are posted to unless allow_private is set"""
+
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: float,
+        events_per_post: int,
+        max_attempts: int,
+        retry_delay: float,
+        retry_max_delay: float,
+        allow_private: bool = False,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.events_per_post = events_per_post
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.allow_private = allow_private
+        self._client: httpx.AsyncClient | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily, the pool belongs to the loop it is first used on
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            )
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=limits,
+                transport=None if self.allow_private else PublicTransport(limits),
+                trust_env=False,
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    def backoff(self, attempts: int) -> timedelta:
+        # Jittered so endpoints recovering from an outage are not retried
+        # all at once
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.retry_max_delay)
+        return timedelta(seconds=random.uniform(delay / 2, delay))
+
+    async def post(self, webhook: Webhook, events: list[dict]) -> str | None:
+        """Error of a failed post, None once delivered"""
+        client = self.client
+        body = json.dumps({"events": events}).encode()
+        timestamp = int(time())
+
+        async with self._slots:  # type: ignore
+            try:
+                # Bounds the whole post, which the lease of its deliveries
+                # is sized by
+                async with asyncio.timeout(self.timeout):
+                    response = await client.post(
+                        webhook.url,
+                        content=body,
+                        headers={
+                            "Content-Type": "application/json",
+                            TIMESTAMP_HEADER: str(timestamp),
+                            SIGNATURE_HEADER: f"sha256={sign(webhook.secret, timestamp, body)}",
+                        },
+                    )
+            except (httpx.HTTPError, TimeoutError) as error:
+                return f"{type(error).__name__}: {error}"[:500]
+
+        if response.is_success:
+            return None
+        return f"HTTP {response.status_code}"
+
+    async def _deliver(
+        self, webhook: Webhook, deliveries: Sequence[WebhookDelivery]
+    ) -> tuple[list[WebhookDelivery], list[WebhookDelivery], str | None]:
+        """Delivered and failed deliveries and the error. Batches to one
+        webhook go in order, the rest waits when one fails"""
+        delivered: list[WebhookDelivery] = []
+        for start in range(0, len(deliveries), self.events_per_post):
+            batch = deliveries[start : start + self.events_per_post]
+            error = await self.post(webhook, [delivery.payload for delivery in batch])
+            if error is not None:
+                return delivered, list(deliveries[start:]), error
+            delivered.extend(batch)
+        return delivered, [], None
+
+    async def dispatch_batch(self, session: AsyncSession, batch_size: int) -> int:
+        """Post up to batch_size due deliveries, returns how many were due.
+        They are leased in one short transaction, posted, and the results
+        recorded in another, no transaction stays open while posting"""
+        groups = await self._claim(session, batch_size)
+
+        results = await asyncio.gather(
+            *(self._deliver(webhook, group) for webhook, group in groups)
+        )
+
+        await self._record(session, results)
+        return sum(len(group) for _, group in groups)
+
+    async def _claim(
+        self, session: AsyncSession, batch_size: int
+    ) -> list[tuple[Webhook, list[WebhookDelivery]]]:
+        now = datetime.now()
+        # Posts to one webhook go in order, so nothing is due while an
+        # earlier delivery waits for a retry or is leased by a dispatcher
+        earlier = aliased(WebhookDelivery)
+        waiting = exists().where(
+            earlier.webhook_id == WebhookDelivery.webhook_id,
+            earlier.dead_at == None,  # noqa: E711
+            earlier.created_at < WebhookDelivery.created_at,  # type: ignore
+            earlier.next_attempt_at > now,
+        )
+        # Locking the webhook row keeps two dispatchers from claiming
+        # deliveries of one webhook at once, without blocking inserts
+        rows = (
+            await session.execute(
+                select(WebhookDelivery, Webhook)
+                .join(Webhook, WebhookDelivery.webhook_id == Webhook.id)  # type: ignore
+                .where(
+                    WebhookDelivery.dead_at == None,  # noqa: E711
+                    WebhookDelivery.next_attempt_at <= now,
+                    ~waiting,
+                )
+                .order_by(WebhookDelivery.created_at)  # type: ignore
+                .limit(batch_size)
+                .with_for_update(
+                    of=[WebhookDelivery, Webhook],  # type: ignore
+                    skip_locked=True,
+                    key_share=True,
+                )
+            )
+        ).all()
+
+        webhooks: dict = {}
+        for delivery, webhook in rows:
+            webhooks.setdefault(webhook.id, (webhook, []))[1].append(delivery)
+
+        # Each post takes at most the timeout, so every post of the run one
+        # after the other bounds how long the run can take
+        posts = sum(
+            math.ceil(len(group) / self.events_per_post)
+            for _, group in webhooks.values()
+        )
+        if rows:
+            await session.execute(
+                update(WebhookDelivery)
+                .where(WebhookDelivery.id.in_([d.id for d, _ in rows]))  # type: ignore
+                .values(
+                    next_attempt_at=now + timedelta(seconds=self.timeout * (posts + 1))
+                )
+                .execution_options(synchronize_session=False)
+            )
+        # Detached, the commit does not expire what is about to be posted
+        session.expunge_all()
+        await session.commit()
+
+        return list(webhooks.values())
+
+    async def _record(
+        self,
+        session: AsyncSession,
+        results: Sequence[
+            tuple[list[WebhookDelivery], list[WebhookDelivery], str | None]
+        ],
+    ):
+        # Statements rather than the claimed objects, a webhook may have
+        # been deleted with its deliveries while posting
+        delivered = []
+        now = datetime.now()
+        for done, failed, error in results:
+            delivered.extend(delivery.id for delivery in done)
+            if not failed:
+                continue
+
+            # Only the batch that was posted used an attempt
+            attempted = failed[: self.events_per_post]
+            attempts = max(delivery.attempts for delivery in attempted) + 1
+            retry_at = now + self.backoff(attempts)
+            await session.execute(
+                update(WebhookDelivery)
+                .where(WebhookDelivery.id.in_([d.id for d in attempted]))  # type: ignore
+                .values(
+                    attempts=WebhookDelivery.attempts + 1,
+                    last_error=error,
+                    next_attempt_at=retry_at,
+                    dead_at=case(
+                        (WebhookDelivery.attempts + 1 >= self.max_attempts, now),
+                        else_=None,
+                    ),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            rest = failed[self.events_per_post :]
+            if rest:
+                await session.execute(
+                    update(WebhookDelivery)
+                    .where(WebhookDelivery.id.in_([d.id for d in rest]))  # type: ignore
+                    .values(next_attempt_at=retry_at)
+                    .execution_options(synchronize_session=False)
+                )
+
+        if delivered:
+            await session.execute(
+                delete(WebhookDelivery)
+                .where(WebhookDelivery.id.in_(delivered))  # type: ignore
+                .execution_options(synchronize_session=False)
+            )
+        await session.commit()
+
+    async def dispatch(self, session: AsyncSession, batch_size: int) -> int:
+        total = 0
+        while True:
+            due = await self.dispatch_batch(session, batch_size)
+            total += due
+            if due < batch_size:
+                return total
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,141 @@
+"""Latency of other endpoints while the api is flooded with logins
+
+Runs the app in process on an in-memory SQLite database. A probe client
+keeps requesting GET /seller/me while concurrent clients log in. It does
+this with bcrypt on the password thread pool, then with bcrypt run inline
+on the event loop as before. Needs Redis from .env for the token checks.
+
+    cd backend && python -m benchmarks.login_storm --logins 20 --duration 5
+"""
+
+import argparse
+import asyncio
+from statistics import quantiles
+from time import perf_counter
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+
+from app.core.security import passwords
+from app.database.models import Seller
+from app.database.session import get_read_session, get_session
+from app.main import app
+
+SELLER = {
+    "name": "Storm",
+    "email": "storm@example.com",
+    "zip_code": 11001,
+}
+PASSWORD = "thunder"
+
+
+async def setup() -> AsyncClient:
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def session_override():
+        async with sessions() as session:
+            yield session
+
+    app.dependency_overrides[get_session] = session_override
+    app.dependency_overrides[get_read_session] = session_override
+
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    async with sessions() as session:
+        session.add(
+            Seller(
+                **SELLER,
+                email_verified=True,
+                password_hash=passwords.context.hash(PASSWORD),
+            )
+        )
+        await session.commit()
+
+    return AsyncClient(transport=ASGITransport(app), base_url="http://bench")
+
+
+async def login(client: AsyncClient) -> str | None:
+    """Access token, None when the login was shed with a 503"""
+    response = await client.post(
+        "/seller/token",
+        data={
+            "grant_type": "password",
+            "username": SELLER["email"],
+            "password": PASSWORD,
+        },
+    )
+    if response.status_code == 503:
+        return None
+    assert response.status_code == 200, response.text
+    return response.json()["access_token"]
+
+
+async def storm(client: AsyncClient, logins: int, duration: float):
+    """Probe latencies and completed logins while `logins` clients log in"""
+    headers = {"Authorization": f"Bearer {await login(client)}"}
+    deadline = perf_counter() + duration
+    latencies: list[float] = []
+    completed = shed = 0
+
+    async def log_in_repeatedly():
+        nonlocal completed, shed
+        while perf_counter() < deadline:
+            if await login(client):
+                completed += 1
+            else:
+                shed += 1
+
+    async def probe():
+        while perf_counter() < deadline:
+            start = perf_counter()
+            response = await client.get("/seller/me", headers=headers)
+            latencies.append(perf_counter() - start)
+            assert response.status_code == 200
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(probe(), *(log_in_repeatedly() for _ in range(logins)))
+    return latencies, completed, shed
+
+
+def report(
+    name: str, latencies: list[float], completed: int, shed: int, duration: float
+):
+    # A blocked loop may leave a single probe
+    cuts = quantiles(latencies * 2, n=100, method="inclusive")
+    p50, p99, worst = cuts[49] * 1000, cuts[98] * 1000, max(latencies) * 1000
+    print(
+        f"{name:<10} probe p50 {p50:>8.1f}ms  p99 {p99:>8.1f}ms  max {worst:>8.1f}ms"
+        f"  probes {len(latencies):>4}  logins {completed / duration:>5.1f}/s"
+        f"  shed {shed}"
+    )
+
+
+async def inline(fn, *args):
+    # Before the pool, bcrypt ran on the event loop
+    return fn(*args)
+
+
+async def run(args):
+    client = await setup()
+    async with client:
+        report("idle", *await storm(client, 0, args.duration), args.duration)
+        report(
+            "pooled", *await storm(client, args.logins, args.duration), args.duration
+        )
+        passwords._run = inline  # type: ignore
+        report(
+            "inline", *await storm(client, args.logins, args.duration), args.duration
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Email delivery throughput against a local aiosmtpd server
+
+Compares the per-task path, a fresh event loop and SMTP connection per
+message, with the pooled mailer sending batches on one long-lived loop.
+
+    cd backend && python -m benchmarks.smtp_delivery --messages 500
+"""
+
+import argparse
+import asyncio
+import socket
+from time import perf_counter
+
+from aiosmtpd.controller import Controller
+from asgiref.sync import async_to_sync
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+
+from app.config import notification_settings, worker_settings
+from app.utils import TEMPLATE_DIR
+from app.worker.mailer import EventLoopThread, Mailer
+
+
+class CountingHandler:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        # Stands in for the time a real relay takes to accept a message
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def emails(count: int) -> list[dict]:
+    return [
+        {
+            "recipients": [f"client{i}@example.com"],
+            "subject": "Your order is out for delivery",
+            "context": {"id": i, "seller": "Seller", "partner": "Partner"},
+            "template_name": "mail_out_for_delivery.html",
+        }
+        for i in range(count)
+    ]
+
+
+def per_task(config: ConnectionConfig, count: int):
+    # What each send_email_with_template task did before pooling
+    send_message = async_to_sync(FastMail(config).send_message)
+    for email in emails(count):
+        send_message(
+            MessageSchema(
+                recipients=email["recipients"],
+                subject=email["subject"],
+                template_body=email["context"],
+                subtype=MessageType.html,
+            ),
+            template_name=email["template_name"],
+        )
+
+
+def pooled(config: ConnectionConfig, count: int, pool_size: int, batch_size: int):
+    mailer = Mailer(config, pool_size)
+    loop = EventLoopThread()
+    pending = emails(count)
+    for start in range(0, count, batch_size):
+        failed = loop.run(mailer.send_batch(pending[start : start + batch_size]))
+        assert not failed, f"{len(failed)} emails failed"
+    loop.run(mailer.pool.close())
+
+
+def measure(name: str, handler: CountingHandler, run) -> float:
+    handler.received = 0
+    start = perf_counter()
+    run()
+    elapsed = perf_counter() - start
+    rate = handler.received / elapsed
+    print(f"{name:<10} {handler.received:>6} messages {elapsed:>8.2f}s {rate:>9.1f}/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=worker_settings.SMTP_POOL_SIZE)
+    parser.add_argument(
+        "--batch-size", type=int, default=worker_settings.MAIL_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="seconds per DATA command"
+    )
+    args = parser.parse_args()
+
+    port = free_port()
+    handler = CountingHandler(args.latency)
+    server = Controller(handler, hostname="127.0.0.1", port=port)
+    server.start()
+
+    config = ConnectionConfig(
+        **notification_settings.model_dump(
+            exclude={
+                "MAIL_PORT",
+                "MAIL_SERVER",
+                "MAIL_STARTTLS",
+                "MAIL_SSL_TLS",
+                "USE_CREDENTIALS",
+            }
+        ),
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=port,
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=False,
+        TEMPLATE_FOLDER=TEMPLATE_DIR,
+    )
+
+    try:
+        before = measure("per-task", handler, lambda: per_task(config, args.messages))
+        after = measure(
+            "pooled",
+            handler,
+            lambda: pooled(config, args.messages, args.pool_size, args.batch_size),
+        )
+    finally:
+        server.stop()
+
+    print(f"speedup    {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Token blacklist lookups and memory with millions of revoked tokens
+
+Fills the blacklist configured in .env with revoked tokens expiring over
+one token lifetime, times is_jti_blacklisted for revoked and unknown
+tokens, then removes what it added. Expiries are a century out so the
+buckets never overlap real ones, still, run it against a scratch Redis.
+
+    cd backend && python -m benchmarks.token_blacklist --tokens 10000000
+    cd backend && python -m benchmarks.token_blacklist --encoding legacy
+"""
+
+import argparse
+import asyncio
+import random
+from statistics import quantiles
+from time import perf_counter, time
+from uuid import uuid4
+
+from redis.exceptions import ResponseError
+
+from app.database.redis import (
+    _redis,
+    blacklist_bucket,
+    blacklist_key,
+    is_jti_blacklisted,
+)
+from app.utils import ACCESS_TOKEN_EXPIRY
+
+CENTURY = 100 * 365 * 24 * 3600
+CHUNK = 10_000
+
+
+async def used_memory() -> int | None:
+    # Not every Redis compatible server implements INFO
+    try:
+        return (await _redis.info("memory"))["used_memory"]
+    except ResponseError:
+        return None
+
+
+async def populate(count: int, encoding: str, sample: int) -> tuple[list, set]:
+    """Revoke `count` tokens, returns a sample of them and the keys written"""
+    start = int(time()) + CENTURY
+    lifetime = int(ACCESS_TOKEN_EXPIRY.total_seconds())
+    revoked, keys = [], set()
+
+    for offset in range(0, count, CHUNK):
+        tokens = [
+            (uuid4(), start + random.randrange(lifetime))
+            for _ in range(min(CHUNK, count - offset))
+        ]
+        async with _redis.pipeline(transaction=False) as pipe:
+            if encoding == "bucketed":
+                buckets: dict[str, dict] = {}
+                for jti, exp in tokens:
+                    buckets.setdefault(blacklist_key(blacklist_bucket(exp)), {})[
+                        jti.bytes
+                    ] = exp
+                for key, members in buckets.items():
+                    pipe.zadd(key, members)
+                keys.update(buckets)
+            else:
+                for jti, _ in tokens:
+                    pipe.set(str(jti), "blacklisted")
+                    keys.add(str(jti))
+            await pipe.execute()
+
+        if len(revoked) < sample:
+            revoked.extend((str(jti), exp) for jti, exp in tokens[: sample // 10 + 1])
+
+    return revoked[:sample], keys
+
+
+async def cleanup(keys: set):
+    keys = list(keys)
+    for offset in range(0, len(keys), CHUNK):
+        await _redis.delete(*keys[offset : offset + CHUNK])
+
+
+async def lookups(tokens: list, expected: bool) -> list[float]:
+    timings = []
+    for jti, exp in tokens:
+        start = perf_counter()
+        assert await is_jti_blacklisted(jti, exp) is expected
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def summary(name: str, timings: list[float]):
+    p50, p99 = (quantiles(timings, n=100)[i] * 1000 for i in (49, 98))
+    rate = len(timings) / sum(timings)
+    print(f"{name:<16} p50 {p50:>7.3f}ms  p99 {p99:>7.3f}ms {rate:>10.0f}/s")
+
+
+async def run(args):
+    before = await used_memory()
+    start = perf_counter()
+    revoked, keys = await populate(args.tokens, args.encoding, args.lookups)
+    elapsed = perf_counter() - start
+    after = await used_memory()
+
+    print(f"{args.encoding} blacklist, {args.tokens} revoked tokens")
+    print(f"{'populate':<16} {elapsed:.1f}s, {len(keys)} keys")
+    if before is None or after is None:
+        print(f"{'memory':<16} unavailable")
+    else:
+        memory = after - before
+        print(
+            f"{'memory':<16} {memory / 2**20:.1f} MiB, "
+            f"{memory / args.tokens:.0f} B/token"
+        )
+
+    try:
+        summary("revoked lookup", await lookups(revoked, True))
+        unknown = [(str(uuid4()), exp) for _, exp in revoked]
+        summary("unknown lookup", await lookups(unknown, False))
+    finally:
+        await cleanup(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument(
+        "--encoding",
+        choices=["bucketed", "legacy"],
+        default="bucketed",
+        help="legacy is one plain key per token, as stored before buckets",
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
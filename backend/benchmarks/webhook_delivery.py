@@ -0,0 +1,117 @@
+"""Webhook events delivered per second, one event per POST against batches
+
+Runs the dispatcher on an in-memory SQLite database and posts to a stand-in
+receiver in a thread of this process, so both share one CPU and the rates
+are a lower bound. Each run queues --events across --webhooks endpoints.
+
+    cd backend && python -m benchmarks.webhook_delivery --events 5000
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import perf_counter
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlmodel import SQLModel, insert
+
+from app.database.models import Seller, Webhook, WebhookDelivery
+from app.worker.webhooks import WebhookDispatcher
+
+
+class Receiver(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    posts = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        Receiver.posts += 1
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+async def queue_events(session: AsyncSession, webhooks: list[Webhook], events: int):
+    now = datetime.now()
+    await session.execute(
+        insert(WebhookDelivery),
+        [
+            {
+                "webhook_id": webhooks[i % len(webhooks)].id,
+                "payload": {"id": str(uuid4()), "status": "in_transit"},
+                "next_attempt_at": now,
+            }
+            for i in range(events)
+        ],
+    )
+    await session.commit()
+
+
+async def run(args):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Receiver)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        seller = Seller(name="Bench", email="bench@example.com", password_hash="")
+        session.add(seller)
+        await session.flush()
+        webhooks = [
+            Webhook(
+                url=f"http://127.0.0.1:{server.server_port}/{i}",
+                secret="bench",
+                seller_id=seller.id,
+            )
+            for i in range(args.webhooks)
+        ]
+        session.add_all(webhooks)
+        await session.commit()
+
+        for events_per_post in (1, args.events_per_post):
+            dispatcher = WebhookDispatcher(
+                concurrency=args.concurrency,
+                timeout=10,
+                events_per_post=events_per_post,
+                max_attempts=1,
+                retry_delay=1,
+                retry_max_delay=1,
+                allow_private=True,
+            )
+            await queue_events(session, webhooks, args.events)
+            Receiver.posts = 0
+
+            start = perf_counter()
+            delivered = await dispatcher.dispatch(session, args.batch_size)
+            elapsed = perf_counter() - start
+            await dispatcher.close()
+
+            print(
+                f"{events_per_post:>4} per post  {delivered / elapsed:>8.0f} events/s"
+                f"  {Receiver.posts:>6} posts  {elapsed:.2f}s"
+            )
+
+    server.shutdown()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--webhooks", type=int, default=20)
+    parser.add_argument("--events-per-post", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
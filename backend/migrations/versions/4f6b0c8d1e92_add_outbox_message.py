@@ -0,0 +1,49 @@
+"""add outbox message
+
+Revision ID: 4f6b0c8d1e92
+Revises: 7d2c91e4a5f8
+Create Date: 2026-10-18 12:21:05.640218
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '4f6b0c8d1e92'
+down_revision: Union[str, Sequence[str], None] = '7d2c91e4a5f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('outbox_message',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('task', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('dispatched_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_outbox_message_pending',
+        'outbox_message',
+        ['created_at'],
+        unique=False,
+        postgresql_where=sa.text('dispatched_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        'ix_outbox_message_pending',
+        table_name='outbox_message',
+        postgresql_where=sa.text('dispatched_at IS NULL'),
+    )
+    op.drop_table('outbox_message')
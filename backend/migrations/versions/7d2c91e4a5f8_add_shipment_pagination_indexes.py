@@ -0,0 +1,44 @@
+"""add shipment pagination indexes
+
+Revision ID: 7d2c91e4a5f8
+Revises: e8a3f0b5c217
+Create Date: 2026-10-18 10:48:27.913504
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2c91e4a5f8'
+down_revision: Union[str, Sequence[str], None] = 'e8a3f0b5c217'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_shipment_seller_created_at',
+            'shipment',
+            ['seller_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_shipment_delivery_partner_created_at',
+            'shipment',
+            ['delivery_partner_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shipment_delivery_partner_created_at', table_name='shipment')
+    op.drop_index('ix_shipment_seller_created_at', table_name='shipment')
@@ -0,0 +1,36 @@
+"""add shipment_tag tag index
+
+Revision ID: 9b3e5d7a1c40
+Revises: 4f6b0c8d1e92
+Create Date: 2026-10-18 14:12:05.418236
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e5d7a1c40'
+down_revision: Union[str, Sequence[str], None] = '4f6b0c8d1e92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_shipment_tag_tag_id_shipment_id',
+            'shipment_tag',
+            ['tag_id', 'shipment_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shipment_tag_tag_id_shipment_id', table_name='shipment_tag')
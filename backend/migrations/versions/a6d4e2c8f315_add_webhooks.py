@@ -0,0 +1,66 @@
+"""add webhooks
+
+Revision ID: a6d4e2c8f315
+Revises: 9b3e5d7a1c40
+Create Date: 2026-10-18 14:02:37.118406
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d4e2c8f315'
+down_revision: Union[str, Sequence[str], None] = '9b3e5d7a1c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('webhook',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('url', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('secret', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('seller_id', sa.Uuid(), nullable=False),
+    sa.ForeignKeyConstraint(['seller_id'], ['seller.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_webhook_seller_id'), 'webhook', ['seller_id'], unique=False)
+    op.create_table('webhook_delivery',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('webhook_id', sa.Uuid(), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('dead_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['webhook_id'], ['webhook.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_webhook_delivery_webhook_id'), 'webhook_delivery', ['webhook_id'], unique=False)
+    op.create_index(
+        'ix_webhook_delivery_pending',
+        'webhook_delivery',
+        ['next_attempt_at'],
+        unique=False,
+        postgresql_where=sa.text('dead_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        'ix_webhook_delivery_pending',
+        table_name='webhook_delivery',
+        postgresql_where=sa.text('dead_at IS NULL'),
+    )
+    op.drop_index(op.f('ix_webhook_delivery_webhook_id'), table_name='webhook_delivery')
+    op.drop_table('webhook_delivery')
+    op.drop_index(op.f('ix_webhook_seller_id'), table_name='webhook')
+    op.drop_table('webhook')
@@ -0,0 +1,65 @@
+"""add partner active shipment count
+
+Revision ID: c41e7d2a9b63
+Revises: 58a4532d04fc
+Create Date: 2026-10-18 09:12:40.118342
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e7d2a9b63'
+down_revision: Union[str, Sequence[str], None] = '58a4532d04fc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'delivery_partner',
+        sa.Column('active_shipment_count', sa.Integer(), server_default='0', nullable=False),
+    )
+    op.create_index(
+        op.f('ix_serviceable_location_location_id'),
+        'serviceable_location',
+        ['location_id'],
+        unique=False,
+    )
+    # Count shipments whose latest event is not final
+    op.execute(
+        sa.text(
+            """
+            UPDATE delivery_partner AS partner
+            SET active_shipment_count = active.total
+            FROM (
+                SELECT shipment.delivery_partner_id, count(*) AS total
+                FROM shipment
+                LEFT JOIN LATERAL (
+                    SELECT shipment_event.status
+                    FROM shipment_event
+                    WHERE shipment_event.shipment_id = shipment.id
+                    ORDER BY shipment_event.created_at DESC
+                    LIMIT 1
+                ) AS last_event ON true
+                WHERE last_event.status IS NULL
+                    OR last_event.status NOT IN ('delivered', 'cancelled')
+                GROUP BY shipment.delivery_partner_id
+            ) AS active
+            WHERE active.delivery_partner_id = partner.id
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        op.f('ix_serviceable_location_location_id'), table_name='serviceable_location'
+    )
+    op.drop_column('delivery_partner', 'active_shipment_count')
@@ -0,0 +1,41 @@
+"""add webhook_delivery webhook next attempt index
+
+Revision ID: d3f1a7b9c502
+Revises: a6d4e2c8f315
+Create Date: 2026-10-18 16:41:12.507318
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f1a7b9c502'
+down_revision: Union[str, Sequence[str], None] = 'a6d4e2c8f315'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_webhook_delivery_webhook_id_next_attempt_at',
+            'webhook_delivery',
+            ['webhook_id', 'next_attempt_at'],
+            unique=False,
+            postgresql_where=sa.text('dead_at IS NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        'ix_webhook_delivery_webhook_id_next_attempt_at',
+        table_name='webhook_delivery',
+        postgresql_where=sa.text('dead_at IS NULL'),
+    )
@@ -0,0 +1,53 @@
+"""drop outbox message dispatched_at
+
+Revision ID: e5b2c9d4f718
+Revises: d3f1a7b9c502
+Create Date: 2026-10-18 19:42:11.305127
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b2c9d4f718'
+down_revision: Union[str, Sequence[str], None] = 'd3f1a7b9c502'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_outbox_message_created_at',
+            'outbox_message',
+            ['created_at'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+    op.drop_index(
+        'ix_outbox_message_pending',
+        table_name='outbox_message',
+        postgresql_where=sa.text('dispatched_at IS NULL'),
+    )
+    op.drop_column('outbox_message', 'dispatched_at')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column(
+        'outbox_message',
+        sa.Column('dispatched_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index(
+        'ix_outbox_message_pending',
+        'outbox_message',
+        ['created_at'],
+        unique=False,
+        postgresql_where=sa.text('dispatched_at IS NULL'),
+    )
+    op.drop_index('ix_outbox_message_created_at', table_name='outbox_message')
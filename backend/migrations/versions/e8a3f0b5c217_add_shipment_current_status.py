@@ -0,0 +1,87 @@
+"""add shipment current status
+
+Revision ID: e8a3f0b5c217
+Revises: c41e7d2a9b63
+Create Date: 2026-10-18 10:03:11.402957
+
+"""
+from typing import Sequence, Union
+
+import sqlmodel
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a3f0b5c217'
+down_revision: Union[str, Sequence[str], None] = 'c41e7d2a9b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _backfill_current_status() -> None:
+    connection = op.get_bind()
+
+    select_batch = sa.text(
+        "SELECT id FROM shipment WHERE id > :last_id ORDER BY id LIMIT :limit"
+    )
+    update_batch = sa.text(
+        """
+        UPDATE shipment
+        SET current_status = last_event.status,
+            current_location = last_event.location
+        FROM (
+            SELECT DISTINCT ON (shipment_id) shipment_id, status, location
+            FROM shipment_event
+            WHERE shipment_id IN :ids
+            ORDER BY shipment_id, created_at DESC
+        ) AS last_event
+        WHERE shipment.id = last_event.shipment_id
+        """
+    ).bindparams(sa.bindparam("ids", expanding=True))
+
+    # Walk the table by primary key so each update stays small
+    last_id = "00000000-0000-0000-0000-000000000000"
+    while True:
+        ids = connection.execute(
+            select_batch, {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}
+        ).scalars().all()
+
+        if not ids:
+            break
+
+        connection.execute(update_batch, {"ids": list(ids)})
+        last_id = ids[-1]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'shipment',
+        sa.Column(
+            'current_status',
+            postgresql.ENUM(name='shipmentstatus', create_type=False),
+            nullable=True,
+        ),
+    )
+    op.add_column('shipment', sa.Column('current_location', sa.Integer(), nullable=True))
+
+    _backfill_current_status()
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_shipment_current_status'),
+            'shipment',
+            ['current_status'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_shipment_current_status'), table_name='shipment')
+    op.drop_column('shipment', 'current_location')
+    op.drop_column('shipment', 'current_status')